@@ -3,22 +3,39 @@
 """
 Advanced Discord Auto Message Bot with Flask Web UI
 """
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context, send_from_directory, g
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-import http.client, json, time, os, sys, random, logging, threading
+import json, time, os, sys, random, logging, threading, hmac, fnmatch, functools
 from logging.handlers import RotatingFileHandler
 from datetime import datetime, timedelta
-from collections import deque
-from croniter import croniter
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.security import generate_password_hash, check_password_hash
-import psycopg2
-from psycopg2.extras import DictCursor
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
-from urllib.parse import urljoin
+from urllib.parse import unquote
+from scheduler import Scheduler, CronSchedule
+import discord_client
+from ratelimit import RateLimited, limiter as rate_limiter
+from circuit import CircuitOpen, breaker as circuit_breaker, suspension_reason
+from batch_writer import BatchWriter
+from events import EventBus
+from cache import TTLCache
+from pubsub import PgNotifier, LocalNotifier
+from storage import open_storage, postgres_config
+from uploads import UploadManager, LocalDiskBackend, open_backend
+from payloads import AttachmentCache, CompiledProfile
+from control import ControlPlane
+from logbuffer import LogRing, start_queue_logging
+from janitor import Janitor
+from dispatch import Dispatcher
+from outbox import OutboxWorker
+import metrics
+import sender
 
 # --- INISIALISASI & KONFIGURASI ---
+# Under gunicorn, post_fork records when this worker was forked so the boot report covers imports too.
+BOOT_STARTED = float(os.environ.get('WORKER_FORKED_AT') or time.time())
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'fallback-secret-key-yang-aman')
 app.config['UPLOAD_FOLDER'] = os.path.join(os.environ.get('RENDER_DATA_DIR', os.path.dirname(os.path.abspath(__file__))), 'temp_uploads')
@@ -32,20 +49,22 @@ cloudinary.config(
     api_secret=os.environ.get('CLOUDINARY_API_SECRET')
 )
 
-# PostgreSQL configuration
-DB_CONFIG = {
-    'dbname': os.environ.get('PG_DBNAME', 'discord_bot'),
-    'user': os.environ.get('PG_USER', 'admin'),
-    'password': os.environ.get('PG_PASSWORD', 'password'),
-    'host': os.environ.get('PG_HOST', 'localhost'),
-    'port': os.environ.get('PG_PORT', '5432')
-}
-
-bot_threads = {}
-stop_events = {}
-bot_status_lock = threading.Lock()
-bot_status = {}
+# PostgreSQL configuration (STORAGE_BACKEND=postgres, the default), from PG_* variables
+DB_CONFIG = postgres_config()
+
+# Each /api/events stream holds one of the worker's GUNICORN_THREADS threads; by default half of them may,
+# so the other routes keep answering however many dashboards are open.
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', int(os.environ.get('GUNICORN_THREADS', 32)) // 2))
+SSE_MAX_STREAMS_PER_USER = int(os.environ.get('SSE_MAX_STREAMS_PER_USER', 4))
+event_bus = EventBus(max_streams=SSE_MAX_STREAMS, max_streams_per_user=SSE_MAX_STREAMS_PER_USER)
+# Due sends queue per user and share DISPATCH_CONCURRENCY send slots fairly (see dispatch.py).
+dispatcher = Dispatcher()
+# Default jitter for profiles that set none, so bots saved with the same interval do not fire together.
+SEND_JITTER = int(os.environ.get('SEND_JITTER', 0))
+scheduler = Scheduler(on_schedule=lambda key, next_run: control.broadcast(key[0], "schedule", {"profile": key[1], "next_run": next_run}),
+                      dispatch=lambda key, action, cost: dispatcher.submit(key[0], action, cost))
 log = None  # Initialized in setup_logger
+log_listener = None
 
 # --- FLASK-LOGIN ---
 login_manager = LoginManager()
@@ -58,262 +77,445 @@ class User(UserMixin):
         self.username = username
         self.password_hash = password_hash
 
-@login_manager.user_loader
-def load_user(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=DictCursor)
-    cur.execute("SELECT id, username, password_hash FROM users WHERE id = %s", (user_id,))
-    user_data = cur.fetchone()
-    cur.close()
-    conn.close()
+def _load_user(user_id):
+    user_data = storage.get_user(user_id)
     if user_data:
-        return User(user_data['id'], user_data['username'], user_data['password_hash'])
+        return User(*user_data)
     return None
 
+@login_manager.user_loader
+def load_user(user_id):
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    with DB_TIME.time("load_user"):
+        return user_cache.get_or_load(user_id, lambda: _load_user(user_id))
+
 # --- DATABASE HELPER FUNCTIONS ---
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+storage = open_storage(DB_CONFIG)
+
+# --- CACHES ---
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 300))
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', 10_000))
+user_cache = TTLCache("users", maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+profile_cache = TTLCache("profiles", maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+# Compiled cron expressions for schedule previews, filled when a profile is saved.
+cron_cache = TTLCache("cron", maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+cron_cache_lock = threading.Lock()
+# Cross-worker messaging needs Postgres; the SQLite backend runs as a single process.
+notifier = PgNotifier(storage.connect, storage.connection) if storage.backend == "postgres" else LocalNotifier()
+
+def _drop_cached_user(user_id):
+    user_cache.invalidate(user_id)
+    profile_cache.invalidate(user_id)
+
+def invalidate_user(user_id):
+    """Drop a user's cached row and profiles here and in every other worker. Call after commit."""
+    _drop_cached_user(user_id)
+    try:
+        notifier.publish("cache_invalidate", {"user_id": user_id})
+    except Exception as e:
+        log.error(f"Failed to broadcast cache invalidation for user {user_id}: {e}")
+
+def _clear_caches():
+    user_cache.clear()
+    profile_cache.clear()
+
+notifier.subscribe("cache_invalidate", lambda payload: _drop_cached_user(payload["user_id"]))
+notifier.on_reconnect(_clear_caches)
+
+# Recent bot log lines per user, kept in memory (see logbuffer.py). LOG_PERSIST=0 stops writing them to the logs table.
+LOG_PERSIST = os.environ.get('LOG_PERSIST', '1') != '0'
+log_ring = LogRing(max_users=CACHE_SIZE, load=storage.recent_logs if LOG_PERSIST else None)
+
+def handle_event(user_id, event_type, data):
+    # Every bot event, from this worker or another, passes through here.
+    if event_type == "log":
+        log_ring.append(user_id, data["line"])
+    elif event_type == "logs_cleared":
+        log_ring.clear(user_id)
+    event_bus.publish(user_id, event_type, data)
+
+# Bot status and start/stop shared across gunicorn workers, keyed by (user_id, profile_name).
+control = ControlPlane(storage, notifier,
+                       on_stop=lambda user_id, profile_name: unschedule(user_id, profile_name),
+                       on_event=handle_event)
+
+# Attachments: spooled to UPLOAD_FOLDER, deduplicated by SHA-256, pushed to UPLOAD_BACKEND in the background.
+UPLOAD_DIR = os.path.join(os.environ.get('RENDER_DATA_DIR', os.path.dirname(os.path.abspath(__file__))), 'uploads')
+upload_manager = UploadManager(storage, open_backend(UPLOAD_DIR), app.config['UPLOAD_FOLDER'])
+attachment_cache = AttachmentCache(resolve_local=getattr(upload_manager.backend, "path_for", None))
+# Bulk stops finish here, after the response has been sent.
+bulk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk")
+
+# --- METRICS ---
+# Served at /metrics in Prometheus text format, merged across gunicorn workers (see metrics.py).
+metrics_exporter = metrics.MultiProcessExporter()
+SCHEDULE_LAG = metrics.histogram("discordbot_schedule_lag_seconds", "How late scheduled sends start.", buckets=metrics.LAG_BUCKETS)
+DB_TIME = metrics.histogram("discordbot_db_seconds", "Time spent in database helpers.", ["helper"])
+REQUEST_TIME = metrics.histogram("discordbot_http_request_seconds", "Web request duration by route.", ["route", "method", "status"])
+SSE_CLIENTS = metrics.gauge("discordbot_sse_clients", "Open /api/events streams.")
+
+def _db_connections():
+    stats = storage.stats()
+    if storage.backend == "postgres":
+        return {("in_use",): stats["in_use"], ("idle",): stats["idle"]}
+    return {("opened",): stats["connections"]}
+
+metrics.callback("discordbot_threads", "Live threads.", threading.active_count)
+metrics.callback("discordbot_scheduled_profiles", "Profiles scheduled in this worker.", lambda: len(scheduler))
+metrics.callback("discordbot_dispatch_queue", "Due sends waiting for a send slot.", lambda: dispatcher.stats()["queued"])
+metrics.callback("discordbot_dispatch_in_use", "Send slots in use.", lambda: dispatcher.stats()["in_use"])
+metrics.callback("discordbot_db_connections", "Database connections by state.", _db_connections, labelnames=["state"])
+metrics.callback("discordbot_discord_connections_idle", "Idle keep-alive connections to Discord.",
+                 lambda: discord_client.get_pool().stats()["idle"])
+metrics.callback("discordbot_discord_handshakes_total", "New connections opened to Discord.",
+                 lambda: discord_client.get_pool().stats()["handshakes"], kind="counter")
+metrics.callback("discordbot_circuits_open", "Open or half-open circuits by scope.", circuit_breaker.open_counts,
+                 labelnames=["scope"])
+metrics.callback("discordbot_write_queue", "Rows waiting in the batch writers.",
+                 lambda: {("sends",): send_writer.stats()["queued"], ("logs",): log_writer.stats()["queued"]}, labelnames=["writer"])
 
 def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username VARCHAR(50) UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS profiles (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id),
-            profile_name VARCHAR(100) NOT NULL,
-            token TEXT NOT NULL,
-            channelid TEXT NOT NULL,
-            schedule_mode VARCHAR(20) DEFAULT 'interval',
-            interval_seconds INTEGER DEFAULT 300,
-            cron_expression TEXT,
-            messages JSONB NOT NULL,
-            UNIQUE (user_id, profile_name)
-        );
-        CREATE TABLE IF NOT EXISTS sends (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id),
-            profile_name VARCHAR(100) NOT NULL,
-            timestamp TIMESTAMP NOT NULL,
-            success BOOLEAN NOT NULL
-        );
-    """)
-    conn.commit()
-    cur.close()
-    conn.close()
+    # A no-op once gunicorn's on_starting has applied the migrations.
+    applied = storage.migrate()
+    if applied:
+        log.info(f"Applied schema migrations {applied}.")
 
 # --- LOGGING ---
 def setup_logger():
-    global log
+    # Callers only enqueue records; the file and stdout writes happen on the listener's thread.
+    global log, log_listener
     log = logging.getLogger("discordbot")
     log.setLevel(logging.INFO)
     if log.hasHandlers():
         log.handlers.clear()
+    if log_listener is not None:
+        log_listener.stop()
     log_path = os.path.join(os.environ.get('RENDER_DATA_DIR', os.path.dirname(os.path.abspath(__file__))), 'bot.log')
     fh = RotatingFileHandler(log_path, maxBytes=1_000_000, backupCount=3, encoding="utf-8")
     fmt = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s", "%Y-%m-%d %H:%M:%S")
     fh.setFormatter(fmt)
-    log.addHandler(fh)
     ch = logging.StreamHandler(sys.stdout)
     ch.setFormatter(fmt)
-    log.addHandler(ch)
+    log_listener = start_queue_logging(log, fh, ch)
     return log
 
 # --- DATA MANAGEMENT ---
-def get_all_users():
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=DictCursor)
-    cur.execute("SELECT id, username, password_hash FROM users")
-    users = {str(row['id']): {'username': row['username'], 'password_hash': row['password_hash']} for row in cur.fetchall()}
-    cur.close()
-    conn.close()
-    return users
-
 def get_user_profiles(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=DictCursor)
-    cur.execute("SELECT profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages FROM profiles WHERE user_id = %s", (user_id,))
-    profiles = {row['profile_name']: {
-        'token': row['token'],
-        'channelid': row['channelid'],
-        'schedule_mode': row['schedule_mode'],
-        'interval_seconds': row['interval_seconds'],
-        'cron_expression': row['cron_expression'],
-        'messages': row['messages']
-    } for row in cur.fetchall()}
-    cur.close()
-    conn.close()
-    return profiles
+    return dict(profile_cache.get_or_load(user_id, lambda: storage.load_profiles(user_id)))
 
+@DB_TIME.timed("get_profile_config")
 def get_profile_config(user_id, profile_name="default"):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=DictCursor)
-    cur.execute("SELECT token, channelid, schedule_mode, interval_seconds, cron_expression, messages FROM profiles WHERE user_id = %s AND profile_name = %s", (user_id, profile_name))
-    config = cur.fetchone()
-    cur.close()
-    conn.close()
+    config = profile_cache.get_or_load(user_id, lambda: storage.load_profiles(user_id)).get(profile_name)
     if not config:
         return {
             "token": "", "channelid": "", "schedule_mode": "interval",
-            "interval_seconds": 300, "cron_expression": "",
+            "interval_seconds": 300, "cron_expression": "", "jitter_seconds": 0,
             "messages": [{"type": "text", "content": "Hello World!"}]
         }
     return {
         "token": config['token'], "channelid": config['channelid'],
         "schedule_mode": config['schedule_mode'], "interval_seconds": config['interval_seconds'],
-        "cron_expression": config['cron_expression'], "messages": config['messages']
+        "cron_expression": config['cron_expression'], "jitter_seconds": config['jitter_seconds'], "messages": config['messages']
     }
 
-def log_send(user_id, profile_name, success):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO sends (user_id, profile_name, timestamp, success) VALUES (%s, %s, %s, %s)",
-                (user_id, profile_name, datetime.now(), success))
-    conn.commit()
-    cur.close()
-    conn.close()
+send_writer = BatchWriter("sends", DB_TIME.timed("log_send")(storage.write_sends))
+# Expires old send history and purges the sends of deleted profiles (see janitor.py).
+janitor = Janitor(storage)
+
+log_writer = BatchWriter("logs", DB_TIME.timed("log_event")(storage.write_logs))
+# Send rows, bot log lines and status events for every tick, shared with outbox_worker.py (see sender.py).
+recorder = sender.Recorder(control, send_writer, log_writer, persist_logs=LOG_PERSIST)
+log_send = recorder.log_send
+log_event = recorder.log_event
 
 def get_dashboard_data(user_id):
-    profiles = get_user_profiles(user_id)
-    active_count = sum(1 for profile_name in profiles if bot_status.get(profile_name, {}).get("running", False))
-    stopped_count = len(profiles) - active_count
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=DictCursor)
     today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    cur.execute("SELECT success FROM sends WHERE user_id = %s AND timestamp >= %s", (user_id, today))
-    rows = cur.fetchall()
-    total_sent = len(rows)
-    failed_sent = len([r for r in rows if not r['success']])
-    cur.execute("SELECT message FROM logs WHERE user_id = %s ORDER BY timestamp DESC LIMIT 5", (user_id,))
-    recent_logs = [row['message'] for row in cur.fetchall()]
-    next_schedule, earliest_next_run = "None scheduled", None
-    for profile_name in profiles:
-        if bot_status.get(profile_name, {}).get("running", False):
-            config = get_profile_config(user_id, profile_name)
-            schedule_mode = config.get("schedule_mode", "interval")
-            current_next_run = None
-            if schedule_mode == "interval":
-                interval = config.get("interval_seconds", 300)
-                last_run_str = bot_status.get(profile_name, {}).get("last_run", "-")
-                if last_run_str != "-":
-                    try:
-                        last_run = datetime.strptime(last_run_str, "%H:%M:%S")
-                        current_next_run = datetime.combine(datetime.today(), last_run.time()) + timedelta(seconds=interval)
-                    except ValueError:
-                        pass
-            elif schedule_mode in ["cron_simple", "cron_advanced"]:
-                if cron_expr := config.get("cron_expression"):
-                    try:
-                        current_next_run = croniter(cron_expr, datetime.now()).get_next(datetime)
-                    except Exception:
-                        pass
-            if current_next_run and (earliest_next_run is None or current_next_run < earliest_next_run):
-                earliest_next_run = current_next_run
-                next_schedule = f"'{profile_name}' at {earliest_next_run.strftime('%H:%M:%S')}"
-    cur.close()
-    conn.close()
+    with DB_TIME.time("dashboard"):
+        row = storage.dashboard(user_id, today)
+    running = {name: status for name, status in control.status_for(user_id).items() if status["running"]}
+    next_runs = {name: status["next_run"] for name, status in running.items() if status["next_run"]}
+    active_count = len(running)
+    stopped_count = max(row['profile_count'] - active_count, 0)
+    next_schedule = "None scheduled"
+    if next_runs:
+        profile_name, next_run = min(next_runs.items(), key=lambda item: item[1])
+        next_schedule = f"'{profile_name}' at {datetime.fromtimestamp(next_run).strftime('%H:%M:%S')}"
     return {
         "status": f"{active_count} Active / {stopped_count} Stopped",
-        "messages": f"{total_sent} Sent ({failed_sent} Failed)",
-        "recent_logs": recent_logs or ["No logs available."],
+        "messages": f"{row['total_sent']} Sent ({row['failed_sent']} Failed)",
+        "recent_logs": log_ring.recent(user_id, 5) or ["No logs available."],
         "next_schedule": next_schedule
     }
 
 # --- BOT LOGIC ---
-def send_message_logic(channel_id, token, message):
+def run_bot_once(user_id, profile_name, profile):
+    due = scheduler.next_run((user_id, profile_name))
+    if due is not None:
+        SCHEDULE_LAG.observe(max(0.0, time.time() - due))
+    if OUTBOX:
+        # A sender process delivers it; a tick of this bot still waiting in the outbox is not queued twice.
+        now = datetime.now()
+        storage.enqueue_send(user_id, profile_name, datetime.fromtimestamp(due) if due is not None else now,
+                             len(profile.channel_ids), now)
+        return
+    # When every channel is rate limited nothing is recorded; the scheduler retries after retry_after.
+    return recorder.send(user_id, profile_name, profile)[1]
+
+# --- OUTBOX ---
+# OUTBOX=1 queues due sends in the outbox table; any process running an OutboxWorker delivers them (see outbox.py).
+# OUTBOX_CONSUME=0 keeps these workers from sending, for deployments with dedicated outbox_worker.py machines.
+OUTBOX = os.environ.get('OUTBOX', '0') == '1'
+OUTBOX_CONSUME = os.environ.get('OUTBOX_CONSUME', '1') != '0'
+# Profiles compiled for outbox ticks, reused until the cached config changes.
+compiled_cache = TTLCache("compiled", maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+def compiled_profile(user_id, profile_name, cfg):
+    cached = compiled_cache.get((user_id, profile_name))
+    if cached is None or cached[0] is not cfg:
+        cached = (cfg, CompiledProfile(cfg['token'], cfg['channelid'], cfg['messages'], attachment_cache))
+        compiled_cache.set((user_id, profile_name), cached)
+    return cached[1]
+
+def deliver_outbox(user_id, profile_name):
+    """Send a tick claimed from the outbox. Returns (channels reached, retry_after or None)."""
+    cfg = get_user_profiles(user_id).get(profile_name)
+    if cfg is None:
+        raise LookupError(f"profile {profile_name} not found")
+    return recorder.send(user_id, profile_name, compiled_profile(user_id, profile_name, cfg), count=False)
+
+def outbox_finished(rows):
+    for user_id, profile_name, running, owner, sent_count, last_run in rows:
+        control.record_counts(user_id, profile_name, running, owner, sent_count, last_run)
+
+outbox_worker = OutboxWorker(storage, deliver_outbox, dispatcher, on_finished=outbox_finished)
+
+def unschedule(user_id, profile_name):
+    scheduler.cancel((user_id, profile_name))
+
+def on_bot_error(key, error):
+    user_id, profile_name = key
+    log_event(user_id, f"[{profile_name}] Bot dihentikan: {error}", logging.ERROR)
+    control.release(user_id, profile_name)
+
+CRON_MODES = ('cron_simple', 'cron_advanced')
+
+def compile_cron(cron_expr):
+    """Validated CronSchedule for `cron_expr`, shared by previews. Raises ValueError if invalid."""
+    return cron_cache.get_or_load(cron_expr, lambda: CronSchedule(cron_expr))
+
+def profile_from_request(data):
+    """The stored form of a profile submitted by the UI or an import. Raises ValueError on bad fields."""
+    channelid = data.get("channelid", "")
+    return {
+        "token": data.get("token", ""), "channelid": ", ".join(map(str, channelid)) if isinstance(channelid, list) else channelid,
+        "schedule_mode": data.get("schedule_mode", "interval"),
+        "interval_seconds": int(data.get("interval_seconds") or 300), "cron_expression": data.get("cron_expression", ""),
+        "jitter_seconds": int(data.get("jitter_seconds") or 0), "messages": data.get("messages", [])}
+
+def profile_error(profile_name, cfg):
+    """Why `cfg` cannot be saved as `profile_name`, or None if it is valid."""
+    if not profile_name:
+        return "Nama profil tidak boleh kosong."
+    if len(profile_name) > 100:
+        return "Nama profil maksimal 100 karakter."
+    if not cfg["messages"]:
+        return "Pesan tidak boleh kosong."
+    if cfg["jitter_seconds"] < 0:
+        return "Jitter tidak boleh negatif."
     try:
-        content_to_send = ""
-        msg_type = message.get('type')
-        if msg_type == 'text':
-            content_to_send = message.get('content', '').replace("{now}", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-        elif msg_type == 'embed':
-            data = message.get('data', {})
-            content_to_send = f"**{data.get('title', '')}**\n{data.get('description', '')}"
-        elif msg_type == 'attachment':
-            content_to_send = message.get('url', '')
-            if not content_to_send:
-                log.error("Attachment URL is empty, skipping.")
-                return False
-        if not content_to_send.strip():
-            log.error("Content to send is empty, skipping.")
-            return False
-        headers = {"Authorization": token, "Content-Type": "application/json"}
-        body = json.dumps({"content": content_to_send, "tts": False})
-        log.info(f"Sending request to {channel_id} with content: {content_to_send[:100]}...")
-        conn = http.client.HTTPSConnection("discord.com", 443, timeout=30)
-        conn.request("POST", f"/api/v10/channels/{channel_id}/messages", body=body, headers=headers)
-        resp = conn.getresponse()
-        resp_body = resp.read().decode(errors='ignore')
-        if 200 <= resp.status < 300:
-            log.info(f"Pesan berhasil dikirim ke channel {channel_id}")
-            return True
+        CompiledProfile(cfg["token"], cfg["channelid"], cfg["messages"], attachment_cache)
+    except (ValueError, TypeError, AttributeError) as e:
+        return f"Pesan tidak valid: {e}"
+    if cfg["schedule_mode"] in CRON_MODES:
+        try:
+            compile_cron(cfg["cron_expression"])
+        except ValueError as e:
+            return f"Jadwal cron tidak valid: {e}"
+    return None
+
+def select_profiles(user_id, data):
+    """Profile names picked by a bulk request: "profiles" (a list) or "match" (a glob, "*" for all)."""
+    names = get_user_profiles(user_id)
+    if isinstance(data.get("profiles"), list):
+        return [name for name in dict.fromkeys(data["profiles"]) if name in names]
+    if data.get("match"):
+        return [name for name in names if fnmatch.fnmatchcase(name, data["match"])]
+    return []
+
+def preview_schedule(user_id, profile_names, count):
+    """{profile: {"running", "mode", "next_runs"}}; next_runs is empty for stopped interval profiles."""
+    profiles, status = get_user_profiles(user_id), control.status_for(user_id)
+    local = scheduler.upcoming([(user_id, name) for name in profile_names], count)
+    now, preview = time.time(), {}
+    for name in profile_names:
+        cfg = profiles.get(name)
+        if cfg is None:
+            continue
+        mode = cfg['schedule_mode'] if cfg['schedule_mode'] in CRON_MODES else 'interval'
+        running, next_run = status.get(name, {}).get('running', False), status.get(name, {}).get('next_run')
+        next_runs = []
+        if (user_id, name) in local:
+            next_runs = local[(user_id, name)]
+        elif mode == 'interval':
+            if running and next_run:
+                next_runs = [next_run + i * int(cfg['interval_seconds'] or 300) for i in range(count)]
         else:
-            log.error(f"HTTP {resp.status} {resp.reason} | response: {resp_body}")
-            return False
-    except Exception as e:
-        log.exception(f"Terjadi error saat mengirim pesan: {e}")
-        return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
-
-def bot_worker(user_id, profile_name):
-    global bot_status, stop_events
+            try:
+                cron = compile_cron(cfg['cron_expression'])
+            except ValueError:
+                preview[name] = {"running": running, "mode": mode, "next_runs": [], "error": "Invalid cron expression"}
+                continue
+            start = next_run if running and next_run else now
+            with cron_cache_lock:
+                next_runs = ([start] if running and next_run else []) + cron.upcoming(count, start)
+            next_runs = next_runs[:count]
+        preview[name] = {"running": running, "mode": mode, "next_runs": next_runs}
+    return preview
+
+def schedule_bot(user_id, profile_name, delay=0, resumed=False):
     cfg = get_profile_config(user_id, profile_name)
     token, channel_id, messages, schedule_mode = (cfg.get(k, '') for k in ['token', 'channelid', 'messages', 'schedule_mode'])
-    interval, cron_expr = int(cfg.get('interval_seconds', 300)), cfg.get('cron_expression', '')
+    interval, cron_expr = int(cfg.get('interval_seconds') or 300), cfg.get('cron_expression', '')
     if not all([token, channel_id, messages]):
-        log.error(f"Worker stopped [{profile_name}]: Missing config.")
-        with bot_status_lock:
-            bot_status[profile_name]["running"] = False
-        return
-    log.info(f"Bot worker started for profile: {profile_name}.")
-    while not stop_events[profile_name].is_set():
-        message = random.choice(messages)
-        success = send_message_logic(channel_id, token, message)
-        log_send(user_id, profile_name, success)
-        if success:
-            with bot_status_lock:
-                bot_status[profile_name]["sent_count"] += 1
-                bot_status[profile_name]["last_run"] = datetime.now().strftime("%H:%M:%S")
-        if schedule_mode == 'interval':
-            for _ in range(interval):
-                if stop_events[profile_name].is_set():
-                    break
-                time.sleep(1)
-        elif schedule_mode in ['cron_simple', 'cron_advanced'] and cron_expr:
-            try:
-                sleep_duration = (croniter(cron_expr, datetime.now()).get_next(datetime) - datetime.now()).total_seconds()
-                while sleep_duration > 0 and not stop_events[profile_name].is_set():
-                    time.sleep(min(1, sleep_duration))
-                    sleep_duration -= 1
-            except Exception as e:
-                log.error(f"Cron error for '{profile_name}': {e}. Stopping.")
-                break
-    log.info(f"Bot worker stopped for profile: {profile_name}.")
-    with bot_status_lock:
-        bot_status[profile_name]["running"] = False
+        raise ValueError("Missing config.")
+    compiled = CompiledProfile(token, channel_id, messages, attachment_cache)
+    if not compiled.channel_ids:
+        raise ValueError("Missing config.")
+    action = lambda: run_bot_once(user_id, profile_name, compiled)
+    # A fan-out holds one send slot per channel; queueing it in the outbox holds one.
+    options = dict(on_error=on_bot_error, delay=delay, jitter=int(cfg.get('jitter_seconds') or 0) or SEND_JITTER,
+                   cost=1 if OUTBOX else len(compiled.channel_ids))
+    if schedule_mode in CRON_MODES:
+        scheduler.add((user_id, profile_name), action, cron_expr=cron_expr, **options)
+    else:
+        scheduler.add((user_id, profile_name), action, interval=interval, **options)
+    if resumed:
+        log_event(user_id, f"[{profile_name}] Bot dilanjutkan setelah restart ({schedule_mode}), kirim berikutnya dalam {delay:.0f} detik.")
+    else:
+        log_event(user_id, f"[{profile_name}] Bot dimulai ({schedule_mode}).")
+
+# --- WARM RESTART ---
+# Due bots resume spread over this many seconds instead of all firing at boot.
+RESUME_WINDOW = float(os.environ.get('RESUME_WINDOW', 60))
+boot_report = {"pid": os.getpid()}
+
+def resume_delays(runs, now):
+    """({(user_id, profile_name): first-fire delay}, number of due runs) for adopted runs.
+
+    A run that is not due yet keeps its schedule; due runs, most overdue
+    first, are spread evenly over RESUME_WINDOW.
+    """
+    delays, due = {}, []
+    for user_id, profile_name, last_run in runs:
+        cfg = get_user_profiles(user_id).get(profile_name)
+        if cfg is None:
+            continue
+        next_run = None
+        if last_run is not None:
+            if cfg['schedule_mode'] in CRON_MODES:
+                try:
+                    cron = compile_cron(cfg['cron_expression'])
+                except ValueError:
+                    cron = None
+                if cron is not None:
+                    with cron_cache_lock:
+                        next_run = cron.next_after(last_run.timestamp())
+            else:
+                next_run = last_run.timestamp() + int(cfg['interval_seconds'] or 300)
+        if next_run is not None and next_run > now:
+            delays[(user_id, profile_name)] = next_run - now
+        else:
+            due.append((next_run or 0, user_id, profile_name))
+    due.sort()
+    for i, (_, user_id, profile_name) in enumerate(due):
+        delays[(user_id, profile_name)] = RESUME_WINDOW * i / len(due)
+    return delays, len(due)
+
+def resume_bots():
+    """Adopt the runs left by workers that are gone and schedule them again. Returns (resumed, due) counts."""
+    runs = control.adopt()
+    if not runs:
+        return 0, 0
+    delays, due = resume_delays(runs, time.time())
+    resumed, failed = 0, []
+    for user_id, profile_name, _ in runs:
+        delay = delays.get((user_id, profile_name))
+        try:
+            if delay is None:
+                raise ValueError("Profil tidak ditemukan.")
+            schedule_bot(user_id, profile_name, delay=delay, resumed=True)
+            resumed += 1
+        except ValueError as e:
+            log_event(user_id, f"[{profile_name}] Bot gagal dilanjutkan: {e}", logging.ERROR)
+            failed.append((user_id, profile_name))
+    for user_id, profile_name in failed:
+        control.release(user_id, profile_name)
+    return resumed, due
+
+def resume_on_boot():
+    """Resume orphaned bots and log the boot report. Runs once per worker, off the import path."""
+    started = time.time()
+    try:
+        resumed, due = resume_bots()
+        boot_report.update(resumed=resumed, due=due, resume_seconds=round(time.time() - started, 3))
+    except Exception as e:
+        log.error(f"Resuming bots failed: {e}")
+        boot_report.update(resumed=0, due=0, resume_error=str(e))
+    boot_report["ready_seconds"] = round(time.time() - BOOT_STARTED, 3)
+    log.info("Worker boot: " + ", ".join(f"{k}={v}" for k, v in boot_report.items()))
+    # Runs of a worker that died without handing them back are adoptable once its heartbeat has expired.
+    time.sleep(control.owner_timeout)
+    try:
+        resumed, _ = resume_bots()
+        if resumed:
+            log.info(f"Resumed {resumed} bots of a worker that stopped heartbeating.")
+    except Exception as e:
+        log.error(f"Resuming bots failed: {e}")
 
 # --- ROUTES ---
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_TIME.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+    return response
+
+def metrics_token_required(view):
+    # Process-wide internals, for the operator rather than any logged-in user: protected by
+    # METRICS_TOKEN (Bearer) instead of a login, and not served at all without one.
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = os.environ.get('METRICS_TOKEN')
+        if not token:
+            return Response("Not Found\n", status=404, mimetype='text/plain')
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return Response("Unauthorized\n", status=401, mimetype='text/plain')
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/metrics')
+@metrics_token_required
+def get_metrics():
+    # Scraped by Prometheus, not a browser.
+    return Response(metrics_exporter.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     if request.method == 'POST':
         username, password = request.form['username'], request.form['password']
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=DictCursor)
-        cur.execute("SELECT id, username, password_hash FROM users WHERE username = %s", (username,))
-        user_data = cur.fetchone()
-        cur.close()
-        conn.close()
-        if user_data and check_password_hash(user_data['password_hash'], password):
-            login_user(User(user_data['id'], user_data['username'], user_data['password_hash']), remember=True)
+        user_data = storage.find_user(username)
+        if user_data and check_password_hash(user_data[2], password):
+            login_user(User(*user_data), remember=True)
             return redirect(url_for('index'))
         else:
             flash('Username atau password salah.', 'danger')
@@ -325,22 +527,13 @@ def register():
         return redirect(url_for('index'))
     if request.method == 'POST':
         username, password = request.form['username'], request.form['password']
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-        if cur.fetchone():
-            cur.close()
-            conn.close()
+        user_id = storage.create_user(username, generate_password_hash(password), {
+            "token": "", "channelid": "", "schedule_mode": "interval", "interval_seconds": 300, "cron_expression": "",
+            "jitter_seconds": 0, "messages": [{"type": "text", "content": "Hello World!"}]})
+        if user_id is None:
             flash('Username sudah digunakan.', 'danger')
             return redirect(url_for('register'))
-        password_hash = generate_password_hash(password)
-        cur.execute("INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id", (username, password_hash))
-        user_id = cur.fetchone()[0]
-        cur.execute("INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
-                    (user_id, "default", "", "", "interval", 300, "", json.dumps([{"type": "text", "content": "Hello World!"}])))
-        conn.commit()
-        cur.close()
-        conn.close()
+        invalidate_user(user_id)
         flash('Registrasi berhasil! Silakan login.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -364,46 +557,109 @@ def index():
 @app.route('/api/upload_attachment', methods=['POST'])
 @login_required
 def upload_attachment():
-    if 'file' not in request.files:
-        return jsonify({"message": "No file part"}), 400
-    file = request.files['file']
-    if file.filename == '':
+    # The raw request body is the file (name in X-Filename); multipart "file" fields are still accepted.
+    if request.mimetype == 'multipart/form-data':
+        if 'file' not in request.files:
+            return jsonify({"message": "No file part"}), 400
+        stream, filename = request.files['file'].stream, request.files['file'].filename
+    else:
+        stream, filename = request.stream, unquote(request.headers.get('X-Filename', ''))
+    if not filename:
         return jsonify({"message": "No selected file"}), 400
     try:
-        # Upload to Cloudinary
-        upload_result = cloudinary.uploader.upload(file, resource_type="auto")
-        return jsonify({"message": "File uploaded", "filepath": upload_result['secure_url']})
+        result = upload_manager.ingest(stream, filename)
     except Exception as e:
-        log.error(f"Error uploading to Cloudinary: {e}")
+        log.error(f"Error receiving upload: {e}")
         return jsonify({"message": f"Upload failed: {str(e)}"}), 500
+    if result["status"] == "done":
+        return jsonify(dict(result, message="File uploaded"))
+    return jsonify(dict(result, message="File diterima, sedang diunggah.")), 202
+
+@app.route('/api/uploads/<digest>')
+@login_required
+def get_upload_status(digest):
+    result = upload_manager.status(digest)
+    if result is None:
+        return jsonify({"message": "Upload tidak ditemukan."}), 404
+    return jsonify(result)
+
+@app.route('/uploads/<path:filename>')
+@login_required
+def serve_upload(filename):
+    if not isinstance(upload_manager.backend, LocalDiskBackend):
+        return jsonify({"message": "Not found"}), 404
+    return send_from_directory(upload_manager.backend.directory, filename)
 
 @app.route('/api/start', methods=['POST'])
 @login_required
 def start_bot():
     profile_name = request.json.get("profile", "default")
-    if profile_name in bot_threads and bot_threads[profile_name].is_alive():
+    if not control.claim(current_user.id, profile_name):
         return jsonify({"message": "Bot sudah berjalan!"})
-    with bot_status_lock:
-        if profile_name not in stop_events:
-            stop_events[profile_name] = threading.Event()
-        stop_events[profile_name].clear()
-        if profile_name not in bot_status:
-            bot_status[profile_name] = {}
-        bot_status[profile_name].update({"running": True, "sent_count": 0, "last_run": "-"})
-    bot_threads[profile_name] = threading.Thread(target=bot_worker, args=(current_user.id, profile_name))
-    bot_threads[profile_name].start()
+    try:
+        schedule_bot(current_user.id, profile_name)
+    except ValueError as e:
+        log_event(current_user.id, f"[{profile_name}] Bot gagal dimulai: {e}", logging.ERROR)
+        control.release(current_user.id, profile_name)
+        return jsonify({"message": f"Bot gagal dimulai untuk profil '{profile_name}': {e}"}), 400
     return jsonify({"message": f"Bot dimulai untuk profil '{profile_name}'."})
 
 @app.route('/api/stop', methods=['POST'])
 @login_required
 def stop_bot():
     profile_name = request.json.get("profile", "default")
-    if profile_name not in bot_threads or not bot_threads[profile_name].is_alive():
+    if not control.is_wanted(current_user.id, profile_name):
         return jsonify({"message": "Bot tidak berjalan."})
-    stop_events[profile_name].set()
-    bot_threads[profile_name].join(timeout=5)
+    unschedule(current_user.id, profile_name)
+    control.release(current_user.id, profile_name)
+    log_event(current_user.id, f"[{profile_name}] Bot dihentikan.")
     return jsonify({"message": "Bot dihentikan."})
 
+@app.route('/api/bulk_start', methods=['POST'])
+@login_required
+def bulk_start():
+    user_id = current_user.id
+    names = select_profiles(user_id, request.json or {})
+    if not names:
+        return jsonify({"message": "Tidak ada profil yang dipilih."}), 400
+    claimed = control.claim_many(user_id, names)
+    started, failed = [], {}
+    for profile_name in names:
+        if profile_name not in claimed:
+            continue
+        try:
+            schedule_bot(user_id, profile_name)
+            started.append(profile_name)
+        except ValueError as e:
+            log_event(user_id, f"[{profile_name}] Bot gagal dimulai: {e}", logging.ERROR)
+            failed[profile_name] = str(e)
+    if failed:
+        control.release_many(user_id, list(failed))
+    already_running = [name for name in names if name not in claimed]
+    return jsonify({"message": f"{len(started)} bot dimulai, {len(already_running)} sudah berjalan, {len(failed)} gagal.",
+                    "started": started, "already_running": already_running, "failed": failed})
+
+def finish_bulk_stop(user_id, names):
+    try:
+        control.release_many(user_id, names)
+        for profile_name in names:
+            log_event(user_id, f"[{profile_name}] Bot dihentikan.")
+    except Exception as e:
+        log.error(f"Bulk stop failed for user {user_id}: {e}")
+
+@app.route('/api/bulk_stop', methods=['POST'])
+@login_required
+def bulk_stop():
+    user_id = current_user.id
+    names = [name for name in select_profiles(user_id, request.json or {}) if control.is_wanted(user_id, name)]
+    if not names:
+        return jsonify({"message": "Tidak ada bot yang berjalan.", "stopping": []})
+    # Local jobs stop firing now; the status update and the other workers follow in the background.
+    for profile_name in names:
+        unschedule(user_id, profile_name)
+    bulk_executor.submit(finish_bulk_stop, user_id, names)
+    return jsonify({"message": f"Menghentikan {len(names)} bot.", "stopping": names}), 202
+
 @app.route('/api/send_once', methods=['POST'])
 @login_required
 def send_once():
@@ -411,33 +667,112 @@ def send_once():
     profile_name, token, channel_id, messages = data.get("profile", "default"), data.get('token'), data.get('channelid'), data.get('messages')
     if not all([token, channel_id, messages]):
         return jsonify({"success": False, "message": "Konfigurasi tidak lengkap untuk tes."})
-    message = random.choice(messages)
-    success = send_message_logic(channel_id, token, message)
-    log_send(current_user.id, profile_name, success)
-    if success:
+    try:
+        compiled = CompiledProfile(token, channel_id, messages, attachment_cache)
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Pesan tidak valid: {e}"})
+    if not compiled.channel_ids:
+        return jsonify({"success": False, "message": "Konfigurasi tidak lengkap untuk tes."})
+    results = sender.send_to_channels(compiled.channel_ids, token, compiled.pick(), max_wait=2.0)
+    limited = [result for result in results.values() if isinstance(result, RateLimited)]
+    for sent_to, result in results.items():
+        if not isinstance(result, (RateLimited, CircuitOpen)):
+            log_send(current_user.id, profile_name, result, sent_to)
+    if limited and len(limited) == len(results):
+        retry_after = min(e.retry_after for e in limited)
+        return jsonify({"success": False, "message": f"Rate limit Discord, coba lagi dalam {retry_after:.1f} detik."})
+    reason = suspension_reason(results)
+    if reason:
+        return jsonify({"success": False, "message": f"Tidak dikirim, channel sedang diblokir: {reason}."})
+    failed = [sent_to for sent_to, result in results.items() if result is not True]
+    if not failed:
         return jsonify({"success": True, "message": "Pesan tes berhasil dikirim!"})
-    return jsonify({"success": False, "message": "Gagal mengirim pesan tes. Cek log."})
+    if len(results) == 1:
+        return jsonify({"success": False, "message": "Gagal mengirim pesan tes. Cek log."})
+    return jsonify({"success": False, "message": f"Gagal mengirim pesan tes ke {len(failed)} dari {len(results)} channel. Cek log.",
+                    "failed_channels": failed})
 
 @app.route('/api/status')
 @login_required
 def get_status():
-    with bot_status_lock:
-        for profile in list(bot_status.keys()):
-            if bot_status[profile].get("running") and (profile not in bot_threads or not bot_threads[profile].is_alive()):
-                bot_status[profile]["running"] = False
-        return jsonify(bot_status)
+    return jsonify(control.status_for(current_user.id))
+
+@app.route('/api/events')
+@login_required
+def stream_events():
+    user_id = current_user.id
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if not event_bus.open_stream(user_id):
+        # The dashboard polls instead and retries the stream later.
+        return jsonify({"message": "Terlalu banyak koneksi live. Coba lagi nanti."}), 503, {'Retry-After': '30'}
+
+    def generate(cursor):
+        SSE_CLIENTS.inc()
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                events, cursor = event_bus.wait(user_id, cursor, timeout=15)
+                if not events:
+                    yield ": keep-alive\n\n"
+                    continue
+                for event in events:
+                    yield f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n"
+        finally:
+            SSE_CLIENTS.dec()
+
+    response = Response(stream_with_context(generate(last_id)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, even if the stream never started.
+    response.call_on_close(lambda: event_bus.close_stream(user_id))
+    return response
 
 @app.route('/api/logs')
 @login_required
 def get_logs():
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=DictCursor)
-    cur.execute("SELECT message FROM logs WHERE user_id = %s ORDER BY timestamp DESC LIMIT 15", (current_user.id,))
-    logs = [row['message'] for row in cur.fetchall()]
-    cur.close()
-    conn.close()
+    logs = log_ring.recent(current_user.id, 15)
     return jsonify({"logs": "".join(logs) if logs else "No logs available."})
 
+@app.route('/api/http_stats')
+@metrics_token_required
+def get_http_stats():
+    return jsonify(discord_client.get_pool().stats())
+
+@app.route('/api/db_stats')
+@metrics_token_required
+def get_db_stats():
+    return jsonify({"storage": storage.stats(), "send_writer": send_writer.stats(), "log_writer": log_writer.stats(), "log_ring": log_ring.stats(),
+                    "janitor": janitor.stats(),
+                    "caches": {"users": user_cache.stats(), "profiles": profile_cache.stats()},
+                    "uploads": upload_manager.stats(), "attachments": attachment_cache.stats(), "sse": event_bus.stream_stats()})
+
+@app.route('/api/dispatch_stats')
+@metrics_token_required
+def get_dispatch_stats():
+    return jsonify(dispatcher.stats())
+
+@app.route('/api/outbox_stats')
+@metrics_token_required
+def get_outbox_stats():
+    return jsonify({"enabled": OUTBOX, "ticks": storage.outbox_stats(datetime.now()),
+                    "worker": outbox_worker.stats() if OUTBOX and OUTBOX_CONSUME else None})
+
+@app.route('/api/startup')
+@metrics_token_required
+def get_startup_report():
+    return jsonify(boot_report)
+
+@app.route('/api/ratelimits')
+@login_required
+def get_ratelimits():
+    tokens = [p['token'] for p in get_user_profiles(current_user.id).values()]
+    return jsonify(rate_limiter.snapshot(tokens))
+
+@app.route('/api/circuits')
+@login_required
+def get_circuits():
+    tokens = [p['token'] for p in get_user_profiles(current_user.id).values()]
+    return jsonify(circuit_breaker.snapshot(tokens))
+
 @app.route('/api/profiles', methods=['GET'])
 @login_required
 def get_profiles_list():
@@ -455,56 +790,67 @@ def save_profile():
     data = request.json
     try:
         profile_name = data.get("profile_name", "default").strip()
-        if not profile_name:
-            return jsonify({"message": "Nama profil tidak boleh kosong."}), 400
-        messages = data.get("messages", [])
-        if not messages:
-            return jsonify({"message": "Pesan tidak boleh kosong."}), 400
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (user_id, profile_name) DO UPDATE
-            SET token = EXCLUDED.token, channelid = EXCLUDED.channelid, schedule_mode = EXCLUDED.schedule_mode,
-                interval_seconds = EXCLUDED.interval_seconds, cron_expression = EXCLUDED.cron_expression, messages = EXCLUDED.messages
-        """, (current_user.id, profile_name, data.get("token", ""), data.get("channelid", ""), data.get("schedule_mode", "interval"),
-              int(data.get("interval_seconds", 300)), data.get("cron_expression", ""), json.dumps(messages)))
-        conn.commit()
-        cur.close()
-        conn.close()
+        cfg = profile_from_request(data)
+        error = profile_error(profile_name, cfg)
+        if error:
+            return jsonify({"message": error}), 400
+        storage.save_profile(current_user.id, profile_name, cfg)
+        invalidate_user(current_user.id)
         return jsonify({"message": f"Profil '{profile_name}' berhasil disimpan!"})
     except Exception as e:
         log.error(f"Error saving profile: {e}")
         return jsonify({"message": f"Error: {str(e)}"}), 500
 
+@app.route('/api/import_profiles', methods=['POST'])
+@login_required
+def import_profiles():
+    """Upsert many profiles at once: {"profiles": {name: cfg}} or a users.json document {"users": {id: {"profiles": ...}}}."""
+    data = request.json or {}
+    if isinstance(data.get("users"), dict):
+        sources = [user.get("profiles") or {} for user in data["users"].values() if isinstance(user, dict)]
+    else:
+        sources = [data.get("profiles") or {}]
+    profiles, errors = {}, {}
+    for source in sources:
+        if not isinstance(source, dict):
+            return jsonify({"message": "Format impor tidak valid."}), 400
+        for name, cfg in source.items():
+            name = str(name).strip()
+            if name in profiles:
+                errors[name] = "Nama profil muncul lebih dari sekali."
+                continue
+            try:
+                profiles[name] = profile_from_request(cfg)
+            except (ValueError, TypeError, AttributeError) as e:
+                errors[name] = f"Konfigurasi tidak valid: {e}"
+                continue
+            error = profile_error(name, profiles[name])
+            if error:
+                errors[name] = error
+    if errors:
+        return jsonify({"message": f"{len(errors)} profil tidak valid, tidak ada yang diimpor.", "errors": errors}), 400
+    if not profiles:
+        return jsonify({"message": "Tidak ada profil untuk diimpor."}), 400
+    try:
+        storage.save_profiles(current_user.id, profiles)
+    except Exception as e:
+        log.error(f"Error importing profiles: {e}")
+        return jsonify({"message": f"Error: {str(e)}"}), 500
+    invalidate_user(current_user.id)
+    return jsonify({"message": f"{len(profiles)} profil berhasil diimpor!", "imported": list(profiles)})
+
 @app.route('/api/delete_profile', methods=['POST'])
 @login_required
 def delete_profile():
     try:
         profile_name = request.json.get("profile").strip()
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM profiles WHERE user_id = %s", (current_user.id,))
-        if cur.fetchone()[0] <= 1 and profile_name == "default":
-            cur.close()
-            conn.close()
+        if storage.count_profiles(current_user.id) <= 1 and profile_name == "default":
             return jsonify({"message": "Tidak dapat menghapus satu-satunya profil."}), 400
-        cur.execute("DELETE FROM profiles WHERE user_id = %s AND profile_name = %s", (current_user.id, profile_name))
-        if cur.rowcount == 0:
-            cur.close()
-            conn.close()
+        if not storage.delete_profile(current_user.id, profile_name, datetime.now()):
             return jsonify({"message": f"Profil '{profile_name}' tidak ditemukan."}), 404
-        cur.execute("DELETE FROM sends WHERE user_id = %s AND profile_name = %s", (current_user.id, profile_name))
-        conn.commit()
-        cur.close()
-        conn.close()
-        if profile_name in bot_threads and bot_threads[profile_name].is_alive():
-            stop_events[profile_name].set()
-            bot_threads[profile_name].join(timeout=5)
-        with bot_status_lock:
-            if profile_name in bot_status:
-                del bot_status[profile_name]
+        invalidate_user(current_user.id)
+        unschedule(current_user.id, profile_name)
+        control.remove(current_user.id, profile_name)
         return jsonify({"message": f"Profil '{profile_name}' berhasil dihapus!"})
     except Exception as e:
         log.error(f"Error deleting profile: {e}")
@@ -515,31 +861,34 @@ def delete_profile():
 def duplicate_profile():
     try:
         profile_name = request.json.get("profile_name").strip()
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=DictCursor)
-        cur.execute("SELECT * FROM profiles WHERE user_id = %s AND profile_name = %s", (current_user.id, profile_name))
-        profile = cur.fetchone()
+        profile = storage.load_profiles(current_user.id).get(profile_name)
         if not profile:
-            cur.close()
-            conn.close()
             return jsonify({"message": f"Profil '{profile_name}' tidak ditemukan."}), 404
         new_profile_name = f"{profile_name}_copy_{random.randint(100, 999)}"
-        cur.execute("SELECT 1 FROM profiles WHERE user_id = %s AND profile_name = %s", (current_user.id, new_profile_name))
-        while cur.fetchone():
+        while not storage.create_profile(current_user.id, new_profile_name, profile):
             new_profile_name = f"{profile_name}_copy_{random.randint(100, 999)}"
-        cur.execute("""
-            INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (current_user.id, new_profile_name, profile['token'], profile['channelid'], profile['schedule_mode'],
-              profile['interval_seconds'], profile['cron_expression'], json.dumps(profile['messages'])))
-        conn.commit()
-        cur.close()
-        conn.close()
+        invalidate_user(current_user.id)
         return jsonify({"message": f"Profil '{profile_name}' diduplikasi sebagai '{new_profile_name}'!", "new_profile_name": new_profile_name})
     except Exception as e:
         log.error(f"Error duplicating profile: {e}")
         return jsonify({"message": f"Error: {str(e)}"}), 500
 
+@app.route('/api/schedule/preview')
+@login_required
+def get_schedule_preview():
+    """Upcoming fire times for ?profile=... (repeatable; default all), or for an unsaved ?cron_expression=."""
+    count = max(1, min(request.args.get('count', 5, type=int), 50))
+    cron_expr = request.args.get('cron_expression')
+    if cron_expr:
+        try:
+            cron = compile_cron(cron_expr)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        with cron_cache_lock:
+            return jsonify({"cron_expression": cron_expr, "next_runs": cron.upcoming(count, time.time())})
+    names = request.args.getlist('profile') or list(get_user_profiles(current_user.id))
+    return jsonify({"profiles": preview_schedule(current_user.id, names, count)})
+
 @app.route('/api/dashboard')
 @login_required
 def get_dashboard():
@@ -549,12 +898,11 @@ def get_dashboard():
 @login_required
 def clear_logs():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM logs WHERE user_id = %s", (current_user.id,))
-        conn.commit()
-        cur.close()
-        conn.close()
+        control.broadcast(current_user.id, "logs_cleared", {})
+        if LOG_PERSIST:
+            # Drop the persisted copy too, or a restart would bring the lines back.
+            log_writer.flush()
+            storage.clear_logs(current_user.id)
         log.info(f"Logs cleared by user {current_user.id}.")
         return jsonify({"message": "Log berhasil dibersihkan!"})
     except Exception as e:
@@ -564,46 +912,45 @@ def clear_logs():
 @app.route('/api/analytics', methods=['GET'])
 @login_required
 def get_analytics():
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=DictCursor)
     time_range = request.args.get('range', 'daily')
     limits = {'daily': 24*60*60, 'weekly': 7*24*60*60, 'monthly': 30*24*60*60}
-    cutoff = datetime.now() - timedelta(seconds=limits.get(time_range, 24*60*60))
+    cutoff = (datetime.now() - timedelta(seconds=limits.get(time_range, 24*60*60))).replace(minute=0, second=0, microsecond=0)
     current_profiles = list(get_user_profiles(current_user.id).keys())
-    if not current_profiles:
-        cur.close()
-        conn.close()
-        return jsonify({"dates": [], "success": 0, "failure": 0, "total": 0, "profiles": {}})
-    placeholders = ','.join(['%s'] * len(current_profiles))
-    cur.execute(f"""
-        SELECT timestamp, success, profile_name
-        FROM sends
-        WHERE user_id = %s AND timestamp >= %s AND profile_name IN ({placeholders})
-        ORDER BY timestamp ASC
-    """, [current_user.id, cutoff] + current_profiles)
-    rows = cur.fetchall()
     data = {
-        "dates": [row['timestamp'].isoformat() for row in rows],
-        "success": sum(1 for row in rows if row['success']),
-        "failure": len(rows) - sum(1 for row in rows if row['success']),
-        "total": len(rows),
-        "profiles": {profile_name: {"success": 0, "failure": 0, "timestamps": {}} for profile_name in current_profiles}
+        "dates": [], "success": 0, "failure": 0, "total": 0,
+        "profiles": {profile_name: {"success": 0, "failure": 0, "hours": {}} for profile_name in current_profiles}
     }
-    for row in rows:
-        profile_name = row['profile_name']
-        if profile_name in data["profiles"]:
-            data["profiles"][profile_name]["timestamps"][row['timestamp'].isoformat()] = row['success']
-            if row['success']:
-                data["profiles"][profile_name]["success"] += 1
-            else:
-                data["profiles"][profile_name]["failure"] += 1
-    cur.close()
-    conn.close()
+    if not current_profiles:
+        return jsonify(data)
+    hours = set()
+    with DB_TIME.time("analytics"):
+        rows = storage.rollups(current_user.id, cutoff)
+    for profile_name, hour, success_count, failure_count in rows:
+        profile = data["profiles"].get(profile_name)
+        if profile is None:
+            continue
+        hour = hour.isoformat()
+        hours.add(hour)
+        profile["hours"][hour] = {"success": success_count, "failure": failure_count}
+        profile["success"] += success_count
+        profile["failure"] += failure_count
+    data["dates"] = sorted(hours)
+    data["success"] = sum(p["success"] for p in data["profiles"].values())
+    data["failure"] = sum(p["failure"] for p in data["profiles"].values())
+    data["total"] = data["success"] + data["failure"]
     return jsonify(data)
 
 # Initialize logger and database
 setup_logger()
+boot_report["import_seconds"] = round(time.time() - BOOT_STARTED, 3)
+_migrate_started = time.time()
 init_db()
+boot_report["migrate_seconds"] = round(time.time() - _migrate_started, 3)
+metrics_exporter.start()
+janitor.ensure_started()
+if OUTBOX and OUTBOX_CONSUME:
+    outbox_worker.ensure_started()
+threading.Thread(target=resume_on_boot, name="resume", daemon=True).start()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=False)
\ No newline at end of file
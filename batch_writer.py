@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded in-memory queue with a background flusher that writes rows in bulk.
+
+Producers call `put(row)`; a daemon thread hands batches to `flush_fn(rows)`
+once `max_batch` rows are waiting or `flush_interval` seconds have passed.
+When the queue is full, `put` blocks for up to `put_timeout` seconds
+(backpressure) and then drops the row. Remaining rows are flushed at exit.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+log = logging.getLogger("discordbot")
+
+_STOP = object()
+
+
+class BatchWriter:
+    def __init__(self, name, flush_fn, max_batch=None, flush_interval=None, max_queue=None,
+                 put_timeout=0.5, retries=3):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_batch = max_batch or int(os.environ.get("BATCH_WRITER_MAX_BATCH", 500))
+        self.flush_interval = flush_interval or float(os.environ.get("BATCH_WRITER_FLUSH_INTERVAL", 1.0))
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=max_queue or int(os.environ.get("BATCH_WRITER_MAX_QUEUE", 10_000)))
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._stats = {"enqueued": 0, "written": 0, "batches": 0, "dropped": 0, "failed": 0}
+        atexit.register(self.close)
+
+    def _ensure_started(self):
+        # Started lazily so each gunicorn worker gets its own flusher after fork.
+        if self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+                self._thread.start()
+
+    def put(self, row):
+        if self._closed:
+            self._write([row])
+            return True
+        self._ensure_started()
+        try:
+            self._queue.put(row, timeout=self.put_timeout)
+        except queue.Full:
+            self._stats["dropped"] += 1
+            log.warning(f"{self.name} writer queue full; dropped a row.")
+            return False
+        self._stats["enqueued"] += 1
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    row = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stop = True
+                    break
+                batch.append(row)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        with self._flush_lock:
+            for attempt in range(1, self.retries + 1):
+                try:
+                    self.flush_fn(batch)
+                    self._stats["written"] += len(batch)
+                    self._stats["batches"] += 1
+                    return
+                except Exception as e:
+                    log.error(f"{self.name} writer flush failed (attempt {attempt}/{self.retries}, {len(batch)} rows): {e}")
+                    time.sleep(min(0.5 * attempt, 2))
+            self._stats["failed"] += len(batch)
+
+    def flush(self):
+        """Write everything queued so far from the calling thread."""
+        batch = []
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP:
+                batch.append(row)
+            if len(batch) >= self.max_batch:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def close(self, timeout=10):
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread and self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+                self._thread.join(timeout)
+            except queue.Full:
+                pass
+        self.flush()
+
+    def stats(self):
+        return dict(self._stats, queued=self._queue.qsize())
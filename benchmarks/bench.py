@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark for the bot scheduler and send path.
+
+Runs the app in-process on the SQLite backend against a local fake Discord
+(benchmarks/fake_discord.py) and drives scenarios of 10, 1,000 and 10,000
+profiles in interval and cron mode. Every profile is started with the real
+claim/schedule_bot path. Reports, per scenario:
+
+- sends per second accepted by the fake API;
+- scheduling jitter: actual fire time minus the intended fire time;
+- p50/p99 send latency, measured around sender.send_message_logic;
+- DB write throughput: send rows flushed per second by the batch writer;
+- RSS per profile, from the growth after all profiles are scheduled.
+
+A "main" scenario also runs main.py as a subprocess against the same fake.
+Results are written as JSON; --baseline prints the change against an
+earlier results file.
+
+    python benchmarks/bench.py --duration 15 --output bench.json
+    python benchmarks/bench.py --profiles 10 1000 --modes interval --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_discord import FakeDiscord  # noqa: E402
+
+PROFILES_PER_USER = 500
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(values, scale=1000.0):
+    """p50/p99/max/mean of `values` (seconds), in milliseconds."""
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), "p50_ms": round(percentile(values, 50) * scale, 3),
+            "p99_ms": round(percentile(values, 99) * scale, 3), "max_ms": round(max(values) * scale, 3),
+            "mean_ms": round(statistics.fmean(values) * scale, 3)}
+
+
+class Probe:
+    """Wraps app.run_bot_once and sender.send_message_logic to record jitter and latency."""
+
+    def __init__(self, app):
+        import sender
+        self.app, self.sender = app, sender
+        self.lock = threading.Lock()
+        self.jitter, self.latency = [], []
+        self._run_bot_once, self._send = app.run_bot_once, sender.send_message_logic
+
+    def install(self):
+        def run_bot_once(user_id, profile_name, profile):
+            intended = self.app.scheduler.next_run((user_id, profile_name))
+            if intended is not None:
+                with self.lock:
+                    self.jitter.append(max(0.0, time.time() - intended))
+            return self._run_bot_once(user_id, profile_name, profile)
+
+        def send_message_logic(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return self._send(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.latency.append(time.perf_counter() - started)
+
+        self.app.run_bot_once, self.sender.send_message_logic = run_bot_once, send_message_logic
+
+    def reset(self):
+        with self.lock:
+            self.jitter, self.latency = [], []
+
+
+def wait_for_quiet(fake, quiet=1.0, timeout=120.0):
+    """Block until the fake has seen no request for `quiet` seconds."""
+    deadline, last, last_change = time.time() + timeout, None, time.time()
+    while time.time() < deadline:
+        seen = sum(fake.snapshot()["counts"].values())
+        if seen != last:
+            last, last_change = seen, time.time()
+        elif time.time() - last_change >= quiet:
+            return
+        time.sleep(0.1)
+
+
+def create_profiles(app, scenario, count, mode, interval, cron_expr):
+    keys, user_id = [], None
+    for i in range(count):
+        if i % PROFILES_PER_USER == 0:
+            user_id = app.storage.create_user(f"bench-{scenario}-{i // PROFILES_PER_USER}", "x", {"messages": []})
+        name = f"p{i}"
+        app.storage.save_profile(user_id, name, {
+            "token": f"Bot bench-token-{scenario}-{i}", "channelid": str(10_000_000 + i),
+            "schedule_mode": "interval" if mode == "interval" else "cron_advanced",
+            "interval_seconds": interval, "cron_expression": cron_expr,
+            "messages": [{"type": "text", "content": f"benchmark {i} at {{now}}"}]})
+        keys.append((user_id, name))
+    return keys
+
+
+def run_scenario(app, fake, probe, count, mode, args):
+    scenario = f"{mode}-{count}-{int(time.time())}"
+    keys = create_profiles(app, scenario, count, mode, args.interval, f"* * * * * */{args.interval}")
+    app.send_writer.flush()
+    written_before = app.send_writer.stats()["written"]
+    fake.reset()
+    probe.reset()
+    rss_before = rss_bytes()
+    started = time.time()
+    for user_id, name in keys:
+        app.control.claim(user_id, name)
+        app.schedule_bot(user_id, name)
+    start_seconds = time.time() - started
+    rss_after = rss_bytes()
+    time.sleep(args.duration)
+    for user_id, name in keys:
+        app.scheduler.cancel((user_id, name))
+    elapsed = time.time() - started
+    sent = fake.snapshot()
+    # Saturated runs leave sends queued behind the executor; let them drain so
+    # they are not counted against the next scenario.
+    wait_for_quiet(fake)
+    flush_started = time.time()
+    app.send_writer.flush()
+    rows = app.send_writer.stats()["written"] - written_before
+    for user_id, name in keys:
+        app.control.release(user_id, name)
+    with probe.lock:
+        jitter, latency = list(probe.jitter), list(probe.latency)
+    return {
+        "scenario": "app", "mode": mode, "profiles": count, "interval_seconds": args.interval,
+        "duration_seconds": round(elapsed, 3), "start_all_seconds": round(start_seconds, 3),
+        "sends": sent["accepted"], "sends_per_second": round(sent["accepted"] / elapsed, 2),
+        "responses": sent["counts"],
+        "jitter": summarize(jitter), "send_latency": summarize(latency),
+        "db_rows_written": rows, "db_rows_per_second": round(rows / (time.time() - started), 2),
+        "db_final_flush_seconds": round(time.time() - flush_started, 3),
+        "rss_bytes": rss_after, "rss_per_profile_bytes": round((rss_after - rss_before) / count, 1),
+    }
+
+
+def run_main(fake, args, workdir):
+    config_path = os.path.join(workdir, "main-config.json")
+    with open(config_path, "w") as f:
+        json.dump({"Config": [{"token": "Bot bench-main", "channelid": "42", "interval_seconds": 1,
+                               "messages": ["benchmark from main.py at {now}"]}]}, f)
+    fake.reset()
+    env = dict(os.environ, BOT_CONFIG=config_path, RENDER_DATA_DIR=workdir, DISCORD_API_BASE=fake.url)
+    started = time.time()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(args.duration)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    elapsed = time.time() - started
+    sent = fake.snapshot()
+    return {"scenario": "main", "mode": "interval", "profiles": 1, "duration_seconds": round(elapsed, 3),
+            "sends": sent["accepted"], "sends_per_second": round(sent["accepted"] / elapsed, 2),
+            "responses": sent["counts"]}
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["mode"], r["profiles"]): r for r in json.load(f)["results"]}
+    metrics = [("sends_per_second", None), ("jitter", "p99_ms"), ("send_latency", "p50_ms"),
+               ("send_latency", "p99_ms"), ("db_rows_per_second", None), ("rss_per_profile_bytes", None)]
+    for result in results:
+        old = baseline.get((result["scenario"], result["mode"], result["profiles"]))
+        if not old:
+            continue
+        parts = []
+        for metric, sub in metrics:
+            new_value = result.get(metric, {}).get(sub) if sub else result.get(metric)
+            old_value = old.get(metric, {}).get(sub) if sub else old.get(metric)
+            if new_value is None or not old_value:
+                continue
+            parts.append(f"{metric}{'.' + sub if sub else ''} {old_value} -> {new_value} ({(new_value - old_value) / old_value:+.1%})")
+        print(f"[{result['scenario']} {result['mode']} x{result['profiles']}] " + "; ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--modes", nargs="+", default=["interval", "cron"], choices=["interval", "cron"])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run each scenario")
+    parser.add_argument("--interval", type=int, default=5, help="send interval (and cron step) in seconds")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--skip-main", action="store_true", help="do not run the main.py scenario")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    fake = FakeDiscord(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+                       error_rate=args.error_rate, seed=1).start()
+    workdir = tempfile.mkdtemp(prefix="discordbot-bench-")
+    os.environ.update(RENDER_DATA_DIR=workdir, STORAGE_BACKEND="sqlite", SQLITE_PATH=os.path.join(workdir, "bench.db"),
+                      UPLOAD_BACKEND="local", DISCORD_API_BASE=fake.url)
+    import logging
+    import app
+    logging.getLogger("discordbot").setLevel(logging.WARNING)
+    probe = Probe(app)
+    probe.install()
+
+    results = []
+    for mode in args.modes:
+        for count in args.profiles:
+            print(f"Running {mode} x{count} for {args.duration}s...", flush=True)
+            results.append(run_scenario(app, fake, probe, count, mode, args))
+            print(json.dumps(results[-1]), flush=True)
+    if not args.skip_main:
+        print(f"Running main.py for {args.duration}s...", flush=True)
+        results.append(run_main(fake, args, workdir))
+        print(json.dumps(results[-1]), flush=True)
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "git_commit": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                     text=True).stdout.strip() or None,
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Discord message API, for benchmarks.
+
+Accepts POST /api/v10/channels/<id>/messages over keep-alive HTTP/1.1 and
+answers like Discord would, with configurable latency, 429 injection and
+error rate. Rate-limit headers are included so the client-side limiter
+is exercised.
+
+    python benchmarks/fake_discord.py --port 8999 --latency-ms 40 --rate-429 0.01
+
+Then point the app or main.py at it with DISCORD_API_BASE=http://127.0.0.1:8999.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MESSAGE_PATH = re.compile(r"^/api/v10/channels/(\d+)/messages$")
+
+
+class FakeDiscord:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0.0, jitter_ms=0.0, rate_429=0.0, error_rate=0.0,
+                 retry_after=1.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                fake._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-discord", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {"ok": 0, "rate_limited": 0, "error": 0, "bad_request": 0}
+            self.arrivals = []  # time.time() of every accepted message
+            self.bytes_received = 0
+
+    def _roll(self, rate):
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def _handle(self, handler):
+        body = handler.rfile.read(int(handler.headers.get("Content-Length") or 0))
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+        match = MESSAGE_PATH.match(handler.path)
+        if not match or not handler.headers.get("Authorization"):
+            self._reply(handler, 400, {"message": "Bad request", "code": 50035}, "bad_request")
+        elif self._roll(self.rate_429):
+            self._reply(handler, 429, {"message": "You are being rate limited.", "retry_after": self.retry_after,
+                                       "global": False},
+                        "rate_limited", {"Retry-After": str(self.retry_after), "X-RateLimit-Remaining": "0",
+                                         "X-RateLimit-Reset-After": str(self.retry_after),
+                                         "X-RateLimit-Bucket": f"fake-{match.group(1)}", "X-RateLimit-Scope": "user"})
+        elif self._roll(self.error_rate):
+            self._reply(handler, 500, {"message": "500: Internal Server Error", "code": 0}, "error")
+        else:
+            with self._lock:
+                self.arrivals.append(time.time())
+                self.bytes_received += len(body)
+            self._reply(handler, 200, {"id": str(time.time_ns()), "channel_id": match.group(1)}, "ok",
+                        {"X-RateLimit-Limit": "5", "X-RateLimit-Remaining": "4", "X-RateLimit-Reset-After": "1.0",
+                         "X-RateLimit-Bucket": f"fake-{match.group(1)}"})
+
+    def _reply(self, handler, status, payload, outcome, headers=None):
+        data = json.dumps(payload).encode()
+        with self._lock:
+            self.counts[outcome] += 1
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def snapshot(self):
+        with self._lock:
+            return {"counts": dict(self.counts), "accepted": len(self.arrivals), "bytes_received": self.bytes_received}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+    fake = FakeDiscord(args.host, args.port, args.latency_ms, args.jitter_ms, args.rate_429, args.error_rate,
+                       args.retry_after).start()
+    print(f"Fake Discord listening on {fake.url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(fake.snapshot()))
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breakers for dead tokens and channels.
+
+Every message send is checked against two circuits, one for its token and
+one for its (token, channel) pair, and its outcome is fed back:
+
+- 401 opens the token's circuit; 403 and 404 open the channel's. These are
+  permanent errors (revoked token, lost access, deleted channel): after
+  CIRCUIT_PERMANENT_THRESHOLD in a row the circuit opens and is probed
+  every CIRCUIT_PERMANENT_PROBE seconds, doubling up to CIRCUIT_BACKOFF_MAX.
+- 5xx responses, timeouts and connection errors are transient: after
+  CIRCUIT_TRANSIENT_THRESHOLD in a row the channel's circuit opens for
+  CIRCUIT_BACKOFF seconds, doubling on every failed probe.
+- Any other response means the token and channel work and closes both.
+
+While a circuit is open, sends raise CircuitOpen without a request. Once
+the wait is over the circuit is half-open: the next send is let through
+as the probe and the others still raise until its outcome is recorded.
+State is per process and starts closed, so a restart probes right away.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from ratelimit import token_key
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+PERMANENT_REASONS = {401: "token rejected (HTTP 401)", 403: "missing access to the channel (HTTP 403)",
+                     404: "unknown channel (HTTP 404)"}
+# Bot log lines for a profile's suspension and resumption, written once per change.
+SUSPENDED_MESSAGE = "[{profile}] Bot ditangguhkan: {reason}. Dicoba lagi otomatis."
+RESUMED_MESSAGE = "[{profile}] Bot dilanjutkan."
+
+
+class CircuitOpen(Exception):
+    def __init__(self, scope, reason, retry_after, permanent):
+        super().__init__(f"Circuit open for the {scope}: {reason}; next probe in {retry_after:.0f}s")
+        self.scope = scope
+        self.reason = reason
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+
+def suspension_reason(results):
+    """Why a profile with these {channel_id: result} is suspended, or None when any channel was not cut off."""
+    cut_off = [result for result in results.values() if isinstance(result, CircuitOpen)]
+    if not cut_off or len(cut_off) < len(results):
+        return None
+    return min(cut_off, key=lambda e: e.retry_after).reason
+
+
+class Circuit:
+    __slots__ = ("state", "failures", "opens", "open_until", "reason", "permanent", "probing")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.open_until = 0.0
+        self.reason = None
+        self.permanent = False
+        self.probing = False
+
+
+class CircuitBreaker:
+    def __init__(self, transient_threshold=None, permanent_threshold=None, backoff=None, permanent_probe=None,
+                 backoff_max=None, max_circuits=100_000):
+        self.transient_threshold = transient_threshold or int(os.environ.get("CIRCUIT_TRANSIENT_THRESHOLD", 5))
+        self.permanent_threshold = permanent_threshold or int(os.environ.get("CIRCUIT_PERMANENT_THRESHOLD", 2))
+        self.backoff = backoff or float(os.environ.get("CIRCUIT_BACKOFF", 30))
+        self.permanent_probe = permanent_probe or float(os.environ.get("CIRCUIT_PERMANENT_PROBE", 600))
+        self.backoff_max = backoff_max or float(os.environ.get("CIRCUIT_BACKOFF_MAX", 6 * 3600))
+        self.max_circuits = max_circuits
+        self._lock = threading.Lock()
+        # (token_key,) or (token_key, channel_id) -> Circuit; only endpoints that failed have one.
+        self._circuits = OrderedDict()
+
+    def _circuit(self, key):
+        # Caller holds the lock.
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            circuit = self._circuits[key] = Circuit()
+            while len(self._circuits) > self.max_circuits:
+                self._circuits.popitem(last=False)
+        else:
+            self._circuits.move_to_end(key)
+        return circuit
+
+    def _admit(self, key, scope, now):
+        # Caller holds the lock. Raises CircuitOpen unless a send may go to `key`.
+        circuit = self._circuits.get(key)
+        if circuit is None or circuit.state == CLOSED:
+            return False
+        if circuit.state == OPEN and now >= circuit.open_until:
+            circuit.state = HALF_OPEN
+            circuit.probing = False
+        if circuit.state == HALF_OPEN and not circuit.probing:
+            circuit.probing = True
+            return True
+        raise CircuitOpen(scope, circuit.reason, max(0.0, circuit.open_until - now), circuit.permanent)
+
+    def check(self, token, channel_id):
+        """Raise CircuitOpen if the token or the channel is cut off. Call `record` after a send that was let through."""
+        tk, now = token_key(token), time.time()
+        with self._lock:
+            probe = self._admit((tk,), "token", now)
+            try:
+                self._admit((tk, channel_id), "channel", now)
+            except CircuitOpen:
+                if probe:
+                    self._circuits[(tk,)].probing = False
+                raise
+
+    def record(self, token, channel_id, status=None, error=None):
+        """Feed back a send's HTTP `status`, or the `error` it raised. Neither means it never reached Discord."""
+        tk = token_key(token)
+        with self._lock:
+            if status is None and error is None:
+                # Not sent (rate limited): a probe slot goes to the next send.
+                for key in ((tk,), (tk, channel_id)):
+                    if key in self._circuits:
+                        self._circuits[key].probing = False
+                return
+            if status == 401:
+                self._fail((tk,), PERMANENT_REASONS[401], True)
+            elif status in (403, 404):
+                self._succeed((tk,))
+                self._fail((tk, channel_id), PERMANENT_REASONS[status], True)
+            elif error is not None or status >= 500:
+                self._fail((tk, channel_id), f"HTTP {status}" if status else f"{type(error).__name__}: {error}", False)
+            else:
+                self._succeed((tk,))
+                self._succeed((tk, channel_id))
+
+    def _succeed(self, key):
+        # Caller holds the lock.
+        self._circuits.pop(key, None)
+
+    def _fail(self, key, reason, permanent):
+        # Caller holds the lock.
+        circuit = self._circuit(key)
+        if circuit.permanent != permanent:
+            circuit.failures = 0
+        circuit.failures += 1
+        circuit.reason = reason
+        circuit.permanent = permanent
+        threshold = self.permanent_threshold if permanent else self.transient_threshold
+        if circuit.state == HALF_OPEN or circuit.failures >= threshold:
+            circuit.opens += 1
+            base = self.permanent_probe if permanent else self.backoff
+            circuit.open_until = time.time() + min(base * 2 ** (circuit.opens - 1), self.backoff_max)
+            circuit.state = OPEN
+            circuit.probing = False
+
+    def snapshot(self, tokens=None):
+        keys = {token_key(t) for t in tokens if t} if tokens is not None else None
+        now = time.time()
+        with self._lock:
+            return [{"token": key[0], "channel": key[1] if len(key) > 1 else None, "state": c.state, "reason": c.reason,
+                     "permanent": c.permanent, "failures": c.failures, "opens": c.opens,
+                     "retry_after": round(max(0.0, c.open_until - now), 3) if c.state != CLOSED else None}
+                    for key, c in self._circuits.items() if keys is None or key[0] in keys]
+
+    def open_counts(self):
+        with self._lock:
+            counts = {("token",): 0, ("channel",): 0}
+            for key, circuit in self._circuits.items():
+                if circuit.state != CLOSED:
+                    counts[("token",) if len(key) == 1 else ("channel",)] += 1
+            return counts
+
+
+breaker = CircuitBreaker()
\ No newline at end of file
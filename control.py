@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Bot status and control shared by every gunicorn worker.
+
+The bot_runs table (reached through the storage backend) is the source of truth for which (user_id, profile)
+is running and which process owns its job. Each worker keeps an in-memory
+mirror of it, kept current by "bot_events" notifications, so status reads
+are dict lookups. Start claims the row atomically; stop releases it and
+forwards the stop to the owning process over "bot_control". Owners that
+stop heartbeating are treated as gone, so their rows can be claimed again.
+
+A row stays running when its owner shuts down or dies: the owner is only
+cleared, and the next worker to boot adopts the run and resumes its
+schedule, so deploys and worker recycles do not stop anyone's bots.
+
+A running profile whose token or channels are cut off by the circuit
+breaker (see circuit.py) is marked suspended with the reason; the mark is
+mirrored like the rest of the status and cleared when a probe gets through.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from batch_writer import BatchWriter
+
+log = logging.getLogger("discordbot")
+
+# pg_notify payloads must stay under 8000 bytes.
+MAX_NOTIFY_PAYLOAD = 7000
+
+
+class ControlPlane:
+    def __init__(self, storage, notifier, on_stop, on_event, heartbeat_interval=None, owner_timeout=None):
+        self.storage = storage
+        self.notifier = notifier
+        self.on_stop = on_stop      # on_stop(user_id, profile_name): cancel the local job
+        self.on_event = on_event    # on_event(user_id, type, data): deliver to local listeners
+        self.heartbeat_interval = heartbeat_interval or float(os.environ.get("CONTROL_HEARTBEAT_INTERVAL", 15))
+        self.owner_timeout = owner_timeout or float(os.environ.get("CONTROL_OWNER_TIMEOUT", 60))
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._status = {}       # user_id -> {profile_name: status dict}
+        self._dirty = {}        # (user_id, profile_name) -> (sent_count, last_run datetime)
+        self._suspended = {}    # (user_id, profile_name) -> reason; not stored in bot_runs
+        self._live_owners = set()
+        self._thread = None
+        self._pid = None
+        self._outbox = BatchWriter("bot_events", self._publish_events, max_batch=200, flush_interval=0.2)
+        notifier.subscribe("bot_events", self._on_remote_events)
+        notifier.subscribe("bot_control", self._on_control)
+        notifier.on_reconnect(self.reload)
+
+    @property
+    def owner(self):
+        return self.notifier.origin
+
+    # --- LIFECYCLE ---
+    def ensure_started(self):
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._heartbeat()
+            self.reload()
+            self._thread = threading.Thread(target=self._heartbeat_loop, name="control-heartbeat", daemon=True)
+            self._thread.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                self._heartbeat()
+            except Exception as e:
+                log.error(f"Control heartbeat failed: {e}")
+
+    def _heartbeat(self):
+        now = datetime.now()
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        updates = [(user_id, profile_name, sent, last_run) for (user_id, profile_name), (sent, last_run) in dirty.items()]
+        live = self.storage.heartbeat(self.owner, now, updates, now - timedelta(seconds=self.owner_timeout),
+                                      now - timedelta(seconds=self.owner_timeout * 10))
+        self._live_owners = live | {self.owner}
+
+    def reload(self):
+        """Rebuild the status mirror from bot_runs."""
+        status = {}
+        for user_id, profile_name, running, owner, sent_count, last_run in self.storage.load_runs():
+            status.setdefault(user_id, {})[profile_name] = {
+                "running": bool(running), "owner": owner, "sent_count": sent_count or 0,
+                "last_run": last_run.strftime("%H:%M:%S") if last_run else "-",
+            }
+        with self._lock:
+            self._status = status
+
+    def shutdown(self):
+        """Write pending counters, hand this process's runs back for the next worker to adopt and flush notifications."""
+        try:
+            self._heartbeat()
+            self.storage.release_owner(self.owner, datetime.now())
+        except Exception as e:
+            log.error(f"Control shutdown failed: {e}")
+        self._outbox.close()
+
+    # --- STATUS ---
+    def _is_live(self, entry):
+        return entry["running"] and (entry["owner"] == self.owner or entry["owner"] in self._live_owners)
+
+    def status_for(self, user_id):
+        self.ensure_started()
+        with self._lock:
+            profiles = self._status.get(user_id, {})
+            return {name: {"running": self._is_live(entry), "sent_count": entry["sent_count"], "last_run": entry["last_run"],
+                           "next_run": entry.get("next_run") if self._is_live(entry) else None,
+                           "suspended": self._suspended.get((user_id, name)) if self._is_live(entry) else None}
+                    for name, entry in profiles.items()}
+
+    def is_running(self, user_id, profile_name):
+        self.ensure_started()
+        with self._lock:
+            entry = self._status.get(user_id, {}).get(profile_name)
+            return bool(entry) and self._is_live(entry)
+
+    def is_wanted(self, user_id, profile_name):
+        """True while the profile is meant to run, including when its owner is gone and it waits to be adopted."""
+        self.ensure_started()
+        with self._lock:
+            entry = self._status.get(user_id, {}).get(profile_name)
+            return bool(entry) and entry["running"]
+
+    def _set(self, user_id, profile_name, **changes):
+        with self._lock:
+            entry = self._status.setdefault(user_id, {}).setdefault(
+                profile_name, {"running": False, "owner": None, "sent_count": 0, "last_run": "-"})
+            if changes.pop("sent", False):
+                entry["sent_count"] += 1
+            entry.update(changes)
+            snapshot = dict(entry)
+        self.broadcast(user_id, "status", {"profile": profile_name, **snapshot, "suspended": self._suspended.get((user_id, profile_name))})
+        return snapshot
+
+    # --- CONTROL ---
+    def claim(self, user_id, profile_name):
+        """Atomically mark the profile as running and owned by this process. False if it already runs."""
+        self.ensure_started()
+        now = datetime.now()
+        claimed = self.storage.claim_run(user_id, profile_name, self.owner, now, now - timedelta(seconds=self.owner_timeout))
+        if claimed:
+            self._set(user_id, profile_name, running=True, owner=self.owner, sent_count=0, last_run="-")
+        return claimed
+
+    def claim_many(self, user_id, profile_names):
+        """`claim` for many profiles with one storage round trip. Returns the claimed names."""
+        self.ensure_started()
+        now = datetime.now()
+        claimed = self.storage.claim_runs(user_id, profile_names, self.owner, now, now - timedelta(seconds=self.owner_timeout))
+        for profile_name in profile_names:
+            if profile_name in claimed:
+                self._set(user_id, profile_name, running=True, owner=self.owner, sent_count=0, last_run="-")
+        return claimed
+
+    def adopt(self):
+        """Take over the runs whose owner is gone. Returns their (user_id, profile_name, last_run datetime or None)."""
+        self.ensure_started()
+        now = datetime.now()
+        adopted = self.storage.adopt_runs(self.owner, now, now - timedelta(seconds=self.owner_timeout))
+        for user_id, profile_name, sent_count, last_run in adopted:
+            self._set(user_id, profile_name, running=True, owner=self.owner, sent_count=sent_count or 0,
+                      last_run=last_run.strftime("%H:%M:%S") if last_run else "-")
+        return [(user_id, profile_name, last_run) for user_id, profile_name, _, last_run in adopted]
+
+    def release(self, user_id, profile_name):
+        """Mark the profile stopped and tell its owner (if another process) to cancel the job."""
+        self.ensure_started()
+        with self._lock:
+            entry = self._status.get(user_id, {}).get(profile_name) or {}
+        owner = entry.get("owner")
+        self.storage.stop_run(user_id, profile_name, datetime.now())
+        if owner and owner != self.owner:
+            self.notifier.publish("bot_control", {"op": "stop", "owner": owner, "user_id": user_id, "profile": profile_name})
+        with self._lock:
+            self._dirty.pop((user_id, profile_name), None)
+            self._suspended.pop((user_id, profile_name), None)
+        self._set(user_id, profile_name, running=False)
+
+    def release_many(self, user_id, profile_names):
+        """`release` for many profiles: one storage round trip and one stop message per owning process."""
+        self.ensure_started()
+        remote = {}
+        with self._lock:
+            entries = self._status.get(user_id, {})
+            for profile_name in profile_names:
+                owner = (entries.get(profile_name) or {}).get("owner")
+                if owner and owner != self.owner:
+                    remote.setdefault(owner, []).append(profile_name)
+        self.storage.stop_runs(user_id, profile_names, datetime.now())
+        for owner, names in remote.items():
+            chunk, size = [], 0
+            for name in names:
+                encoded = len(json.dumps(name)) + 1
+                if chunk and size + encoded > MAX_NOTIFY_PAYLOAD:
+                    self.notifier.publish("bot_control", {"op": "stop", "owner": owner, "user_id": user_id, "profiles": chunk})
+                    chunk, size = [], 0
+                chunk.append(name)
+                size += encoded
+            self.notifier.publish("bot_control", {"op": "stop", "owner": owner, "user_id": user_id, "profiles": chunk})
+        with self._lock:
+            for profile_name in profile_names:
+                self._dirty.pop((user_id, profile_name), None)
+                self._suspended.pop((user_id, profile_name), None)
+        for profile_name in profile_names:
+            self._set(user_id, profile_name, running=False)
+
+    def remove(self, user_id, profile_name):
+        self.release(user_id, profile_name)
+        self.storage.delete_run(user_id, profile_name)
+        with self._lock:
+            self._status.get(user_id, {}).pop(profile_name, None)
+
+    def record_send(self, user_id, profile_name, when=None):
+        when = when or datetime.now()
+        snapshot = self._set(user_id, profile_name, sent=True, last_run=when.strftime("%H:%M:%S"))
+        # Counters are written to bot_runs with the next heartbeat, not per send.
+        with self._lock:
+            self._dirty[(user_id, profile_name)] = (snapshot["sent_count"], when)
+
+    def record_counts(self, user_id, profile_name, running, owner, sent_count, last_run):
+        """Counters that an outbox sender already wrote to bot_runs."""
+        self._set(user_id, profile_name, running=bool(running), owner=owner, sent_count=sent_count,
+                  last_run=last_run.strftime("%H:%M:%S") if last_run else "-")
+
+    def set_suspended(self, user_id, profile_name, reason):
+        """Mark the profile suspended with `reason`, or resumed with None. True if that changed its status."""
+        with self._lock:
+            if self._suspended.get((user_id, profile_name)) == reason:
+                return False
+        self.broadcast(user_id, "suspended", {"profile": profile_name, "reason": reason})
+        return True
+
+    def _on_control(self, payload):
+        if payload.get("op") == "stop" and payload.get("owner") == self.owner:
+            for profile_name in payload.get("profiles") or [payload["profile"]]:
+                self.on_stop(payload["user_id"], profile_name)
+
+    # --- EVENTS ---
+    def _track_schedule(self, user_id, data):
+        with self._lock:
+            entry = self._status.get(user_id, {}).get(data["profile"])
+            if entry is not None:
+                entry["next_run"] = data["next_run"]
+
+    def _track_suspended(self, user_id, data):
+        with self._lock:
+            if data["reason"]:
+                self._suspended[(user_id, data["profile"])] = data["reason"]
+            else:
+                self._suspended.pop((user_id, data["profile"]), None)
+
+    def broadcast(self, user_id, event_type, data):
+        """Deliver an event locally and forward it to the other workers."""
+        if event_type == "schedule":
+            self._track_schedule(user_id, data)
+        elif event_type == "suspended":
+            self._track_suspended(user_id, data)
+        self.on_event(user_id, event_type, data)
+        self._outbox.put((user_id, event_type, data))
+
+    def _publish_events(self, events):
+        chunks, chunk, size = [], [], 0
+        for event in events:
+            encoded = len(json.dumps(event))
+            if chunk and size + encoded > MAX_NOTIFY_PAYLOAD:
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(event)
+            size += encoded
+        if chunk:
+            chunks.append(chunk)
+        for chunk in chunks:
+            self.notifier.publish("bot_events", {"events": chunk})
+
+    def _on_remote_events(self, payload):
+        for user_id, event_type, data in payload.get("events", []):
+            if event_type == "status":
+                entry = {k: data[k] for k in ("running", "owner", "sent_count", "last_run") if k in data}
+                with self._lock:
+                    self._status.setdefault(user_id, {}).setdefault(data["profile"], {}).update(entry)
+            elif event_type == "schedule":
+                self._track_schedule(user_id, data)
+            elif event_type == "suspended":
+                self._track_suspended(user_id, data)
+            self.on_event(user_id, event_type, data)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Thread-safe database connection pool with a context-manager API.
+
+    with pool.connection() as conn:
+        ...
+
+commits on success and rolls back on error. Connections idle for longer
+than `check_after` seconds are pinged on checkout and replaced if dead.
+The pool is per process: after a fork (gunicorn worker) it starts empty.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect_fn, size=None, check_after=30.0, acquire_timeout=30.0):
+        self.connect_fn = connect_fn
+        self.size = size or int(os.environ.get("DB_POOL_SIZE", 5))
+        self.check_after = check_after
+        self.acquire_timeout = acquire_timeout
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle = []  # (conn, last_used)
+        self._stats = {"checkouts": 0, "created": 0, "discarded": 0, "in_use": 0,
+                       "wait_total": 0.0, "wait_max": 0.0, "timeouts": 0}
+
+    def _healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._stats["discarded"] += 1
+
+    def _checkout(self):
+        if self._pid != os.getpid():
+            self._reset()
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available after {self.acquire_timeout}s")
+        waited = time.monotonic() - started
+        try:
+            conn = None
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    candidate, last_used = self._idle.pop()
+                if self._healthy(candidate, last_used):
+                    conn = candidate
+                    break
+                self._discard(candidate)
+            if conn is None:
+                conn = self.connect_fn()
+                with self._lock:
+                    self._stats["created"] += 1
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_total"] += waited
+            self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+        return conn
+
+    def _checkin(self, conn, broken=False):
+        with self._lock:
+            self._stats["in_use"] -= 1
+        if broken or conn.closed:
+            self._discard(conn)
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self._checkin(conn, broken)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=self.size, idle=len(self._idle))
+        stats["wait_avg"] = stats["wait_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Keep-alive HTTP(S) connection pool for the Discord API.
+
+Connections are reused across sends and profiles instead of paying a TCP
+connect + TLS handshake per message. The target defaults to
+https://discord.com and can be pointed at a local stand-in server with
+DISCORD_API_BASE (e.g. http://127.0.0.1:8080).
+"""
+import http.client
+import os
+import socket
+import threading
+import time
+from collections import deque, namedtuple
+from urllib.parse import urlsplit
+
+API_PREFIX = "/api/v10"
+
+Response = namedtuple("Response", ["status", "reason", "headers", "body"])
+
+# Errors that mean a pooled connection was closed by the peer while idle.
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+
+
+class ConnectionPool:
+    def __init__(self, base_url=None, max_idle=None, idle_timeout=None, timeout=30):
+        parts = urlsplit(base_url or os.environ.get("DISCORD_API_BASE", "https://discord.com"))
+        self.scheme = parts.scheme or "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.scheme == "https" else 80)
+        self.max_idle = max_idle if max_idle is not None else int(os.environ.get("DISCORD_POOL_MAX_IDLE", 32))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.environ.get("DISCORD_POOL_IDLE_TIMEOUT", 60))
+        self.timeout = timeout
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "reused": 0, "handshakes": 0, "reconnects": 0, "closed": 0}
+
+    # --- CONNECTIONS ---
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        conn = cls(self.host, self.port, timeout=self.timeout)
+        conn.connect()
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._lock:
+            self._stats["handshakes"] += 1
+        return conn
+
+    def _checkout(self):
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            while self._idle:
+                candidate, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    conn = candidate
+                    break
+                stale.append(candidate)
+            # Anything older than the freshest idle connection has expired too.
+            while self._idle and now - self._idle[0][1] > self.idle_timeout:
+                stale.append(self._idle.popleft()[0])
+        for c in stale:
+            self._close(c)
+        if conn:
+            return conn, True
+        return self._connect(), False
+
+    def _checkin(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((conn, time.monotonic()))
+                return
+        self._close(conn)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._stats["closed"] += 1
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+    # --- REQUESTS ---
+    def _send(self, conn, method, path, body, headers):
+        conn.request(method, path, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        data = resp.read()
+        return Response(resp.status, resp.reason, resp.msg, data), resp.will_close
+
+    def request(self, method, path, body=None, headers=None):
+        conn, reused = self._checkout()
+        try:
+            try:
+                result, will_close = self._send(conn, method, path, body, headers)
+            except STALE_ERRORS:
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection; retry once on a fresh one.
+                self._close(conn)
+                with self._lock:
+                    self._stats["reconnects"] += 1
+                conn, reused = self._connect(), False
+                result, will_close = self._send(conn, method, path, body, headers)
+        except Exception:
+            self._close(conn)
+            raise
+        with self._lock:
+            self._stats["requests"] += 1
+            if reused:
+                self._stats["reused"] += 1
+        if will_close:
+            self._close(conn)
+        else:
+            self._checkin(conn)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def post_message(channel_id, headers, body):
+    return get_pool().request("POST", f"{API_PREFIX}/channels/{channel_id}/messages", body=body, headers=headers)
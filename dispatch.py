@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Fair-share dispatch of sends between the scheduler and Discord.
+
+Due sends are queued per owner (a user_id) and run by DISPATCH_CONCURRENCY
+worker threads, so at most that many sends are in flight in a worker no
+matter how many profiles fire at once. A send costs one slot per channel
+(capped at the whole budget), as a fan-out holds that many connections.
+
+Owners are served by deficit round robin: each turn an owner's deficit
+grows by its weight (DISPATCH_WEIGHTS, "user_id:weight,...", default 1)
+and it may start sends while the deficit covers their cost. A user with
+500 profiles due therefore waits behind their own queue, not in front of
+everyone else's.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import metrics
+
+DISPATCH_WAIT = metrics.histogram("discordbot_dispatch_wait_seconds", "Time due sends wait in the dispatch queue.",
+                                  buckets=metrics.LAG_BUCKETS)
+
+
+def parse_weights(spec):
+    """{owner: weight} from "owner:weight,..."; owners are kept as strings and ints when numeric."""
+    weights = {}
+    for item in (spec or "").split(","):
+        owner, _, weight = item.strip().partition(":")
+        if owner and weight:
+            weights[int(owner) if owner.isdigit() else owner] = float(weight)
+    return weights
+
+
+class _Task:
+    __slots__ = ("fn", "units", "future", "queued_at")
+
+    def __init__(self, fn, units):
+        self.fn = fn
+        self.units = units
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+
+class Dispatcher:
+    def __init__(self, concurrency=None, weights=None):
+        self.concurrency = concurrency or int(os.environ.get("DISPATCH_CONCURRENCY", 16))
+        self.weights = weights if weights is not None else parse_weights(os.environ.get("DISPATCH_WEIGHTS"))
+        self._cond = threading.Condition()
+        self._queues = {}       # owner -> deque of _Task
+        self._active = deque()  # owners with queued tasks, in round-robin order
+        self._deficit = {}      # owner -> units it may still start this turn
+        self._topped = set()    # owners whose deficit was already topped up this turn
+        self._in_use = 0
+        self._queued = 0
+        self._threads = []
+        self._pid = None
+        self._closed = False
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def ensure_started(self):
+        # Started lazily so that each gunicorn worker runs its own after fork.
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._closed = False
+            self._threads = [threading.Thread(target=self._run, name=f"dispatch-{i}", daemon=True)
+                             for i in range(self.concurrency)]
+            for thread in self._threads:
+                thread.start()
+
+    def set_weight(self, owner, weight):
+        with self._cond:
+            if weight is None:
+                self.weights.pop(owner, None)
+            else:
+                self.weights[owner] = float(weight)
+
+    def submit(self, owner, fn, cost=1):
+        """Queue `fn()` for `owner`; returns a concurrent.futures.Future with its result."""
+        self.ensure_started()
+        task = _Task(fn, max(1, min(int(cost), self.concurrency)))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Dispatcher is closed")
+            queue = self._queues.get(owner)
+            if queue is None:
+                queue = self._queues[owner] = deque()
+                self._active.append(owner)
+                self._deficit[owner] = 0.0
+            queue.append(task)
+            self._queued += 1
+            self._stats["submitted"] += 1
+            self._cond.notify()
+        return task.future
+
+    # --- INTERNALS ---
+    def _next(self):
+        """The next task by deficit round robin, or None if the budget is spent. Caller holds the lock."""
+        while self._active:
+            owner = self._active[0]
+            task = self._queues[owner][0]
+            if owner not in self._topped:
+                self._topped.add(owner)
+                self._deficit[owner] += max(self.weights.get(owner, 1.0), 0.01)
+            if self._deficit[owner] < task.units:
+                # Turn over; the owner keeps its deficit for the next round.
+                self._topped.discard(owner)
+                self._active.rotate(-1)
+                continue
+            if self._in_use + task.units > self.concurrency:
+                # Wait for slots rather than letting a cheaper send from another owner jump ahead.
+                return None
+            queue = self._queues[owner]
+            queue.popleft()
+            self._deficit[owner] -= task.units
+            if not queue:
+                del self._queues[owner], self._deficit[owner]
+                self._topped.discard(owner)
+                self._active.popleft()
+            self._in_use += task.units
+            self._queued -= 1
+            return task
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                task = self._next()
+                while task is None and not self._closed:
+                    self._cond.wait()
+                    task = self._next()
+                if task is None:
+                    return
+            wait = time.monotonic() - task.queued_at
+            DISPATCH_WAIT.observe(wait)
+            failed = False
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.fn())
+                except BaseException as e:
+                    failed = True
+                    task.future.set_exception(e)
+            with self._cond:
+                self._in_use -= task.units
+                self._stats["completed"] += 1
+                self._stats["failed"] += failed
+                self._stats["wait_total"] += wait
+                self._stats["wait_max"] = max(self._stats["wait_max"], wait)
+                self._cond.notify_all()
+
+    def stats(self, top=10):
+        with self._cond:
+            depths = sorted(((owner, len(queue)) for owner, queue in self._queues.items()), key=lambda item: -item[1])
+            return {"concurrency": self.concurrency, "in_use": self._in_use, "queued": self._queued, "users_waiting": len(depths),
+                    "deepest": {str(owner): depth for owner, depth in depths[:top]},
+                    "submitted": self._stats["submitted"], "completed": self._stats["completed"], "failed": self._stats["failed"],
+                    "wait_avg": round(self._stats["wait_total"] / self._stats["completed"], 3) if self._stats["completed"] else None,
+                    "wait_max": round(self._stats["wait_max"], 3),
+                    "weights": {str(owner): weight for owner, weight in self.weights.items()}}
+
+    def close(self):
+        """Stop the workers; sends still queued are cancelled."""
+        with self._cond:
+            self._closed = True
+            pending = [task for queue in self._queues.values() for task in queue]
+            self._queues.clear()
+            self._active.clear()
+            self._deficit.clear()
+            self._topped.clear()
+            self._queued = 0
+            self._cond.notify_all()
+        for task in pending:
+            task.future.cancel()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Per-user event bus backing the /api/events Server-Sent Events stream.
+
+Each user has a bounded history of recent events so a reconnecting client
+can resume from its Last-Event-ID. Event ids are "<boot>-<seq>"; an id from
+another process lifetime, or one that has already fallen out of the
+history, gets a single "reset" event telling the client to reload.
+
+Each open stream holds a server thread for as long as the tab is open, so
+`open_stream` caps them per worker and per user; past either cap the route
+answers 503 and the client falls back to polling.
+"""
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+
+Event = namedtuple("Event", ["id", "type", "data"])
+
+
+class _Channel:
+    __slots__ = ("cond", "history", "seq")
+
+    def __init__(self, size):
+        self.cond = threading.Condition()
+        self.history = deque(maxlen=size)
+        self.seq = 0
+
+
+class EventBus:
+    def __init__(self, history=500, max_streams=None, max_streams_per_user=None):
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.history_size = history
+        self.max_streams = max_streams
+        self.max_streams_per_user = max_streams_per_user
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._streams = {}  # user_id -> open streams in this process
+        self._open = 0
+
+    def open_stream(self, user_id):
+        """Reserve a stream slot for `user_id`. False when a cap is reached; pair a True with `close_stream`."""
+        with self._lock:
+            if self.max_streams and self._open >= self.max_streams:
+                return False
+            if self.max_streams_per_user and self._streams.get(user_id, 0) >= self.max_streams_per_user:
+                return False
+            self._open += 1
+            self._streams[user_id] = self._streams.get(user_id, 0) + 1
+            return True
+
+    def close_stream(self, user_id):
+        with self._lock:
+            self._open -= 1
+            left = self._streams.get(user_id, 1) - 1
+            if left:
+                self._streams[user_id] = left
+            else:
+                self._streams.pop(user_id, None)
+
+    def stream_stats(self):
+        with self._lock:
+            return {"open": self._open, "users": len(self._streams), "max_streams": self.max_streams,
+                    "max_streams_per_user": self.max_streams_per_user}
+
+    def _channel(self, user_id):
+        channel = self._channels.get(user_id)
+        if channel is None:
+            with self._lock:
+                channel = self._channels.setdefault(user_id, _Channel(self.history_size))
+        return channel
+
+    def publish(self, user_id, event_type, data):
+        channel = self._channel(user_id)
+        with channel.cond:
+            channel.seq += 1
+            event = Event(f"{self.boot_id}-{channel.seq}", event_type, data)
+            channel.history.append((channel.seq, event))
+            channel.cond.notify_all()
+        return event.id
+
+    def _parse(self, last_id):
+        boot, _, seq = (last_id or "").partition("-")
+        if boot != self.boot_id or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def wait(self, user_id, last_id=None, timeout=15.0):
+        """Block until there are events after `last_id` or `timeout` expires.
+
+        Returns (events, cursor) where cursor is the id to pass on the next call.
+        """
+        channel = self._channel(user_id)
+        deadline = time.monotonic() + timeout
+        with channel.cond:
+            if last_id is None:
+                return [], f"{self.boot_id}-{channel.seq}"
+            seq = self._parse(last_id)
+            oldest = channel.history[0][0] if channel.history else channel.seq + 1
+            if seq is None or seq > channel.seq or seq + 1 < oldest:
+                return [Event(f"{self.boot_id}-{channel.seq}", "reset", {})], f"{self.boot_id}-{channel.seq}"
+            while channel.seq == seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], last_id
+                channel.cond.wait(remaining)
+            events = [event for event_seq, event in channel.history if event_seq > seq]
+            return events, events[-1].id
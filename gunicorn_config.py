@@ -1,3 +1,49 @@
 # gunicorn_config.py
+import os
+
 bind = "0.0.0.0:10000"
-workers = 2
\ No newline at end of file
+# The SQLite backend has no cross-process messaging (LISTEN/NOTIFY), so it runs one worker.
+workers = 1 if os.environ.get("STORAGE_BACKEND", "postgres").lower() == "sqlite" else 2
+# /api/events keeps a connection open per browser tab, so each worker serves
+# requests from a thread pool instead of a single sync thread. A stream holds
+# its thread for as long as the tab is open; the app lets streams take at most
+# SSE_MAX_STREAMS (default half of these threads) and answers 503 past that.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+# With Postgres each worker keeps its own pool of DB_POOL_SIZE database connections (default 5).
+
+
+def on_starting(server):
+    # Metrics from the previous run would otherwise be merged into this one's /metrics.
+    import metrics
+    metrics.MultiProcessExporter().clear()
+    # Migrate once here, so workers only check the schema version when they import the app.
+    from storage import open_storage
+    storage = open_storage()
+    applied = storage.migrate()
+    storage.close()
+    if applied:
+        server.log.info(f"Applied schema migrations {applied}.")
+
+
+def post_fork(server, worker):
+    # The app's boot report measures from here.
+    import time
+    os.environ["WORKER_FORKED_AT"] = str(time.time())
+
+
+def worker_exit(server, worker):
+    # Finish in-flight uploads, flush queued send and log rows, hand this worker's bots back and drain the log queue before it goes away.
+    import app
+    app.bulk_executor.shutdown(wait=True)
+    app.janitor.close()
+    for key in app.scheduler.keys():
+        app.scheduler.cancel(key)
+    app.outbox_worker.close()
+    app.dispatcher.close()
+    app.control.shutdown()
+    app.upload_manager.close()
+    app.send_writer.close()
+    app.log_writer.close()
+    app.metrics_exporter.close()
+    app.log_listener.stop()
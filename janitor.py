@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Background upkeep of the sends history.
+
+Every JANITOR_INTERVAL seconds (and once at startup) the janitor:
+
+- creates the sends partitions for this month and the next;
+- expires send rows older than SENDS_RETENTION_DAYS (0 keeps them forever).
+  Their per-hour counts stay in send_rollups, which analytics reads;
+- purges the send rows of deleted profiles, JANITOR_BATCH rows per
+  transaction, so a profile with millions of sends never holds a long lock;
+- deletes outbox ticks finished more than OUTBOX_RETENTION_HOURS ago.
+
+Each worker runs one; the Postgres side uses advisory locks so that only one
+of them drops partitions at a time.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+log = logging.getLogger("discordbot")
+
+
+class Janitor:
+    def __init__(self, storage, retention_days=None, interval=None, batch=None):
+        self.storage = storage
+        self.retention_days = retention_days if retention_days is not None else int(os.environ.get("SENDS_RETENTION_DAYS", 90))
+        self.interval = interval or float(os.environ.get("JANITOR_INTERVAL", 3600))
+        self.batch = batch or int(os.environ.get("JANITOR_BATCH", 5000))
+        self.outbox_retention_hours = float(os.environ.get("OUTBOX_RETENTION_HOURS", 24))
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stats = {"runs": 0, "failed": 0, "expired": 0, "purged": 0, "outbox_expired": 0, "last_run": None, "last_seconds": None}
+
+    def ensure_started(self):
+        # Started lazily so that each gunicorn worker runs its own after fork.
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="janitor", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self._stats["failed"] += 1
+                log.error(f"Janitor run failed: {e}")
+            self._stop.wait(self.interval)
+
+    def run_once(self, now=None):
+        now = now or datetime.now()
+        started = time.perf_counter()
+        self.storage.ensure_partitions(now)
+        expired = 0
+        if self.retention_days > 0:
+            expired = self.storage.expire_sends(now - timedelta(days=self.retention_days), self.batch)
+        purged = 0
+        while not self._stop.is_set():
+            deleted = self.storage.purge_deleted_profiles(self.batch)
+            if deleted is None:
+                break
+            purged += deleted
+        outbox_expired = 0
+        while not self._stop.is_set():
+            deleted = self.storage.expire_outbox(now - timedelta(hours=self.outbox_retention_hours), self.batch)
+            outbox_expired += deleted
+            if deleted < self.batch:
+                break
+        elapsed = time.perf_counter() - started
+        self._stats["runs"] += 1
+        self._stats["expired"] += expired
+        self._stats["purged"] += purged
+        self._stats["outbox_expired"] += outbox_expired
+        self._stats["last_run"] = now.isoformat(timespec="seconds")
+        self._stats["last_seconds"] = round(elapsed, 3)
+        if expired or purged:
+            unit = "partitions" if self.storage.backend == "postgres" else "rows"
+            log.info(f"Janitor expired {expired} send {unit} and purged {purged} rows of deleted profiles in {elapsed:.2f}s.")
+
+    def stats(self):
+        return dict(self._stats, retention_days=self.retention_days, interval=self.interval)
+
+    def close(self):
+        self._stop.set()
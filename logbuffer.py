@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Non-blocking logging and per-user recent-log rings.
+
+`start_queue_logging` puts a QueueHandler on a logger so `log.info()` only
+formats the record and enqueues it; a QueueListener thread does the file
+and stdout writes.
+
+`LogRing` keeps the last `size` bot log lines of each user in memory, for
+/api/logs and the dashboard. Lines reach it through the control plane's
+"log" events, so every worker has the lines of bots running in the others.
+When persistence is on, a user's ring is seeded once from the logs table
+so history survives a restart.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from logging.handlers import QueueHandler, QueueListener
+
+
+def start_queue_logging(logger, *handlers):
+    """Route `logger` through a queue to `handlers`. Returns the running QueueListener."""
+    records = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(records))
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # Drain what is still queued when the interpreter exits.
+    atexit.register(listener.stop)
+    return listener
+
+
+class LogRing:
+    def __init__(self, size=None, max_users=10_000, load=None):
+        self.size = size or int(os.environ.get("LOG_RING_SIZE", 200))
+        self.max_users = max_users
+        # load(user_id, limit) -> persisted lines, newest first; None when logs are not persisted.
+        self.load = load
+        self._lock = threading.Lock()
+        self._rings = OrderedDict()  # user_id -> deque of lines, oldest first
+        self._seeded = set()
+
+    def _ring(self, user_id):
+        # Caller holds the lock.
+        ring = self._rings.get(user_id)
+        if ring is None:
+            ring = self._rings[user_id] = deque(maxlen=self.size)
+            while len(self._rings) > self.max_users:
+                evicted, _ = self._rings.popitem(last=False)
+                self._seeded.discard(evicted)
+        else:
+            self._rings.move_to_end(user_id)
+        return ring
+
+    def append(self, user_id, line):
+        with self._lock:
+            self._ring(user_id).append(line)
+
+    def _seed(self, user_id):
+        with self._lock:
+            if self.load is None or user_id in self._seeded:
+                return
+            self._seeded.add(user_id)
+        try:
+            persisted = self.load(user_id, self.size)
+        except Exception:
+            with self._lock:
+                self._seeded.discard(user_id)
+            raise
+        known = set(persisted)
+        with self._lock:
+            ring = self._ring(user_id)
+            # Lines logged here since startup may already have been flushed to the table.
+            recent = [line for line in ring if line not in known]
+            ring.clear()
+            ring.extend(reversed(persisted))
+            ring.extend(recent)
+
+    def recent(self, user_id, limit=None):
+        """The user's latest `limit` lines, oldest first."""
+        self._seed(user_id)
+        with self._lock:
+            ring = self._rings.get(user_id)
+            if not ring:
+                return []
+            lines = list(ring)
+        return lines[-limit:] if limit else lines
+
+    def clear(self, user_id):
+        with self._lock:
+            self._seeded.add(user_id)
+            ring = self._rings.get(user_id)
+            if ring is not None:
+                ring.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._rings), "lines": sum(len(ring) for ring in self._rings.values()),
+                    "size": self.size, "persisted": self.load is not None}
@@ -1,23 +1,48 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Discord Auto Message Bot
-Runs 24/7, posts to a channel every N seconds
+Discord Auto Message Bot - headless runner
+
+Runs every profile of a config file 24/7 on the same scheduler, payload
+compiler and sender as the web app, without Flask or a database. The
+config (BOT_CONFIG, default config.json) may be:
+
+- the web app's export: {"users": {"<id>": {"profiles": {"<name>": {...}}}}}
+- a profile map: {"profiles": {"<name>": {...}}}
+- the original single-bot form: {"Config": [{"token", "channelid", "messages" or "message", "interval_seconds"}]}
+
+Profiles use the web app's fields (token, channelid, schedule_mode,
+interval_seconds, cron_expression, jitter_seconds, messages); "enabled":
+false skips one. Sends share the web app's fair-share dispatch queue, with
+the users of an export as its owners, and its circuit breaker: a profile
+whose token or channels are dead is suspended until a probe gets through.
+The file is re-read when it changes: new and edited profiles are
+(re)started, removed ones stopped, and the rest keep their schedule.
 """
 
-import http.client
 import json
-import time
 import os
+import signal
 import sys
-import random
+import threading
 import logging
 from logging.handlers import RotatingFileHandler
-from datetime import datetime
+
+import discord_client
+import sender
+from circuit import CircuitOpen, RESUMED_MESSAGE, SUSPENDED_MESSAGE, suspension_reason
+from dispatch import Dispatcher
+from logbuffer import start_queue_logging
+from payloads import AttachmentCache, CompiledProfile
+from ratelimit import RateLimited
+from scheduler import Scheduler
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CFG_PATH = os.path.join(BASE_DIR, 'config.json')
-LOG_PATH = os.path.join(BASE_DIR, 'bot.log')
+CFG_PATH = os.environ.get('BOT_CONFIG', os.path.join(BASE_DIR, 'config.json'))
+LOG_PATH = os.path.join(os.environ.get('RENDER_DATA_DIR', BASE_DIR), 'bot.log')
+# How often the config file is checked for changes.
+POLL_SECONDS = float(os.environ.get('CONFIG_POLL_SECONDS', 2))
+CRON_MODES = ('cron_simple', 'cron_advanced')
 
 # --- Logging setup ---
 def setup_logger():
@@ -28,100 +53,163 @@ def setup_logger():
     fh = RotatingFileHandler(LOG_PATH, maxBytes=1_000_000, backupCount=3, encoding="utf-8")
     fmt = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s", "%Y-%m-%d %H:%M:%S")
     fh.setFormatter(fmt)
-    logger.addHandler(fh)
 
     # Console logs (systemd/journald will capture)
     ch = logging.StreamHandler(sys.stdout)
     ch.setFormatter(fmt)
-    logger.addHandler(ch)
 
+    # Sends log from the scheduler's threads; the writes happen on the listener's.
+    start_queue_logging(logger, fh, ch)
     return logger
 
 log = setup_logger()
+dispatcher = Dispatcher()
+scheduler = Scheduler(dispatch=lambda key, action, cost: dispatcher.submit(key.partition('/')[0], action, cost))
+attachments = AttachmentCache()
+# key -> why the profile is suspended by the circuit breaker (see circuit.py); the web app keeps this
+# on its control plane, which a headless run does not have.
+suspended = {}
 
 # --- Config loader ---
-def load_config():
-    with open(CFG_PATH, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    cfg = (data.get('Config') or [{}])[0]
+def _legacy_profile(cfg):
     token = (cfg.get('token') or '').strip()
-    channel_id = str(cfg.get('channelid') or '').strip()
 
     # Messages: either "messages" list or single "message"
     messages = cfg.get('messages')
     if not (messages and isinstance(messages, list) and len(messages) > 0):
-        single = cfg.get('message') or "Hello from VPS!"
-        messages = [single]
-
-    interval = int(cfg.get('interval_seconds') or 3600)
+        messages = [cfg.get('message') or "Hello from VPS!"]
 
     # Ensure token has "Bot " prefix
     if token and not token.lower().startswith("bot "):
         log.warning('Token missing "Bot " prefix. Adding automatically...')
         token = "Bot " + token
 
-    if not token or not channel_id:
-        raise ValueError("Config missing required fields: 'token' and 'channelid'.")
+    return {"token": token, "channelid": str(cfg.get('channelid') or '').strip(), "schedule_mode": "interval",
+            "interval_seconds": int(cfg.get('interval_seconds') or 3600), "messages": messages}
 
-    return channel_id, token, messages, interval
-
-# --- HTTP helpers ---
-def get_headers(token):
-    return {
-        "Content-Type": "application/json",
-        "User-Agent": "DiscordBot",
-        "Authorization": token
-    }
-
-def get_connection():
-    return http.client.HTTPSConnection("discord.com", 443, timeout=30)
-
-# --- Message renderer ---
-def render_message(template: str) -> str:
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    return template.replace("{now}", now)
-
-# --- Send message ---
-def send_message(channel_id, token, content):
-    body = json.dumps({"content": content, "tts": False})
-    headers = get_headers(token)
-    conn = get_connection()
-    try:
-        conn.request("POST", f"/api/v10/channels/{channel_id}/messages", body=body, headers=headers)
-        resp = conn.getresponse()
-        resp_body = resp.read()
-        if 199 < resp.status < 300:
-            log.info("Message sent successfully.")
+def _expect(value, kind, what):
+    if not isinstance(value, kind):
+        raise ValueError(f"{what} must be a JSON {'object' if kind is dict else 'array'}, not {type(value).__name__}")
+    return value
+
+def load_config():
+    """{key: profile} for the enabled profiles in CFG_PATH. Raises OSError or ValueError."""
+    with open(CFG_PATH, 'r', encoding='utf-8') as f:
+        data = _expect(json.load(f), dict, "The config")
+
+    if 'users' in data:
+        profiles = {}
+        for user_id, user in _expect(data['users'], dict, '"users"').items():
+            user_profiles = _expect(_expect(user, dict, f"User {user_id}").get('profiles') or {}, dict,
+                                    f"The profiles of user {user_id}")
+            profiles.update((f"{user_id}/{name}", cfg) for name, cfg in user_profiles.items())
+    elif 'profiles' in data:
+        profiles = dict(_expect(data['profiles'], dict, '"profiles"'))
+    else:
+        entries = _expect(data.get('Config') or [], list, '"Config"')
+        for i, cfg in enumerate(entries):
+            _expect(cfg, dict, f'"Config" entry {i}')
+        profiles = {cfg.get('name') or f"config-{i}": _legacy_profile(cfg) for i, cfg in enumerate(entries)}
+
+    for key, cfg in profiles.items():
+        _expect(cfg, dict, f"Profile {key}")
+        _expect(cfg.get('messages') or [], list, f"The messages of {key}")
+        # Plain strings are text messages, as in the original config format.
+        cfg['messages'] = [{"type": "text", "content": m} if isinstance(m, str) else m for m in cfg.get('messages') or []]
+    return {key: cfg for key, cfg in profiles.items() if cfg.get('enabled', True)}
+
+# --- Sending ---
+def run_once(key, profile):
+    results, limited = sender.send_profile(profile)
+    if limited:
+        # Retried after retry_after instead of waiting a full interval.
+        log.warning(f"[{key}] {limited}")
+        return limited.retry_after
+    reason = suspension_reason(results)
+    if reason != suspended.get(key):
+        if reason:
+            log.error(SUSPENDED_MESSAGE.format(profile=key, reason=reason))
+            suspended[key] = reason
         else:
-            snippet = (resp_body[:300] if resp_body else b'').decode(errors="ignore")
-            log.error("HTTP %s %s | response: %s", resp.status, resp.reason, snippet)
-    except Exception as e:
-        log.exception("Exception while sending message: %s", e)
-    finally:
+            log.info(RESUMED_MESSAGE.format(profile=key))
+            suspended.pop(key)
+    for channel_id, result in results.items():
+        if isinstance(result, RateLimited):
+            log.warning(f"[{key}] Channel {channel_id} skipped this time: {result}")
+        elif isinstance(result, CircuitOpen):
+            continue
+        elif result:
+            log.info(f"[{key}] Message sent to channel {channel_id}.")
+        else:
+            log.error(f"[{key}] Failed to send to channel {channel_id}.")
+
+def on_error(key, error):
+    log.error(f"[{key}] Stopped: {error}")
+
+def start(key, cfg):
+    """Schedule `cfg` under `key`, replacing its current job. Raises ValueError on a bad profile."""
+    profile = CompiledProfile(cfg.get('token', ''), cfg.get('channelid', ''), cfg.get('messages'), attachments)
+    if not profile.token or not profile.channel_ids:
+        raise ValueError("Config missing required fields: 'token' and 'channelid'.")
+    action = lambda: run_once(key, profile)
+    options = dict(on_error=on_error, jitter=int(cfg.get('jitter_seconds') or 0), cost=len(profile.channel_ids))
+    if cfg.get('schedule_mode') in CRON_MODES:
+        scheduler.add(key, action, cron_expr=cfg.get('cron_expression', ''), **options)
+    else:
+        scheduler.add(key, action, interval=int(cfg.get('interval_seconds') or 300), **options)
+
+def apply_config(profiles, running):
+    """Make the scheduler run `profiles`. `running` is what the last call applied; returns the new map."""
+    for key in set(running) - set(profiles):
+        scheduler.cancel(key)
+        suspended.pop(key, None)
+        log.info(f"[{key}] Stopped (removed from config).")
+    applied = {}
+    for key, cfg in profiles.items():
+        if running.get(key) == cfg and scheduler.is_scheduled(key):
+            applied[key] = cfg
+            continue
         try:
-            conn.close()
-        except:
-            pass
+            start(key, cfg)
+        except (ValueError, TypeError, AttributeError) as e:
+            scheduler.cancel(key)
+            log.error(f"[{key}] Not started: {e}")
+            continue
+        applied[key] = cfg
+        mode = cfg.get('schedule_mode') if cfg.get('schedule_mode') in CRON_MODES else f"every {int(cfg.get('interval_seconds') or 300)}s"
+        log.info(f"[{key}] {'Restarted' if key in running else 'Started'} | channels={cfg.get('channelid')} | {mode} | messages={len(cfg['messages'])}")
+    return applied
 
 # --- Main loop ---
 def main():
-    channel_id, token, messages, interval = load_config()
-    log.info("Bot started | channel=%s | interval=%ss | messages=%d",
-             channel_id, interval, len(messages))
-
-    while True:
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    loaded_mtime, running = None, {}
+    while not stop.is_set():
         try:
-            msg_template = random.choice(messages)
-            content = render_message(msg_template)
-            send_message(channel_id, token, content)
-        except Exception as e:
-            log.exception("Error in loop: %s", e)
-        time.sleep(interval)
+            mtime = os.stat(CFG_PATH).st_mtime_ns
+        except OSError as e:
+            mtime = None
+            if loaded_mtime is not None:
+                log.error(f"Config {CFG_PATH} unreadable: {e}")
+        if mtime is not None and mtime != loaded_mtime:
+            loaded_mtime = mtime
+            try:
+                profiles = load_config()
+            except (OSError, ValueError) as e:
+                log.error(f"Could not load {CFG_PATH}, keeping the running profiles: {e}")
+            else:
+                running = apply_config(profiles, running)
+                log.info(f"Config loaded from {CFG_PATH}: {len(running)} of {len(profiles)} profiles running.")
+        stop.wait(POLL_SECONDS)
+    for key in scheduler.keys():
+        scheduler.cancel(key)
+    dispatcher.close()
+    log.info("Stopped. Connection stats: %s", discord_client.get_pool().stats())
 
 if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        log.info("Stopped by user (KeyboardInterrupt).")
+        log.info("Stopped by user (KeyboardInterrupt). Connection stats: %s", discord_client.get_pool().stats())
         sys.exit(0)
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+In-process metrics with a Prometheus text exposition.
+
+Counters, gauges and histograms keep their samples in dicts keyed by label
+values and are updated under a per-metric lock; nothing is formatted until
+a scrape. Values that already live elsewhere (pool sizes, thread counts)
+are registered as callbacks and read at collection time.
+
+Across gunicorn workers: each process writes its samples to
+<METRICS_DIR>/<pid>.json every METRICS_INTERVAL seconds (and right before
+a scrape it serves), and `render()` merges the files of every worker.
+Counters and histograms are summed over all files, including workers that
+have exited, so totals never go backwards on a worker restart; gauges are
+summed over live workers only.
+"""
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+log = logging.getLogger("discordbot")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def remove(self, *labels):
+        with self._lock:
+            self._values.pop(labels, None)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then sum.
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def timed(self, *labels):
+        """Decorator form of `time`."""
+        def decorate(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.time(*labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def samples(self):
+        with self._lock:
+            return [(labels, list(state)) for labels, state in self._values.items()]
+
+
+class _Callback(_Metric):
+    def __init__(self, name, help, kind, fn, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        # fn() returns a number, or {label tuple: number} for labelled metrics.
+        try:
+            value = self.fn()
+        except Exception as e:
+            log.error(f"Metric callback {self.name} failed: {e}")
+            return []
+        if isinstance(value, dict):
+            return list(value.items())
+        return [((), value)]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, kind="gauge", labelnames=()):
+        return self._register(_Callback(name, help, kind, fn, labelnames))
+
+    def collect(self):
+        """A JSON-serializable snapshot of every metric in this process."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            entry = {"kind": metric.kind, "help": metric.help, "labels": list(metric.labelnames),
+                     "samples": [[list(labels), value] for labels, value in metric.samples()]}
+            if metric.kind == "histogram":
+                entry["buckets"] = list(metric.buckets)
+            snapshot[metric.name] = entry
+        return snapshot
+
+
+REGISTRY = Registry()
+counter, gauge, histogram, callback = REGISTRY.counter, REGISTRY.gauge, REGISTRY.histogram, REGISTRY.callback
+
+
+# --- MULTI-PROCESS ---
+def _alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(snapshots):
+    """Merge (pid, snapshot) pairs into {name: entry} with one value per label set."""
+    merged = {}
+    for pid, snapshot in snapshots:
+        live = _alive(pid)
+        for name, entry in snapshot.items():
+            if entry["kind"] == "gauge" and not live:
+                continue
+            target = merged.setdefault(name, dict(entry, samples={}))
+            samples = target["samples"]
+            for labels, value in entry["samples"]:
+                key = tuple(labels)
+                if entry["kind"] == "histogram":
+                    current = samples.get(key)
+                    samples[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    samples[key] = samples.get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_text(merged):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, entry in sorted(merged.items()):
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['kind']}")
+        names = entry["labels"]
+        for labels, value in sorted(entry["samples"].items()):
+            if entry["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(entry["buckets"] + ["+Inf"], value[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _number(float(bound))
+                lines.append(f"{name}_bucket{_labels(names, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, labels)} {_number(float(value[-1]))}")
+            lines.append(f"{name}_count{_labels(names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class MultiProcessExporter:
+    """Shares a registry's samples between the processes using `directory`."""
+
+    def __init__(self, registry=REGISTRY, directory=None, interval=None):
+        self.registry = registry
+        self.directory = directory or os.environ.get("METRICS_DIR") or os.path.join(
+            os.environ.get("RENDER_DATA_DIR", os.path.dirname(os.path.abspath(__file__))), "metrics")
+        self.interval = interval or float(os.environ.get("METRICS_INTERVAL", 5))
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def _ensure_started(self):
+        # Started lazily so that each gunicorn worker runs its own writer after fork.
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                log.error(f"Failed to write metrics: {e}")
+
+    def start(self):
+        self._ensure_started()
+        return self
+
+    def write(self):
+        """Write this process's samples now."""
+        data = json.dumps(self.registry.collect(), separators=(",", ":"))
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp, self._path(os.getpid()))
+
+    def render(self):
+        """Prometheus text for all processes sharing the directory."""
+        self._ensure_started()
+        self.write()
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            pid, ext = os.path.splitext(filename)
+            if ext != ".json" or not pid.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshots.append((int(pid), json.load(f)))
+            except (OSError, ValueError):
+                continue  # Removed or being replaced; the next scrape picks it up.
+        return format_text(_merge(snapshots))
+
+    def clear(self):
+        """Remove every process's samples. Call once from the master before workers start."""
+        if not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith((".json", ".tmp")):
+                try:
+                    os.unlink(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    def close(self):
+        """Stop the writer and leave a final snapshot so this worker's counters are kept."""
+        self._stop.set()
+        if self._pid == os.getpid():
+            self.write()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Durable send queue shared by any number of sender processes.
+
+With OUTBOX=1 a due bot does not send from the process that schedules it:
+run_bot_once writes the tick to the outbox table and returns. Every process
+running an OutboxWorker (web workers unless OUTBOX_CONSUME=0, and
+outbox_worker.py on dedicated sender machines) claims due ticks in batches
+of OUTBOX_BATCH, sends them through its fair-share dispatcher and records
+the outcome.
+
+A claim is a lease of OUTBOX_LEASE seconds. A sender that crashes leaves
+its ticks leased; once the lease runs out another sender takes them over,
+and a tick that has been leased OUTBOX_MAX_ATTEMPTS times is failed. This
+makes delivery at-least-once: a sender that dies between posting to
+Discord and recording the outcome gets that tick sent again.
+"""
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from batch_writer import BatchWriter
+
+log = logging.getLogger("discordbot")
+
+
+class OutboxWorker:
+    def __init__(self, storage, deliver, dispatcher, on_finished=None, batch=None, lease=None, poll=None, max_attempts=None):
+        self.storage = storage
+        # deliver(user_id, profile_name) -> (channels reached, retry_after seconds or None). Raising leaves
+        # the tick leased, so it is retried when the lease runs out.
+        self.deliver = deliver
+        self.dispatcher = dispatcher
+        # on_finished(rows) gets the bot_runs (user_id, profile_name, running, owner, sent_count, last_run) updated by a flush.
+        self.on_finished = on_finished
+        self.batch = batch or int(os.environ.get("OUTBOX_BATCH", 50))
+        self.lease = lease or float(os.environ.get("OUTBOX_LEASE", 60))
+        self.poll = poll or float(os.environ.get("OUTBOX_POLL", 0.5))
+        self.max_attempts = max_attempts or int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+        self._results = BatchWriter("outbox", self._finish, max_batch=self.batch, flush_interval=0.1)
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._owner = None
+        self._in_flight = 0
+        self._stats = {"claims": 0, "claimed": 0, "done": 0, "retried": 0, "errors": 0, "claim_errors": 0}
+
+    @property
+    def owner(self):
+        return self._owner
+
+    def ensure_started(self):
+        # Started lazily so that each gunicorn worker claims under its own name after fork.
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._owner = f"{socket.gethostname()}:{os.getpid()}"
+            self._stop = threading.Event()
+            self._in_flight = 0
+            self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                room = self.batch - self._in_flight
+            claimed = []
+            if room > 0:
+                try:
+                    claimed = self.claim(room)
+                except Exception as e:
+                    self._stats["claim_errors"] += 1
+                    log.error(f"Outbox claim failed: {e}")
+            # A full batch means more may be due; otherwise wait for the next poll or a free slot.
+            if room > 0 and len(claimed) == room:
+                continue
+            self._wake.wait(self.poll)
+            self._wake.clear()
+
+    def claim(self, limit):
+        """Lease up to `limit` due ticks and hand them to the dispatcher. Returns the claimed rows."""
+        now = datetime.now()
+        claimed = self.storage.claim_outbox(self._owner, now, now + timedelta(seconds=self.lease), limit, self.max_attempts)
+        self._stats["claims"] += 1
+        self._stats["claimed"] += len(claimed)
+        for id, user_id, profile_name, _, cost in claimed:
+            with self._lock:
+                self._in_flight += 1
+            future = self.dispatcher.submit(user_id, lambda u=user_id, p=profile_name: self.deliver(u, p), cost)
+            future.add_done_callback(lambda f, id=id, owner=self._owner, key=(user_id, profile_name): self._done(id, owner, key, f))
+        return claimed
+
+    def _done(self, id, owner, key, future):
+        with self._lock:
+            full = self._in_flight >= self.batch
+            self._in_flight -= 1
+        if full:
+            self._wake.set()
+        if future.cancelled():
+            # Shutting down; the lease runs out and another sender takes the tick.
+            return
+        error = future.exception()
+        if error is not None:
+            self._stats["errors"] += 1
+            log.error(f"Outbox tick {id} of {key[0]}/{key[1]} failed, retried after its lease: {error}")
+            return
+        sent, retry_after = future.result()
+        if retry_after is not None:
+            self._stats["retried"] += 1
+            self._results.put((id, owner, "pending", datetime.now() + timedelta(seconds=retry_after), None, None))
+        else:
+            self._stats["done"] += 1
+            self._results.put((id, owner, "done", None, sent, None))
+
+    def _finish(self, outcomes):
+        updated = self.storage.finish_outbox(outcomes, datetime.now())
+        if updated and self.on_finished:
+            self.on_finished(updated)
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._in_flight
+        return dict(self._stats, owner=self._owner, in_flight=in_flight, batch=self.batch, lease=self.lease,
+                    results=self._results.stats())
+
+    def close(self):
+        """Stop claiming and write the outcomes of the ticks sent so far."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(self.poll + 5)
+        self._results.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord Auto Message Bot - outbox sender
+
+A sender-only process for OUTBOX=1 deployments: it claims due ticks from
+the outbox table, sends them and records sends, logs and run counters
+with sender.Recorder like the web app, without Flask or any scheduling of its own.
+Run as many as needed, on any machine that reaches the database; they
+split the work through their leases (see outbox.py). Set OUTBOX_CONSUME=0
+on the web workers to leave all sending to these processes.
+"""
+import logging
+import os
+import signal
+import sys
+import threading
+from logging.handlers import RotatingFileHandler
+
+import discord_client
+import sender
+from batch_writer import BatchWriter
+from cache import TTLCache
+from control import ControlPlane
+from dispatch import Dispatcher
+from logbuffer import start_queue_logging
+from outbox import OutboxWorker
+from payloads import AttachmentCache, CompiledProfile
+from pubsub import PgNotifier, LocalNotifier
+from storage import open_storage
+from uploads import open_backend
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get('RENDER_DATA_DIR', BASE_DIR)
+LOG_PERSIST = os.environ.get('LOG_PERSIST', '1') != '0'
+
+# --- Logging setup ---
+def setup_logger():
+    logger = logging.getLogger("discordbot")
+    logger.setLevel(logging.INFO)
+    fh = RotatingFileHandler(os.path.join(DATA_DIR, 'bot.log'), maxBytes=1_000_000, backupCount=3, encoding="utf-8")
+    fmt = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s", "%Y-%m-%d %H:%M:%S")
+    fh.setFormatter(fmt)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(fmt)
+    start_queue_logging(logger, fh, ch)
+    return logger
+
+log = setup_logger()
+storage = open_storage()
+notifier = PgNotifier(storage.connect, storage.connection) if storage.backend == "postgres" else LocalNotifier()
+# Only used to publish events and counters to the web workers; this process owns no runs.
+control = ControlPlane(storage, notifier, on_stop=lambda user_id, profile_name: None, on_event=lambda user_id, event_type, data: None)
+profile_cache = TTLCache("profiles", maxsize=int(os.environ.get('CACHE_SIZE', 10_000)), ttl=float(os.environ.get('CACHE_TTL', 300)))
+notifier.subscribe("cache_invalidate", lambda payload: profile_cache.invalidate(payload["user_id"]))
+notifier.on_reconnect(profile_cache.clear)
+attachments = AttachmentCache(resolve_local=getattr(open_backend(os.path.join(DATA_DIR, 'uploads')), "path_for", None))
+compiled = {}  # (user_id, profile_name) -> (cfg, CompiledProfile)
+send_writer = BatchWriter("sends", storage.write_sends)
+log_writer = BatchWriter("logs", storage.write_logs)
+# Records ticks exactly as the web app does (see sender.py).
+recorder = sender.Recorder(control, send_writer, log_writer, persist_logs=LOG_PERSIST)
+
+# --- Sending ---
+def deliver(user_id, profile_name):
+    cfg = profile_cache.get_or_load(user_id, lambda: storage.load_profiles(user_id)).get(profile_name)
+    if cfg is None:
+        raise LookupError(f"profile {profile_name} not found")
+    cached = compiled.get((user_id, profile_name))
+    if cached is None or cached[0] is not cfg:
+        cached = compiled[(user_id, profile_name)] = (cfg, CompiledProfile(cfg['token'], cfg['channelid'], cfg['messages'], attachments))
+    return recorder.send(user_id, profile_name, cached[1], count=False)
+
+def finished(rows):
+    for user_id, profile_name, running, owner, sent_count, last_run in rows:
+        control.record_counts(user_id, profile_name, running, owner, sent_count, last_run)
+
+dispatcher = Dispatcher()
+worker = OutboxWorker(storage, deliver, dispatcher, on_finished=finished)
+
+# --- Main loop ---
+def main():
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    applied = storage.migrate()
+    if applied:
+        log.info(f"Applied schema migrations {applied}.")
+    worker.ensure_started()
+    log.info(f"Outbox sender {worker.owner} started: batch={worker.batch}, lease={worker.lease}s, concurrency={dispatcher.concurrency}.")
+    try:
+        while not stop.wait(60):
+            log.info("Outbox sender stats: %s", {k: v for k, v in worker.stats().items() if k != "results"})
+    except KeyboardInterrupt:
+        pass
+    # Stop claiming, give the queued ticks back to their leases and write what was sent.
+    worker.close()
+    dispatcher.close()
+    send_writer.close()
+    log_writer.close()
+    control.shutdown()
+    log.info("Stopped. Connection stats: %s", discord_client.get_pool().stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Precompiled Discord message payloads.
+
+A profile's messages are compiled once, when the bot starts, the profile
+is saved or a test send is made. Each compiled message keeps:
+
+- its request headers, token included, built once;
+- its JSON body pre-serialized, split around the placeholder slots
+  ({now}, ...), so a send only escapes the slot values and joins bytes;
+- for attachments, a pre-built multipart/form-data envelope. The file
+  bytes come from AttachmentCache: local files are mmapped and remote
+  URLs are downloaded once and kept in memory.
+
+Text messages send `content`; embeds send a real `embeds` array;
+attachments upload the file itself as `files[0]`.
+
+A profile may target several channels ("123, 456" or a list); every
+channel gets the same rendered payload.
+"""
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import random
+import re
+import socket
+import threading
+import urllib.request
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlsplit
+
+log = logging.getLogger("discordbot")
+
+# Discord asks bots to identify as "DiscordBot ($url, $version)".
+USER_AGENT = os.environ.get("DISCORD_USER_AGENT", "DiscordBot (discord-bot-panel, 1.0)")
+
+PLACEHOLDERS = {
+    "now": lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+}
+_PLACEHOLDER_RE = re.compile(r"\{(" + "|".join(PLACEHOLDERS) + r")\}")
+
+
+def _check_public_url(url):
+    # Attachment URLs come from users; never fetch from the server's own network.
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Attachment source must be an http(s) URL: {url}")
+    for info in socket.getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP):
+        if not ipaddress.ip_address(info[4][0].split("%")[0]).is_global:
+            raise ValueError(f"Attachment host {parts.hostname} is not a public address")
+
+
+class _PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        _check_public_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_PublicRedirectHandler)
+
+
+class AttachmentCache:
+    """Attachment bytes by source URL or path. Sources are content-addressed uploads, so entries never go stale."""
+
+    def __init__(self, resolve_local=None, max_bytes=None, max_file_bytes=None, max_mapped=None, timeout=30):
+        self.resolve_local = resolve_local or (lambda source: None)
+        self.max_bytes = max_bytes or int(os.environ.get("ATTACHMENT_CACHE_BYTES", 64 * 1024 * 1024))
+        # Every mapping holds a file descriptor, so only this many local files stay mapped.
+        self.max_mapped = max_mapped or int(os.environ.get("ATTACHMENT_MAPPED_FILES", 256))
+        # Discord rejects files above 25 MiB without boosts.
+        self.max_file_bytes = max_file_bytes or int(os.environ.get("ATTACHMENT_MAX_BYTES", 25 * 1024 * 1024))
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._mapped = OrderedDict()    # path -> memoryview of an mmap, backed by the page cache, LRU within max_mapped
+        self._downloaded = OrderedDict()  # url -> bytes, LRU within max_bytes
+        self._size = 0
+        self._stats = {"hits": 0, "downloads": 0, "mapped": 0, "evictions": 0}
+
+    def get(self, source):
+        # Only uploads the backend maps to disk are read locally; any other path is refused.
+        path = self.resolve_local(source)
+        if path:
+            return self._map(path)
+        with self._lock:
+            data = self._downloaded.get(source)
+            if data is not None:
+                self._downloaded.move_to_end(source)
+                self._stats["hits"] += 1
+                return data
+        data = self._download(source)
+        with self._lock:
+            self._stats["downloads"] += 1
+            if source not in self._downloaded and len(data) <= self.max_bytes:
+                self._downloaded[source] = data
+                self._size += len(data)
+                while self._size > self.max_bytes:
+                    _, evicted = self._downloaded.popitem(last=False)
+                    self._size -= len(evicted)
+                    self._stats["evictions"] += 1
+        return data
+
+    def _map(self, path):
+        with self._lock:
+            data = self._mapped.get(path)
+            if data is not None:
+                self._mapped.move_to_end(path)
+                self._stats["hits"] += 1
+                return data
+            size = os.path.getsize(path)
+            if size > self.max_file_bytes:
+                raise ValueError(f"Attachment {os.path.basename(path)} is {size} bytes, over the {self.max_file_bytes} byte limit")
+            with open(path, "rb") as f:
+                # A view, not the mmap itself: http.client would .read() an mmap, moving the file
+                # position every send of this attachment shares.
+                data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) if size else b""
+            self._mapped[path] = data
+            self._stats["mapped"] += 1
+            while len(self._mapped) > self.max_mapped:
+                # Not closed here: a send may still be reading it. The map and its descriptor are
+                # released with the last reference, once those sends are done.
+                self._mapped.popitem(last=False)
+                self._stats["evictions"] += 1
+            return data
+
+    def _download(self, url):
+        _check_public_url(url)
+        with _opener.open(url, timeout=self.timeout) as resp:
+            data = resp.read(self.max_file_bytes + 1)
+        if len(data) > self.max_file_bytes:
+            raise ValueError(f"Attachment {url} is over the {self.max_file_bytes} byte limit")
+        return data
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, cached_bytes=self._size, downloaded=len(self._downloaded), mapped_files=len(self._mapped))
+
+
+class _Template:
+    """A JSON document with placeholder slots, serialized once and split around them."""
+
+    def __init__(self, document):
+        marker = f"slot{uuid.uuid4().hex}"
+
+        def mark(value):
+            if isinstance(value, str):
+                return _PLACEHOLDER_RE.sub(lambda m: f"<{marker}:{m.group(1)}>", value)
+            if isinstance(value, dict):
+                return {k: mark(v) for k, v in value.items()}
+            if isinstance(value, list):
+                return [mark(v) for v in value]
+            return value
+
+        pieces = re.split(f"<{marker}:(\\w+)>", json.dumps(mark(document), separators=(",", ":")))
+        self.parts = [piece.encode() for piece in pieces[0::2]]
+        self.slots = [PLACEHOLDERS[name] for name in pieces[1::2]]
+
+    def render(self):
+        if not self.slots:
+            return self.parts[0]
+        out = [self.parts[0]]
+        for fill, part in zip(self.slots, self.parts[1:]):
+            out.append(json.dumps(fill())[1:-1].encode())
+            out.append(part)
+        return b"".join(out)
+
+
+class CompiledMessage:
+    def __init__(self, kind, preview, headers, template, attachment=None, filename=None, cache=None):
+        self.kind = kind
+        self.preview = preview
+        self.headers = headers
+        self.template = template
+        self.attachment = attachment
+        self.cache = cache
+        if attachment is not None:
+            boundary = uuid.uuid4().hex
+            self.headers = dict(headers, **{"Content-Type": f"multipart/form-data; boundary={boundary}"})
+            self._head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"payload_json\"\r\n"
+                          f"Content-Type: application/json\r\n\r\n").encode()
+            self._file_head = (f"\r\n--{boundary}\r\nContent-Disposition: form-data; name=\"files[0]\"; "
+                               f"filename=\"{filename}\"\r\nContent-Type: application/octet-stream\r\n\r\n").encode()
+            self._tail = f"\r\n--{boundary}--\r\n".encode()
+
+    def render(self):
+        """Return (headers, body). Multipart bodies are a tuple of byte chunks so the file is never copied."""
+        payload = self.template.render()
+        if self.attachment is None:
+            return self.headers, payload
+        data = self.cache.get(self.attachment)
+        body = (self._head + payload + self._file_head, data, self._tail)
+        return dict(self.headers, **{"Content-Length": str(len(body[0]) + len(data) + len(body[2]))}), body
+
+
+def _attachment_filename(source):
+    name = os.path.basename(source.split("?", 1)[0]) or "attachment"
+    return re.sub(r'["\r\n\\]', "_", name)
+
+
+def compile_message(message, token, cache):
+    """Compile one stored message dict. Raises ValueError when it cannot be sent."""
+    headers = {"Authorization": token, "Content-Type": "application/json", "User-Agent": USER_AGENT}
+    msg_type = message.get("type")
+    if msg_type == "text":
+        content = message.get("content", "")
+        if not content.strip():
+            raise ValueError("Content to send is empty.")
+        return CompiledMessage("text", content, headers, _Template({"content": content, "tts": False}))
+    if msg_type == "embed":
+        data = message.get("data", {})
+        embed = {k: data[k] for k in ("title", "description", "url") if data.get(k)}
+        if not embed:
+            raise ValueError("Embed has no title or description.")
+        if data.get("color"):
+            embed["color"] = int(data["color"])
+        return CompiledMessage("embed", embed.get("title") or embed["description"], headers, _Template({"embeds": [embed]}))
+    if msg_type == "attachment":
+        source = message.get("path") or message.get("url") or ""
+        if not source:
+            raise ValueError("Attachment URL is empty.")
+        filename = _attachment_filename(source)
+        # Local uploads are stored as "<hash>_<name>"; send the original name.
+        filename = re.sub(r"^[0-9a-f]{32}_", "", filename)
+        document = {"attachments": [{"id": 0, "filename": filename}]}
+        if message.get("content"):
+            document["content"] = message["content"]
+        return CompiledMessage("attachment", filename, headers, _Template(document),
+                               attachment=source, filename=filename, cache=cache)
+    raise ValueError(f"Unknown message type '{msg_type}'.")
+
+
+def parse_channel_ids(value):
+    """Channel ids from a comma/space separated string or a list, deduplicated in order."""
+    items = value if isinstance(value, (list, tuple)) else re.split(r"[\s,]+", str(value or ""))
+    channel_ids = []
+    for item in items:
+        item = str(item).strip()
+        if not item:
+            continue
+        if not item.isdigit():
+            raise ValueError(f"Invalid channel ID '{item}'.")
+        if item not in channel_ids:
+            channel_ids.append(item)
+    return channel_ids
+
+
+class CompiledProfile:
+    def __init__(self, token, channel_id, messages, cache):
+        if not messages:
+            raise ValueError("No messages to send.")
+        self.token = token
+        self.channel_ids = parse_channel_ids(channel_id)
+        self.messages = [compile_message(message, token, cache) for message in messages]
+
+    def pick(self):
+        return random.choice(self.messages)
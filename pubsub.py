@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-process messaging over Postgres LISTEN/NOTIFY.
+
+Every gunicorn worker runs one listener thread on a dedicated autocommit
+connection. `publish()` sends a JSON payload with pg_notify; when it is
+given the caller's connection, the message is only delivered if that
+transaction commits. Messages are tagged with their origin and not
+delivered back to the process that sent them.
+"""
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+log = logging.getLogger("discordbot")
+
+
+class PgNotifier:
+    def __init__(self, connect_fn, get_connection=None):
+        self.connect_fn = connect_fn
+        self.get_connection = get_connection
+        self._handlers = {}
+        self._reconnect_handlers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._listening = set()
+
+    @property
+    def origin(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def subscribe(self, channel, handler):
+        """Call `handler(payload)` for every message published on `channel` by another process."""
+        with self._lock:
+            self._handlers.setdefault(channel, []).append(handler)
+        self._ensure_started()
+
+    def on_reconnect(self, handler):
+        """Call `handler()` after the listener reconnects, since messages may have been missed."""
+        self._reconnect_handlers.append(handler)
+
+    def publish(self, channel, payload, conn=None):
+        message = json.dumps(dict(payload, origin=self.origin))
+        if conn is not None:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_notify(%s, %s)", (channel, message))
+            return
+        with self.get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (channel, message))
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._listening = set()
+            self._thread = threading.Thread(target=self._run, name="pg-listener", daemon=True)
+            self._thread.start()
+
+    def _listen_new(self, conn):
+        with self._lock:
+            pending = set(self._handlers) - self._listening
+        if not pending:
+            return
+        with conn.cursor() as cur:
+            for channel in pending:
+                cur.execute(f'LISTEN "{channel}"')
+        self._listening |= pending
+
+    def _dispatch(self, notify):
+        try:
+            payload = json.loads(notify.payload)
+        except ValueError:
+            return
+        if payload.get("origin") == self.origin:
+            return
+        with self._lock:
+            handlers = list(self._handlers.get(notify.channel, ()))
+        for handler in handlers:
+            try:
+                handler(payload)
+            except Exception as e:
+                log.error(f"Handler for '{notify.channel}' failed: {e}")
+
+    def _run(self):
+        backoff, connected_before = 1, False
+        while True:
+            conn = None
+            try:
+                conn = self.connect_fn()
+                conn.autocommit = True
+                self._listening = set()
+                self._listen_new(conn)
+                if connected_before:
+                    for handler in self._reconnect_handlers:
+                        handler()
+                connected_before, backoff = True, 1
+                while True:
+                    if select.select([conn], [], [], 5) != ([], [], []):
+                        conn.poll()
+                        while conn.notifies:
+                            self._dispatch(conn.notifies.pop(0))
+                    self._listen_new(conn)
+            except Exception as e:
+                log.error(f"LISTEN connection lost: {e}. Reconnecting in {backoff}s.")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+class LocalNotifier:
+    """Stand-in for PgNotifier when there is no Postgres (SQLite backend, single process).
+
+    Messages are never delivered back to the process that sent them, so with
+    one process there is nobody to deliver to and publishing is a no-op.
+    """
+    @property
+    def origin(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def subscribe(self, channel, handler):
+        pass
+
+    def on_reconnect(self, handler):
+        pass
+
+    def publish(self, channel, payload, conn=None):
+        pass
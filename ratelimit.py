@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Discord rate-limit tracking.
+
+Buckets are learned from the X-RateLimit-* response headers and kept per
+token, per bucket hash and per major parameter (the channel id). A global
+per-token cap and any global 429 are tracked separately. Callers ask
+`acquire()` before sending and feed every response to `update()`; a send
+that would hit a limit raises RateLimited with the delay instead of
+burning the request.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+MESSAGE_ROUTE = "POST /channels/{channel_id}/messages"
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after, scope="bucket"):
+        super().__init__(f"Rate limited ({scope}), retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+        self.scope = scope
+
+
+class Bucket:
+    __slots__ = ("limit", "remaining", "reset_at")
+
+    def __init__(self, limit=1, remaining=1, reset_at=0.0):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_at = reset_at
+
+
+def token_key(token):
+    return hashlib.sha1(token.encode("utf-8")).hexdigest()[:12]
+
+
+def _header(headers, name, cast=str):
+    value = headers.get(name) if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    def __init__(self, global_limit=None):
+        self.global_limit = global_limit or int(os.environ.get("DISCORD_GLOBAL_RATE_LIMIT", 50))
+        self._lock = threading.Lock()
+        self._routes = {}         # (token_key, route) -> bucket hash from X-RateLimit-Bucket
+        self._buckets = {}        # (token_key, bucket hash or route, major) -> Bucket
+        self._global_until = {}   # token_key -> epoch when a global 429 expires
+        self._windows = {}        # token_key -> [window start, requests in window]
+
+    def _bucket_key(self, tk, route, major):
+        return (tk, self._routes.get((tk, route), route), major)
+
+    def acquire(self, token, route, major):
+        """Reserve a request slot. Returns 0 when the request may go out, else seconds to wait."""
+        tk = token_key(token)
+        now = time.time()
+        with self._lock:
+            until = self._global_until.get(tk, 0)
+            if until > now:
+                return until - now
+            window = self._windows.get(tk)
+            if not window or now - window[0] >= 1:
+                window = self._windows[tk] = [now, 0]
+            if window[1] >= self.global_limit:
+                return window[0] + 1 - now
+            bucket = self._buckets.get(self._bucket_key(tk, route, major))
+            if bucket:
+                if bucket.reset_at <= now:
+                    bucket.remaining = bucket.limit
+                elif bucket.remaining <= 0:
+                    return bucket.reset_at - now
+                bucket.remaining -= 1
+            window[1] += 1
+            return 0
+
+    def update(self, token, route, major, resp):
+        """Record the rate-limit headers of a response. Returns retry_after for a 429, else 0."""
+        tk = token_key(token)
+        now = time.time()
+        headers = resp.headers
+        bucket_hash = _header(headers, "X-RateLimit-Bucket")
+        limit = _header(headers, "X-RateLimit-Limit", int)
+        remaining = _header(headers, "X-RateLimit-Remaining", int)
+        reset_after = _header(headers, "X-RateLimit-Reset-After", float)
+        with self._lock:
+            if bucket_hash:
+                self._routes[(tk, route)] = bucket_hash
+            key = self._bucket_key(tk, route, major)
+            bucket = self._buckets.get(key)
+            if remaining is not None and reset_after is not None:
+                if bucket is None:
+                    bucket = self._buckets[key] = Bucket()
+                bucket.limit = limit or bucket.limit
+                bucket.remaining = remaining
+                bucket.reset_at = now + reset_after
+            if resp.status != 429:
+                return 0
+            try:
+                data = json.loads(resp.body or b"{}")
+            except ValueError:
+                data = {}
+            retry_after = data.get("retry_after") or _header(headers, "Retry-After", float) or reset_after or 1.0
+            retry_after = float(retry_after)
+            if data.get("global") or _header(headers, "X-RateLimit-Global") == "true":
+                self._global_until[tk] = now + retry_after
+            else:
+                if bucket is None:
+                    bucket = self._buckets[key] = Bucket()
+                bucket.remaining = 0
+                bucket.reset_at = max(bucket.reset_at, now + retry_after)
+            if len(self._buckets) > 10_000:
+                self._prune(now)
+            return retry_after
+
+    def _prune(self, now):
+        # Caller holds the lock.
+        for key in [k for k, b in self._buckets.items() if b.reset_at < now - 60]:
+            del self._buckets[key]
+        for tk in [t for t, until in self._global_until.items() if until < now]:
+            del self._global_until[tk]
+        for tk in [t for t, w in self._windows.items() if now - w[0] >= 1]:
+            del self._windows[tk]
+
+    def snapshot(self, tokens=None):
+        keys = {token_key(t) for t in tokens if t} if tokens is not None else None
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            buckets = [{
+                "token": tk, "bucket": bucket, "channel": major, "limit": b.limit,
+                "remaining": b.remaining if b.reset_at > now else b.limit,
+                "reset_after": round(max(0.0, b.reset_at - now), 3),
+            } for (tk, bucket, major), b in self._buckets.items() if keys is None or tk in keys]
+            global_limits = {tk: round(until - now, 3) for tk, until in self._global_until.items()
+                             if until > now and (keys is None or tk in keys)}
+        return {"global_limit_per_second": self.global_limit, "global_retry_after": global_limits, "buckets": buckets}
+
+    def send(self, token, route, major, request_fn, max_wait=0.0):
+        """Send through `request_fn()` once the buckets allow it.
+
+        Waits up to `max_wait` seconds for a free slot; beyond that, and on a
+        429 response, raises RateLimited so the caller can requeue.
+        """
+        wait = self.acquire(token, route, major)
+        while wait > 0:
+            if wait > max_wait:
+                raise RateLimited(wait, "preemptive")
+            time.sleep(wait)
+            max_wait -= wait
+            wait = self.acquire(token, route, major)
+        resp = request_fn()
+        retry_after = self.update(token, route, major, resp)
+        if resp.status == 429:
+            scope = "global" if self._global_until.get(token_key(token), 0) > time.time() else "bucket"
+            raise RateLimited(retry_after, scope)
+        return resp
+
+
+limiter = RateLimiter()
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Profile scheduler: one asyncio event loop and a heap of next-fire times.
+
+Every running profile is a Job in the heap. The loop sleeps until the
+earliest job is due (or until start/stop/reschedule wakes it up), then
+hands the blocking send to a small thread pool, or to `dispatch` (see
+dispatch.py) when one is given. Idle profiles cost one heap entry, not a
+thread.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from croniter import croniter
+
+log = logging.getLogger("discordbot")
+
+
+class CronSchedule:
+    """A validated cron expression with one iterator that only advances as fire times pass.
+
+    Upcoming fire times are computed once and kept in a short queue, so the
+    scheduler and previews read them instead of rebuilding a croniter.
+    Not thread-safe; the Scheduler uses it under its lock.
+    """
+    __slots__ = ("expr", "_iter", "_upcoming", "_floor")
+
+    # Falling further behind than this (clock jump, long retry) restarts the iterator instead of stepping.
+    MAX_CATCH_UP = 64
+
+    def __init__(self, expr, start=None):
+        if not expr or not croniter.is_valid(expr):
+            raise ValueError(f"Invalid cron expression: {expr}")
+        self.expr = expr
+        self._reset(start if start is not None else time.time())
+
+    def _reset(self, start):
+        self._iter = croniter(self.expr, datetime.fromtimestamp(start))
+        self._upcoming = deque()
+        self._floor = start
+
+    def next_after(self, ts):
+        """First fire time strictly after `ts`."""
+        if ts < self._floor:
+            # Asked about the past (a preview from an earlier next_run); fire times before now are gone.
+            self._reset(ts)
+        self._floor = ts
+        skipped = 0
+        while True:
+            if not self._upcoming:
+                self._upcoming.append(self._iter.get_next(float))
+            if self._upcoming[0] > ts:
+                return self._upcoming[0]
+            self._upcoming.popleft()
+            skipped += 1
+            if skipped > self.MAX_CATCH_UP:
+                self._reset(ts)
+
+    def upcoming(self, n, after):
+        """The next `n` fire times after `after`."""
+        self.next_after(after)
+        while len(self._upcoming) < n:
+            self._upcoming.append(self._iter.get_next(float))
+        return list(itertools.islice(self._upcoming, n))
+
+
+class Job:
+    __slots__ = ("key", "action", "interval", "cron", "on_error", "jitter", "cost",
+                 "next_run", "last_run", "seq", "active", "in_flight")
+
+    def __init__(self, key, action, interval=None, cron=None, on_error=None, jitter=0, cost=1):
+        self.key = key
+        self.action = action
+        self.interval = interval
+        self.cron = cron
+        self.on_error = on_error
+        self.jitter = jitter
+        self.cost = cost
+        self.next_run = None
+        self.last_run = None
+        self.seq = 0
+        self.active = True
+        self.in_flight = False
+
+    def compute_next(self, now):
+        if self.interval is not None:
+            return now + self.interval + self.spread()
+        return self.cron.next_after(now) + self.spread()
+
+    def spread(self):
+        # Profiles saved with the same interval or cron would otherwise fire in lockstep.
+        return random.uniform(0, self.jitter) if self.jitter else 0
+
+    def upcoming(self, n):
+        if self.next_run is None or n <= 0:
+            return []
+        if self.interval is not None:
+            return [self.next_run + i * self.interval for i in range(n)]
+        return [self.next_run] + self.cron.upcoming(n - 1, self.next_run)
+
+
+class Scheduler:
+    def __init__(self, max_workers=None, on_schedule=None, dispatch=None):
+        # on_schedule(key, next_run) is called whenever a job gets a new fire time.
+        self.on_schedule = on_schedule
+        # dispatch(key, action, cost) -> concurrent Future runs due jobs instead of the executor.
+        self.dispatch = dispatch
+        self._max_workers = max_workers or int(os.environ.get("SCHEDULER_WORKERS", 16))
+        self._lock = threading.Lock()
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count(1)
+        self._loop = None
+        self._thread = None
+        self._wakeup = None
+        self._executor = None
+
+    # --- LIFECYCLE ---
+    def _ensure_started(self):
+        # Started lazily so that gunicorn workers each get their own loop after fork.
+        if self._thread and self._thread.is_alive():
+            return
+        ready = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="bot-send")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, args=(ready,), name="scheduler", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def _run_loop(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        self._loop.call_soon(ready.set)
+        self._loop.run_until_complete(self._main())
+
+    def _wake(self):
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # --- PUBLIC API ---
+    def add(self, key, action, interval=None, cron_expr=None, on_error=None, delay=0, jitter=0, cost=1):
+        """Schedule `action()` for `key`, first run after `delay` seconds. Replaces any existing job.
+
+        If `action()` returns a number, the job is retried after that many
+        seconds instead of at its regular next-fire time. Each regular run
+        starts a random 0-`jitter` seconds late. `cost` is passed to `dispatch`.
+        """
+        if interval is None and not cron_expr:
+            raise ValueError("Either interval or cron_expr is required.")
+        cron = CronSchedule(cron_expr) if cron_expr else None
+        self._ensure_started()
+        job = Job(key, action, interval=interval, cron=cron, on_error=on_error, jitter=jitter, cost=cost)
+        with self._lock:
+            old = self._jobs.get(key)
+            if old:
+                old.active = False
+            self._jobs[key] = job
+            self._push(job, time.time() + delay + job.spread())
+        self._wake()
+        self._notify(job)
+        return job
+
+    def cancel(self, key):
+        with self._lock:
+            job = self._jobs.pop(key, None)
+            if not job:
+                return False
+            job.active = False
+        # The stale heap entry is skipped when it surfaces; no need to wake the loop.
+        return True
+
+    def reschedule(self, key, when):
+        with self._lock:
+            job = self._jobs.get(key)
+            if not job:
+                return False
+            self._push(job, when)
+        self._wake()
+        self._notify(job)
+        return True
+
+    def is_scheduled(self, key):
+        with self._lock:
+            return key in self._jobs
+
+    def next_run(self, key):
+        with self._lock:
+            job = self._jobs.get(key)
+            return job.next_run if job else None
+
+    def next_runs(self, match=None):
+        """Return {key: next_run} for scheduled jobs whose key satisfies `match(key)`."""
+        with self._lock:
+            return {key: job.next_run for key, job in self._jobs.items() if match is None or match(key)}
+
+    def upcoming(self, keys, n=5):
+        """Return {key: [next n fire times]} for the scheduled jobs among `keys`."""
+        with self._lock:
+            return {key: self._jobs[key].upcoming(n) for key in keys if key in self._jobs}
+
+    def keys(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    # --- INTERNALS ---
+    def _notify(self, job):
+        if self.on_schedule:
+            try:
+                self.on_schedule(job.key, job.next_run)
+            except Exception as e:
+                log.error(f"on_schedule callback failed for {job.key}: {e}")
+
+    def _push(self, job, when):
+        # Caller holds the lock. Bumping seq invalidates any older heap entry for this job.
+        job.seq = next(self._seq)
+        job.next_run = when
+        heapq.heappush(self._heap, (when, job.seq, job))
+
+    def _pop_due(self):
+        """Pop every due job; return (due_jobs, seconds until the next one or None)."""
+        due = []
+        now = time.time()
+        with self._lock:
+            while self._heap:
+                when, seq, job = self._heap[0]
+                if not job.active or seq != job.seq:
+                    heapq.heappop(self._heap)
+                    continue
+                if when > now:
+                    return due, when - now
+                heapq.heappop(self._heap)
+                if job.in_flight:
+                    continue
+                job.in_flight = True
+                due.append(job)
+        return due, None
+
+    async def _main(self):
+        while True:
+            self._wakeup.clear()
+            due, timeout = self._pop_due()
+            for job in due:
+                self._loop.create_task(self._fire(job))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, job):
+        error, retry_after = None, None
+        try:
+            if self.dispatch:
+                retry_after = await asyncio.wrap_future(self.dispatch(job.key, job.action, job.cost))
+            else:
+                retry_after = await self._loop.run_in_executor(self._executor, job.action)
+        except asyncio.CancelledError:
+            # The dispatcher was closed (shutdown) before the send ran: nothing was sent and the job stays stopped.
+            with self._lock:
+                job.in_flight = False
+                job.active = False
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+            return
+        except Exception as e:
+            log.exception(f"Scheduled job {job.key} raised: {e}")
+        now = time.time()
+        with self._lock:
+            job.in_flight = False
+            job.last_run = now
+            if not job.active:
+                return
+            try:
+                # bool is an int, but an action returning True/False is not asking for a retry.
+                if type(retry_after) in (int, float) and not math.isnan(retry_after):
+                    self._push(job, now + max(0.0, retry_after))
+                else:
+                    self._push(job, job.compute_next(now))
+            except Exception as e:
+                error = e
+                job.active = False
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+        if error is None:
+            # The loop may be sleeping on a timeout computed before this job was requeued.
+            self._wakeup.set()
+            self._notify(job)
+            return
+        log.error(f"Schedule error for {job.key}: {error}. Stopping.")
+        if job.on_error:
+            job.on_error(job.key, error)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Sending compiled profiles to Discord, shared by the web app and main.py.
+
+Every request goes through the circuit breaker, the per-token rate limiter
+and the keep-alive connection pool. A profile with several channels renders its payload once
+and posts it to all of them concurrently on `fanout_executor`.
+
+`Recorder` turns a tick's results into send rows, bot log lines and status
+events, the same way in the web app and in outbox_worker.py.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import discord_client
+import metrics
+from circuit import CircuitOpen, RESUMED_MESSAGE, SUSPENDED_MESSAGE, breaker as circuit_breaker, suspension_reason
+from ratelimit import RateLimited, MESSAGE_ROUTE, limiter as rate_limiter
+
+log = logging.getLogger("discordbot")
+
+# Multi-channel profiles send to their channels concurrently over the shared Discord connection pool.
+fanout_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("FANOUT_WORKERS", 32)), thread_name_prefix="fanout")
+# How long a fan-out send may wait out a channel's rate limit before that channel is skipped for the tick.
+FANOUT_MAX_WAIT = float(os.environ.get("FANOUT_MAX_WAIT", 2.0))
+
+DISCORD_LATENCY = metrics.histogram("discordbot_discord_request_seconds", "Discord API request latency by HTTP status.", ["status"])
+SENDS = metrics.counter("discordbot_sends_total", "Message sends by outcome.", ["outcome"])
+
+
+def post_message(channel_id, headers, body):
+    started, status = time.perf_counter(), "error"
+    try:
+        resp = discord_client.post_message(channel_id, headers, body)
+        status = str(resp.status)
+        return resp
+    finally:
+        DISCORD_LATENCY.observe(time.perf_counter() - started, status)
+
+
+def send_message_logic(channel_id, token, message, max_wait=0.0, rendered=None):
+    """Send one compiled message (see payloads.py). `rendered` reuses a (headers, body) from message.render()."""
+    try:
+        headers, body = rendered or message.render()
+        circuit_breaker.check(token, channel_id)
+        log.info(f"Sending {message.kind} to {channel_id}: {message.preview[:100]}...")
+        try:
+            resp = rate_limiter.send(token, MESSAGE_ROUTE, channel_id,
+                                     lambda: post_message(channel_id, headers, body), max_wait=max_wait)
+        except RateLimited:
+            circuit_breaker.record(token, channel_id)
+            raise
+        except Exception as e:
+            circuit_breaker.record(token, channel_id, error=e)
+            raise
+        circuit_breaker.record(token, channel_id, resp.status)
+        if 200 <= resp.status < 300:
+            log.info(f"Pesan berhasil dikirim ke channel {channel_id}")
+            SENDS.inc("success")
+            return True
+        else:
+            log.error(f"HTTP {resp.status} {resp.reason} | response: {resp.body.decode(errors='ignore')}")
+            SENDS.inc("failure")
+            return False
+    except RateLimited as e:
+        log.warning(f"Channel {channel_id}: {e}")
+        SENDS.inc("rate_limited")
+        raise
+    except CircuitOpen:
+        # Logged once per profile by the caller when it is suspended, not on every tick.
+        SENDS.inc("circuit_open")
+        raise
+    except Exception as e:
+        log.exception(f"Terjadi error saat mengirim pesan: {e}")
+        SENDS.inc("error")
+        return False
+
+
+def _send_or_limited(channel_id, token, message, max_wait, rendered):
+    try:
+        return send_message_logic(channel_id, token, message, max_wait, rendered)
+    except (RateLimited, CircuitOpen) as e:
+        return e
+
+
+def send_to_channels(channel_ids, token, message, max_wait=0.0):
+    """Send one message to every channel, concurrently when there are several.
+
+    The payload is rendered once and shared. Returns {channel_id: True, False or the RateLimited or CircuitOpen error}.
+    A payload that fails to render (a missing attachment, say) fails every channel.
+    """
+    try:
+        rendered = message.render()
+    except Exception as e:
+        log.exception(f"Terjadi error saat mengirim pesan: {e}")
+        SENDS.inc("error", amount=len(channel_ids))
+        return {channel_id: False for channel_id in channel_ids}
+    if len(channel_ids) == 1:
+        return {channel_ids[0]: _send_or_limited(channel_ids[0], token, message, max_wait, rendered)}
+    futures = {channel_id: fanout_executor.submit(_send_or_limited, channel_id, token, message, max_wait, rendered)
+               for channel_id in channel_ids}
+    return {channel_id: future.result() for channel_id, future in futures.items()}
+
+
+def send_profile(profile):
+    """Send the profile's next message to all of its channels.
+
+    Returns (results, retry_after): retry_after is the shortest wait when every
+    channel was rate limited or cut off by an open circuit, with at least one
+    rate limited, meaning the tick should be retried rather than recorded;
+    otherwise it is None.
+    """
+    # A single channel requeues the whole tick on a 429; a fan-out waits a little per channel instead.
+    max_wait = FANOUT_MAX_WAIT if len(profile.channel_ids) > 1 else 0.0
+    results = send_to_channels(profile.channel_ids, profile.token, profile.pick(), max_wait)
+    limited = [result for result in results.values() if isinstance(result, RateLimited)]
+    if limited and len(limited) + sum(isinstance(result, CircuitOpen) for result in results.values()) == len(results):
+        return results, min(limited, key=lambda e: e.retry_after)
+    return results, None
+
+
+class Recorder:
+    """Records sends and bot events through `control` and the sends/logs BatchWriters."""
+
+    def __init__(self, control, send_writer, log_writer, persist_logs=True):
+        self.control = control
+        self.send_writer = send_writer
+        self.log_writer = log_writer
+        self.persist_logs = persist_logs
+
+    def log_send(self, user_id, profile_name, success, channel_id=None):
+        now = datetime.now()
+        self.send_writer.put((user_id, profile_name, now, success, channel_id))
+        self.control.broadcast(user_id, "send", {"profile": profile_name, "channel_id": channel_id, "success": success,
+                                                 "timestamp": now.isoformat()})
+
+    def log_event(self, user_id, message, level=logging.INFO):
+        """Log a bot event and keep it in the user's log history."""
+        log.log(level, message)
+        now = datetime.now()
+        line = f"{now:%Y-%m-%d %H:%M:%S} | {logging.getLevelName(level)} | {message}\n"
+        if self.persist_logs:
+            self.log_writer.put((user_id, now, line))
+        self.control.broadcast(user_id, "log", {"line": line})
+
+    def track_suspension(self, user_id, profile_name, results):
+        """Suspend the profile while an open circuit cuts off all of its channels, and resume it once one gets through."""
+        reason = suspension_reason(results)
+        if not self.control.set_suspended(user_id, profile_name, reason):
+            return
+        if reason:
+            self.log_event(user_id, SUSPENDED_MESSAGE.format(profile=profile_name, reason=reason), logging.ERROR)
+        else:
+            self.log_event(user_id, RESUMED_MESSAGE.format(profile=profile_name))
+
+    def record_results(self, user_id, profile_name, results, count=True):
+        """Log one tick's {channel_id: result}. Returns how many channels got the message.
+
+        `count` adds them to the run's counters here; outbox ticks are counted by finish_outbox instead.
+        """
+        self.track_suspension(user_id, profile_name, results)
+        sent = 0
+        for channel_id, result in results.items():
+            if isinstance(result, RateLimited):
+                self.log_event(user_id, f"[{profile_name}] Channel {channel_id} dilewati kali ini: {result}", logging.WARNING)
+                continue
+            if isinstance(result, CircuitOpen):
+                # Nothing was sent; the suspension is logged once, not on every tick.
+                continue
+            self.log_send(user_id, profile_name, result, channel_id)
+            if not result:
+                self.log_event(user_id, f"[{profile_name}] Gagal mengirim pesan ke channel {channel_id}.", logging.ERROR)
+            else:
+                self.log_event(user_id, f"[{profile_name}] Pesan terkirim ke channel {channel_id}.")
+                sent += 1
+                if count:
+                    self.control.record_send(user_id, profile_name)
+        return sent
+
+    def send(self, user_id, profile_name, profile, count=True):
+        """Send one tick of `profile` and record it. Returns (channels reached, retry_after or None).
+
+        When every channel was rate limited nothing is recorded and retry_after says when to try again.
+        """
+        results, limited = send_profile(profile)
+        if limited:
+            self.log_event(user_id, f"[{profile_name}] {limited}", logging.WARNING)
+            return 0, limited.retry_after
+        return self.record_results(user_id, profile_name, results, count), None
@@ -28,6 +28,7 @@ document.addEventListener("DOMContentLoaded", () => {
     scheduleMode: document.getElementById("schedule_mode"),
     intervalField: document.getElementById("interval_field"),
     intervalInput: document.getElementById("interval_seconds"),
+    jitterInput: document.getElementById("jitter_seconds"),
     cronSimpleField: document.getElementById("cron_simple_field"),
     cronPreset: document.getElementById("cron_preset"),
     cronAdvancedField: document.getElementById("cron_advanced_field"),
@@ -67,13 +68,17 @@ document.addEventListener("DOMContentLoaded", () => {
   };
 
   let analyticsChart;
+  let analyticsData = null;
+  let statusData = {};
+  let nextRuns = {};
+  let dashboardCounts = { sent: 0, failed: 0 };
   let messageInputs = [];
   let selectedAttachmentFile = null;
 
   // --- INITIALIZATION & HELPERS ---
   initializeTheme();
   loadProfiles();
-  startPeriodicUpdates();
+  startLiveUpdates();
   addEventListeners();
   updateEmbedPreview();
   validateInputs();
@@ -189,10 +194,33 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
+  // Sends the file as the raw request body; the server hashes it while it
+  // streams in. Known files return their URL at once, new ones are polled
+  // until the background upload finishes.
+  async function uploadAttachment(file) {
+    let result = await apiRequest("/upload_attachment", {
+      method: "POST",
+      body: file,
+      headers: {
+        "Content-Type": "application/octet-stream",
+        "X-Filename": encodeURIComponent(file.name),
+      },
+    });
+    while (result?.status === "pending") {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      result = await apiRequest(`/uploads/${result.id}`);
+    }
+    if (result?.status === "failed")
+      throw new Error(`Upload gagal: ${result.error || "unknown error"}`);
+    return result?.filepath || null;
+  }
+
   // --- DASHBOARD & STATUS ---
   async function updateDashboard() {
     const data = await apiRequest("/dashboard");
     if (!data) return;
+    const [, sent, failed] = data.messages.match(/(\d+) Sent \((\d+) Failed\)/) || [];
+    dashboardCounts = { sent: Number(sent) || 0, failed: Number(failed) || 0 };
     elements.dashboardStatus.textContent = data.status;
     elements.dashboardMessages.textContent = data.messages;
     elements.dashboardSchedule.textContent = data.next_schedule;
@@ -204,6 +232,11 @@ document.addEventListener("DOMContentLoaded", () => {
   async function updateStatus() {
     const data = await apiRequest("/status");
     if (!data) return;
+    statusData = data;
+    renderStatus();
+  }
+  function renderStatus() {
+    const data = statusData;
     elements.statusContainer.innerHTML = "";
     const profileNames = Array.from(elements.profileSelect.options).map(
       (opt) => opt.value
@@ -222,7 +255,11 @@ document.addEventListener("DOMContentLoaded", () => {
       const div = document.createElement("div");
       div.className = "flex justify-between items-center text-sm";
       div.innerHTML = `<span>${profileName}</span><span class="text-right">${
-        status.running ? "🟢 Running" : "🔴 Stopped"
+        !status.running
+          ? "🔴 Stopped"
+          : status.suspended
+          ? `⏸️ Suspended: ${status.suspended}`
+          : "🟢 Running"
       } | Sent: ${status.sent_count} | Last: ${status.last_run}</span>`;
       elements.statusContainer.appendChild(div);
     });
@@ -299,6 +336,7 @@ document.addEventListener("DOMContentLoaded", () => {
     elements.channelIdInput.value = data.channelid || "";
     elements.scheduleMode.value = data.schedule_mode || "interval";
     elements.intervalInput.value = data.interval_seconds || 300;
+    elements.jitterInput.value = data.jitter_seconds || 0;
     elements.cronExpression.value = data.cron_expression || "";
     toggleScheduleFields();
     const firstMessage = data.messages?.[0] || { type: "text", content: "" };
@@ -345,7 +383,7 @@ document.addEventListener("DOMContentLoaded", () => {
     elements.embedPreviewDescription.textContent = description;
   }
   function validateInputs() {
-    const channelIdRegex = /^\d{17,19}$/,
+    const channelIdRegex = /^\s*\d{17,19}(\s*,\s*\d{17,19})*\s*$/,
       tokenRegex = /.+[.].+[.].+/;
     function v(el, errEl, regex, msg) {
       const val = el.value.trim();
@@ -373,7 +411,7 @@ document.addEventListener("DOMContentLoaded", () => {
         elements.channelIdInput,
         elements.channelIdError,
         channelIdRegex,
-        "Channel ID must be 17-19 digits."
+        "Channel IDs must be 17-19 digits, separated by commas."
       )
     );
     elements.tokenInput.addEventListener("input", () =>
@@ -524,20 +562,9 @@ document.addEventListener("DOMContentLoaded", () => {
         ).value;
         if (source === "local") {
           if (selectedAttachmentFile) {
-            const formData = new FormData();
-            formData.append("file", selectedAttachmentFile);
-            const uploadResult = await apiRequest("/upload_attachment", {
-              method: "POST",
-              body: formData,
-            });
-            if (!uploadResult?.filepath) throw new Error("File upload failed.");
-            messages = [
-              {
-                type: "attachment",
-                source: "local",
-                path: uploadResult.filepath,
-              },
-            ];
+            const filepath = await uploadAttachment(selectedAttachmentFile);
+            if (!filepath) throw new Error("File upload failed.");
+            messages = [{ type: "attachment", source: "local", path: filepath }];
           } else {
             const existingPath =
               elements.currentAttachmentPath.dataset.fullPath;
@@ -561,6 +588,7 @@ document.addEventListener("DOMContentLoaded", () => {
         channelid: elements.channelIdInput.value,
         schedule_mode: elements.scheduleMode.value,
         interval_seconds: parseInt(elements.intervalInput.value) || 300,
+        jitter_seconds: parseInt(elements.jitterInput.value) || 0,
         cron_expression: elements.cronExpression.value,
         messages,
       };
@@ -609,21 +637,9 @@ document.addEventListener("DOMContentLoaded", () => {
         ).value;
         if (source === "local") {
           if (selectedAttachmentFile) {
-            const formData = new FormData();
-            formData.append("file", selectedAttachmentFile);
-            const uploadResult = await apiRequest("/upload_attachment", {
-              method: "POST",
-              body: formData,
-            });
-            if (!uploadResult?.filepath)
-              throw new Error("Gagal mengunggah file untuk tes.");
-            messages = [
-              {
-                type: "attachment",
-                source: "local",
-                path: uploadResult.filepath,
-              },
-            ];
+            const filepath = await uploadAttachment(selectedAttachmentFile);
+            if (!filepath) throw new Error("Gagal mengunggah file untuk tes.");
+            messages = [{ type: "attachment", source: "local", path: filepath }];
           } else {
             const existingPath =
               elements.currentAttachmentPath.dataset.fullPath;
@@ -847,19 +863,93 @@ document.addEventListener("DOMContentLoaded", () => {
     );
   }
 
-  // --- ANALYTICS & LOGS ---
-  function startPeriodicUpdates() {
+  // --- LIVE UPDATES ---
+  function refreshAll() {
     updateStatus();
     updateLogs();
     updateAnalytics();
     updateDashboard();
-    setInterval(() => {
-      updateAnalytics();
-      updateStatus();
-      if (elements.logRefreshCheckbox.checked) updateLogs();
-      updateDashboard();
-    }, 5000);
   }
+  function startLiveUpdates() {
+    refreshAll();
+    // The server pushes changes as they happen; EventSource reconnects on its
+    // own and resumes from the last event id it saw.
+    const source = new EventSource("/api/events");
+    source.addEventListener("reset", refreshAll);
+    source.addEventListener("status", (e) => applyStatusEvent(JSON.parse(e.data)));
+    source.addEventListener("suspended", (e) => applySuspendedEvent(JSON.parse(e.data)));
+    source.addEventListener("schedule", (e) => applyScheduleEvent(JSON.parse(e.data)));
+    source.addEventListener("send", (e) => applySendEvent(JSON.parse(e.data)));
+    source.addEventListener("log", (e) => applyLogEvent(JSON.parse(e.data)));
+    source.addEventListener("logs_cleared", applyLogsClearedEvent);
+    // A 503 (too many open streams) closes the stream for good; reload
+    // everything and try again in a while.
+    source.addEventListener("error", () => {
+      if (source.readyState !== EventSource.CLOSED) return;
+      setTimeout(startLiveUpdates, 30000);
+    });
+  }
+  function applyStatusEvent({ profile, ...status }) {
+    statusData[profile] = status;
+    if (!status.running) delete nextRuns[profile];
+    renderStatus();
+    renderDashboardSummary();
+  }
+  function applySuspendedEvent({ profile, reason }) {
+    if (!statusData[profile]) return;
+    statusData[profile].suspended = reason;
+    renderStatus();
+  }
+  function applyScheduleEvent({ profile, next_run }) {
+    nextRuns[profile] = next_run;
+    renderDashboardSummary();
+  }
+  function applySendEvent({ profile, success }) {
+    dashboardCounts.sent += 1;
+    if (!success) dashboardCounts.failed += 1;
+    elements.dashboardMessages.textContent = `${dashboardCounts.sent} Sent (${dashboardCounts.failed} Failed)`;
+    if (!analyticsData || !analyticsData.profiles[profile]) return;
+    analyticsData.profiles[profile][success ? "success" : "failure"] += 1;
+    analyticsData[success ? "success" : "failure"] += 1;
+    analyticsData.total += 1;
+    renderAnalytics();
+  }
+  function applyLogEvent({ line }) {
+    if (elements.logRefreshCheckbox.checked) {
+      elements.logPanel.textContent += line;
+      elements.logPanel.scrollTop = elements.logPanel.scrollHeight;
+    }
+    const recent = Array.from(elements.dashboardLogs.children).slice(-4);
+    elements.dashboardLogs.innerHTML = "";
+    recent.forEach((div) => elements.dashboardLogs.appendChild(div));
+    const div = document.createElement("div");
+    div.textContent = line.trim();
+    elements.dashboardLogs.appendChild(div);
+    elements.dashboardLogs.scrollTop = elements.dashboardLogs.scrollHeight;
+  }
+  function applyLogsClearedEvent() {
+    elements.logPanel.textContent = "";
+    elements.dashboardLogs.innerHTML = "";
+  }
+  function renderDashboardSummary() {
+    const profileNames = Array.from(elements.profileSelect.options).map(
+      (opt) => opt.value
+    );
+    const active = profileNames.filter((name) => statusData[name]?.running);
+    elements.dashboardStatus.textContent = `${active.length} Active / ${
+      profileNames.length - active.length
+    } Stopped`;
+    const upcoming = active
+      .filter((name) => nextRuns[name])
+      .sort((a, b) => nextRuns[a] - nextRuns[b]);
+    elements.dashboardSchedule.textContent = upcoming.length
+      ? `'${upcoming[0]}' at ${new Date(
+          nextRuns[upcoming[0]] * 1000
+        ).toLocaleTimeString("en-GB")}`
+      : "None scheduled";
+  }
+
+  // --- ANALYTICS & LOGS ---
   async function updateLogs() {
     const data = await apiRequest("/logs");
     if (!data) return;
@@ -870,6 +960,11 @@ document.addEventListener("DOMContentLoaded", () => {
     const timeRange = elements.analyticsTimeRange.value;
     const data = await apiRequest(`/analytics?range=${timeRange}`);
     if (!data) return;
+    analyticsData = data;
+    renderAnalytics();
+  }
+  function renderAnalytics() {
+    const data = analyticsData;
 
     // Update stats
     elements.analyticsStats.innerHTML = `
@@ -878,16 +973,25 @@ document.addEventListener("DOMContentLoaded", () => {
       <p>Failure: ${data.failure}</p>
     `;
 
-    // Destroy existing chart if it exists
-    if (analyticsChart) {
-      analyticsChart.destroy();
-    }
-
     // Prepare chart data
     const labels = Object.keys(data.profiles);
     const successData = labels.map((profile) => data.profiles[profile].success);
     const failureData = labels.map((profile) => data.profiles[profile].failure);
 
+    // Update the existing chart in place when only the counts changed
+    if (
+      analyticsChart &&
+      analyticsChart.data.labels.join("\n") === labels.join("\n")
+    ) {
+      analyticsChart.data.datasets[0].data = successData;
+      analyticsChart.data.datasets[1].data = failureData;
+      analyticsChart.update("none");
+      return;
+    }
+    if (analyticsChart) {
+      analyticsChart.destroy();
+    }
+
     analyticsChart = new Chart(elements.analyticsChartCtx, {
       type: "bar",
       data: {
@@ -929,14 +1033,10 @@ document.addEventListener("DOMContentLoaded", () => {
       return;
     }
     let csvContent =
-      "data:text/csv;charset=utf-8,Timestamp,Status,Profile Name\r\n";
+      "data:text/csv;charset=utf-8,Hour,Profile Name,Success,Failure\r\n";
     for (const [profileName, profileData] of Object.entries(data.profiles)) {
-      for (const [timestamp, success] of Object.entries(
-        profileData.timestamps
-      )) {
-        csvContent += `${timestamp},${
-          success ? "Success" : "Failure"
-        },${profileName}\r\n`;
+      for (const [hour, counts] of Object.entries(profileData.hours)) {
+        csvContent += `${hour},${profileName},${counts.success},${counts.failure}\r\n`;
       }
     }
     const link = document.createElement("a");
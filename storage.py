@@ -0,0 +1,1303 @@
+# -*- coding: utf-8 -*-
+"""
+Storage backends for users, profiles, send history, logs and bot runs.
+
+Both backends expose the same methods and return plain Python values
+(datetimes, dicts, lists), so app.py and control.py never see SQL:
+
+- PostgresStorage: psycopg2 behind the shared connection pool.
+- SQLiteStorage: an embedded database file for single-node deployments.
+  It runs in WAL mode so readers never block the writer. Each thread
+  reads through its own connection. All writes go through one writer
+  thread, which groups whatever is queued into a single transaction.
+  Each write runs in its own savepoint, so one failing write does not
+  undo the others. Statements are constant strings, so sqlite3's
+  per-connection statement cache keeps them prepared.
+
+On Postgres, sends is range-partitioned by month, so expiring old history
+drops whole partitions instead of deleting rows. Deleted profiles leave a
+tombstone in deleted_profiles and their send rows are purged later in
+batches (see janitor.py).
+
+When sends go through the outbox (see outbox.py), each due tick is a row
+that sender processes lease: with FOR UPDATE SKIP LOCKED on Postgres, and
+through the single writer's transactions on SQLite.
+
+`open_storage()` picks the backend from STORAGE_BACKEND ("postgres" or
+"sqlite").
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from db_pool import ConnectionPool
+
+log = logging.getLogger("discordbot")
+
+PROFILE_COLUMNS = ("token", "channelid", "schedule_mode", "interval_seconds", "cron_expression", "messages", "jitter_seconds")
+
+
+def _profile_values(cfg):
+    return (cfg.get("token", ""), cfg.get("channelid", ""), cfg.get("schedule_mode", "interval"),
+            int(cfg.get("interval_seconds") or 300), cfg.get("cron_expression", ""), json.dumps(cfg.get("messages", [])),
+            int(cfg.get("jitter_seconds") or 0))
+
+
+def _hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _rollup_rows(rows):
+    """Collapse (user_id, profile_name, timestamp, success, channel_id) rows into per-hour counters."""
+    rollups = {}
+    for user_id, profile_name, timestamp, success, _ in rows:
+        counts = rollups.setdefault((user_id, profile_name, _hour(timestamp)), [0, 0])
+        counts[0 if success else 1] += 1
+    return sorted(key + tuple(counts) for key, counts in rollups.items())
+
+
+# --- POSTGRES ---
+POSTGRES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(50) UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS profiles (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        profile_name VARCHAR(100) NOT NULL,
+        token TEXT NOT NULL,
+        channelid TEXT NOT NULL,
+        schedule_mode VARCHAR(20) DEFAULT 'interval',
+        interval_seconds INTEGER DEFAULT 300,
+        cron_expression TEXT,
+        messages JSONB NOT NULL,
+        UNIQUE (user_id, profile_name)
+    );
+    CREATE TABLE IF NOT EXISTS send_rollups (
+        user_id INTEGER NOT NULL,
+        profile_name VARCHAR(100) NOT NULL,
+        hour TIMESTAMP NOT NULL,
+        success_count INTEGER NOT NULL DEFAULT 0,
+        failure_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, profile_name, hour)
+    );
+    CREATE INDEX IF NOT EXISTS idx_send_rollups_user_hour ON send_rollups (user_id, hour);
+    CREATE TABLE IF NOT EXISTS deleted_profiles (
+        user_id INTEGER NOT NULL,
+        profile_name VARCHAR(100) NOT NULL,
+        deleted_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, profile_name, deleted_at)
+    );
+    CREATE TABLE IF NOT EXISTS logs (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        message TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_logs_user_timestamp ON logs (user_id, timestamp DESC);
+    CREATE TABLE IF NOT EXISTS bot_runs (
+        user_id INTEGER NOT NULL,
+        profile_name VARCHAR(100) NOT NULL,
+        running BOOLEAN NOT NULL DEFAULT FALSE,
+        owner TEXT,
+        sent_count INTEGER NOT NULL DEFAULT 0,
+        last_run TIMESTAMP,
+        updated_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, profile_name)
+    );
+    CREATE TABLE IF NOT EXISTS bot_owners (
+        owner TEXT PRIMARY KEY,
+        heartbeat TIMESTAMP NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS uploads (
+        digest CHAR(64) PRIMARY KEY,
+        filename TEXT NOT NULL,
+        size BIGINT NOT NULL,
+        status VARCHAR(10) NOT NULL,
+        url TEXT,
+        error TEXT,
+        created_at TIMESTAMP NOT NULL,
+        updated_at TIMESTAMP NOT NULL
+    );
+"""
+
+# Sends are range-partitioned by month: sends_pYYYYMM holds that month, and
+# sends_before_YYYYMM is a table from before partitioning, holding everything
+# older than that month.
+POSTGRES_SENDS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sends (
+        id SERIAL,
+        user_id INTEGER,
+        profile_name VARCHAR(100) NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        success BOOLEAN NOT NULL,
+        channel_id VARCHAR(32)
+    ) PARTITION BY RANGE (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_sends_user_timestamp ON sends (user_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_sends_user_profile ON sends (user_id, profile_name);
+"""
+
+# One row per due tick of a profile (see outbox.py). The partial unique index keeps at most one
+# outstanding tick per profile, so a backlog never piles up several sends of the same bot.
+POSTGRES_OUTBOX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id BIGSERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        profile_name VARCHAR(100) NOT NULL,
+        due_at TIMESTAMP NOT NULL,
+        cost INTEGER NOT NULL DEFAULT 1,
+        status VARCHAR(10) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        lease_owner TEXT,
+        lease_until TIMESTAMP,
+        sent INTEGER,
+        error TEXT,
+        created_at TIMESTAMP NOT NULL,
+        finished_at TIMESTAMP
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_outstanding ON outbox (user_id, profile_name) WHERE status IN ('pending', 'leased');
+    CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (due_at) WHERE status = 'pending';
+    CREATE INDEX IF NOT EXISTS idx_outbox_leased ON outbox (lease_until) WHERE status = 'leased';
+    CREATE INDEX IF NOT EXISTS idx_outbox_finished ON outbox (finished_at) WHERE status IN ('done', 'failed');
+"""
+
+# Advisory lock keys: schema changes (including new partitions), and the retention job.
+SCHEMA_LOCK = 7_310_001
+RETENTION_LOCK = 7_310_002
+
+
+def _month(timestamp):
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def _partition_range(name):
+    """(lower, upper) of a sends partition from its name; lower is None for the pre-partitioning table."""
+    if name.startswith("sends_before_"):
+        return None, datetime.strptime(name[len("sends_before_"):], "%Y%m")
+    if name.startswith("sends_p"):
+        month = datetime.strptime(name[len("sends_p"):], "%Y%m")
+        return month, _next_month(month)
+    return None
+
+
+class PostgresStorage:
+    backend = "postgres"
+
+    def __init__(self, db_config):
+        import psycopg2
+        from psycopg2.extras import DictCursor, execute_values
+        self._psycopg2 = psycopg2
+        self._dict_cursor = DictCursor
+        self._execute_values = execute_values
+        self.db_config = db_config
+        self.pool = ConnectionPool(self.connect)
+
+    def connect(self):
+        """Open a dedicated connection outside the pool (used by the LISTEN thread)."""
+        return self._psycopg2.connect(**self.db_config)
+
+    def connection(self):
+        """Borrow a pooled connection: `with storage.connection() as conn:` commits on exit."""
+        return self.pool.connection()
+
+    def _cursor(self, conn):
+        return conn.cursor(cursor_factory=self._dict_cursor)
+
+    # --- SCHEMA ---
+    def _base_schema(self, cur):
+        # Also brings databases from before schema_migrations up to date.
+        cur.execute(POSTGRES_SCHEMA)
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('sends')")
+        row = cur.fetchone()
+        legacy = None
+        if row and row[0] == "r":
+            # A sends table from before partitioning: keep it whole as the partition for
+            # everything before next month. Attaching it scans the table once.
+            legacy = f"sends_before_{_next_month(_month(datetime.now())):%Y%m}"
+            cur.execute(f"""
+                ALTER TABLE sends ADD COLUMN IF NOT EXISTS channel_id VARCHAR(32);
+                ALTER TABLE sends RENAME TO {legacy};
+                ALTER INDEX IF EXISTS idx_sends_user_timestamp RENAME TO {legacy}_user_timestamp;
+                ALTER INDEX IF EXISTS idx_sends_user_profile RENAME TO {legacy}_user_profile;
+                ALTER SEQUENCE IF EXISTS sends_id_seq RENAME TO {legacy}_id_seq;
+            """)
+        cur.execute(POSTGRES_SENDS_SCHEMA)
+        if legacy:
+            upper = _partition_range(legacy)[1]
+            cur.execute(f"ALTER TABLE sends ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO (%s)", (upper,))
+            cur.execute(f"SELECT setval('sends_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM {legacy}), false)")
+            log.info(f"Converted sends to a partitioned table; existing rows are in {legacy}.")
+        self._ensure_partitions(cur, datetime.now())
+        # Backfill of the rollups from sends recorded before they existed.
+        cur.execute("""
+            INSERT INTO send_rollups (user_id, profile_name, hour, success_count, failure_count)
+            SELECT user_id, profile_name, date_trunc('hour', timestamp),
+                   COUNT(*) FILTER (WHERE success), COUNT(*) FILTER (WHERE NOT success)
+            FROM sends
+            WHERE user_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM send_rollups)
+            GROUP BY user_id, profile_name, date_trunc('hour', timestamp)
+        """)
+
+    def _index_run_owners(self, cur):
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_bot_runs_owner ON bot_runs (owner) WHERE running")
+
+    def _add_profile_jitter(self, cur):
+        cur.execute("ALTER TABLE profiles ADD COLUMN IF NOT EXISTS jitter_seconds INTEGER NOT NULL DEFAULT 0")
+
+    def _create_outbox(self, cur):
+        cur.execute(POSTGRES_OUTBOX_SCHEMA)
+
+    # (version, description, fn(self, cur)), applied in order; never edit one that has shipped.
+    MIGRATIONS = (
+        (1, "base schema", _base_schema),
+        (2, "index running bot_runs by owner", _index_run_owners),
+        (3, "add profiles.jitter_seconds", _add_profile_jitter),
+        (4, "create outbox", _create_outbox),
+    )
+
+    def migrate(self):
+        """Apply the migrations missing from schema_migrations. Returns the versions applied."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+            if cur.fetchone()[0]:
+                cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+                if cur.fetchone()[0] >= self.MIGRATIONS[-1][0]:
+                    return []
+            # Workers may start together; let one of them migrate and the others find it done.
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK,))
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL
+                )
+            """)
+            cur.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in cur.fetchall()}
+            applied = []
+            for version, description, fn in self.MIGRATIONS:
+                if version in done:
+                    continue
+                fn(self, cur)
+                cur.execute("INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s)",
+                            (version, description, datetime.now()))
+                applied.append(version)
+            return applied
+
+    # --- USERS & PROFILES ---
+    def get_user(self, user_id):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT id, username, password_hash FROM users WHERE id = %s", (user_id,))
+            return cur.fetchone()
+
+    def find_user(self, username):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT id, username, password_hash FROM users WHERE username = %s", (username,))
+            return cur.fetchone()
+
+    def create_user(self, username, password_hash, default_profile):
+        """Create the user with its "default" profile. Returns the new id, or None if the name is taken."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO users (username, password_hash) VALUES (%s, %s)
+                ON CONFLICT (username) DO NOTHING RETURNING id
+            """, (username, password_hash))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            cur.execute("""
+                INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (row[0], "default") + _profile_values(default_profile))
+            return row[0]
+
+    def load_profiles(self, user_id):
+        with self.connection() as conn, self._cursor(conn) as cur:
+            cur.execute("SELECT profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds FROM profiles WHERE user_id = %s", (user_id,))
+            return {row['profile_name']: {k: row[k] for k in PROFILE_COLUMNS} for row in cur.fetchall()}
+
+    def count_profiles(self, user_id):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM profiles WHERE user_id = %s", (user_id,))
+            return cur.fetchone()[0]
+
+    def create_profile(self, user_id, profile_name, cfg):
+        """Insert a new profile. Returns False if the name is already used."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (user_id, profile_name) DO NOTHING
+            """, (user_id, profile_name) + _profile_values(cfg))
+            return cur.rowcount == 1
+
+    def save_profile(self, user_id, profile_name, cfg):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (user_id, profile_name) DO UPDATE
+                SET token = EXCLUDED.token, channelid = EXCLUDED.channelid, schedule_mode = EXCLUDED.schedule_mode,
+                    interval_seconds = EXCLUDED.interval_seconds, cron_expression = EXCLUDED.cron_expression, messages = EXCLUDED.messages,
+                    jitter_seconds = EXCLUDED.jitter_seconds
+            """, (user_id, profile_name) + _profile_values(cfg))
+
+    def save_profiles(self, user_id, profiles):
+        """Upsert {profile_name: cfg} in one statement."""
+        rows = [(user_id, name) + _profile_values(cfg) for name, cfg in profiles.items()]
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute_values(cur, """
+                INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds)
+                VALUES %s
+                ON CONFLICT (user_id, profile_name) DO UPDATE
+                SET token = EXCLUDED.token, channelid = EXCLUDED.channelid, schedule_mode = EXCLUDED.schedule_mode,
+                    interval_seconds = EXCLUDED.interval_seconds, cron_expression = EXCLUDED.cron_expression, messages = EXCLUDED.messages,
+                    jitter_seconds = EXCLUDED.jitter_seconds
+            """, rows, page_size=len(rows))
+
+    def delete_profile(self, user_id, profile_name, now):
+        """Delete a profile and its rollups. Returns False if it did not exist.
+
+        Its send rows are only marked for deletion; `purge_deleted_profiles` removes them.
+        """
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM profiles WHERE user_id = %s AND profile_name = %s", (user_id, profile_name))
+            if cur.rowcount == 0:
+                return False
+            cur.execute("DELETE FROM send_rollups WHERE user_id = %s AND profile_name = %s", (user_id, profile_name))
+            cur.execute("DELETE FROM outbox WHERE user_id = %s AND profile_name = %s", (user_id, profile_name))
+            cur.execute("INSERT INTO deleted_profiles (user_id, profile_name, deleted_at) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                        (user_id, profile_name, now))
+            return True
+
+    # --- SENDS & LOGS ---
+    def write_sends(self, rows):
+        rollups = _rollup_rows(rows)
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute_values(cur, "INSERT INTO sends (user_id, profile_name, timestamp, success, channel_id) VALUES %s", rows, page_size=len(rows))
+            self._execute_values(cur, """
+                INSERT INTO send_rollups (user_id, profile_name, hour, success_count, failure_count) VALUES %s
+                ON CONFLICT (user_id, profile_name, hour) DO UPDATE
+                SET success_count = send_rollups.success_count + EXCLUDED.success_count,
+                    failure_count = send_rollups.failure_count + EXCLUDED.failure_count
+            """, rollups, page_size=len(rollups))
+
+    def write_logs(self, rows):
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute_values(cur, "INSERT INTO logs (user_id, timestamp, message) VALUES %s", rows, page_size=len(rows))
+
+    def recent_logs(self, user_id, limit):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT message FROM logs WHERE user_id = %s ORDER BY timestamp DESC LIMIT %s", (user_id, limit))
+            return [row[0] for row in cur.fetchall()]
+
+    def clear_logs(self, user_id):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM logs WHERE user_id = %s", (user_id,))
+
+    def dashboard(self, user_id, since):
+        with self.connection() as conn, self._cursor(conn) as cur:
+            cur.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM profiles WHERE user_id = %(user_id)s) AS profile_count,
+                    COALESCE(SUM(success_count + failure_count), 0) AS total_sent,
+                    COALESCE(SUM(failure_count), 0) AS failed_sent
+                FROM send_rollups
+                WHERE user_id = %(user_id)s AND hour >= %(since)s
+            """, {"user_id": user_id, "since": since})
+            return dict(cur.fetchone())
+
+    def rollups(self, user_id, since):
+        """(profile_name, hour, success_count, failure_count) rows from `since`, oldest first."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT profile_name, hour, success_count, failure_count
+                FROM send_rollups
+                WHERE user_id = %s AND hour >= %s
+                ORDER BY hour ASC
+            """, (user_id, since))
+            return cur.fetchall()
+
+    # --- SENDS RETENTION ---
+    def _partitions(self, cur):
+        cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'sends'::regclass")
+        return {row[0]: _partition_range(row[0]) for row in cur.fetchall() if _partition_range(row[0])}
+
+    def _ensure_partitions(self, cur, now):
+        """Create the partitions for this month and the next. The caller holds SCHEMA_LOCK."""
+        existing = self._partitions(cur).values()
+        this_month = _month(now)
+        for month in (this_month, _next_month(this_month)):
+            if any((lower is None or lower <= month) and month < upper for lower, upper in existing):
+                continue
+            cur.execute(f"CREATE TABLE IF NOT EXISTS sends_p{month:%Y%m} PARTITION OF sends FOR VALUES FROM (%s) TO (%s)",
+                        (month, _next_month(month)))
+
+    def ensure_partitions(self, now):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK,))
+            self._ensure_partitions(cur, now)
+
+    def expire_sends(self, cutoff, batch):
+        """Drop the sends partitions that end before `cutoff`. Returns how many were dropped.
+
+        Their counts are already in send_rollups, which is written along with the rows.
+        """
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (RETENTION_LOCK,))
+            if not cur.fetchone()[0]:
+                return 0  # Another worker is on it.
+            expired = sorted(name for name, (_, upper) in self._partitions(cur).items() if upper <= cutoff)
+            for name in expired:
+                cur.execute(f"DROP TABLE {name}")
+            return len(expired)
+
+    def purge_deleted_profiles(self, batch):
+        """Delete up to `batch` send rows of one deleted profile.
+
+        Returns the number of rows deleted, or None when nothing is left to purge.
+        """
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT user_id, profile_name, deleted_at FROM deleted_profiles ORDER BY deleted_at LIMIT 1 FOR UPDATE SKIP LOCKED")
+            tombstone = cur.fetchone()
+            if tombstone is None:
+                return None
+            # A profile created again under the same name keeps the rows sent after the deletion.
+            cur.execute("""
+                DELETE FROM sends WHERE user_id = %(user_id)s AND profile_name = %(name)s AND timestamp <= %(deleted_at)s
+                AND id IN (SELECT id FROM sends WHERE user_id = %(user_id)s AND profile_name = %(name)s AND timestamp <= %(deleted_at)s LIMIT %(batch)s)
+            """, {"user_id": tombstone[0], "name": tombstone[1], "deleted_at": tombstone[2], "batch": batch})
+            deleted = cur.rowcount
+            if deleted < batch:
+                cur.execute("DELETE FROM deleted_profiles WHERE user_id = %s AND profile_name = %s AND deleted_at = %s", tombstone)
+            return deleted
+
+    # --- BOT RUNS ---
+    def heartbeat(self, owner, now, updates, live_after, purge_before):
+        """Refresh `owner`'s heartbeat, write its pending counters and return the live owners."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO bot_owners (owner, heartbeat) VALUES (%s, %s)
+                ON CONFLICT (owner) DO UPDATE SET heartbeat = EXCLUDED.heartbeat
+            """, (owner, now))
+            if updates:
+                cur.executemany("""
+                    UPDATE bot_runs SET sent_count = %s, last_run = %s, updated_at = %s
+                    WHERE user_id = %s AND profile_name = %s AND owner = %s
+                """, [(sent, last_run, now, user_id, profile_name, owner) for user_id, profile_name, sent, last_run in updates])
+            cur.execute("SELECT owner FROM bot_owners WHERE heartbeat > %s", (live_after,))
+            live = {row[0] for row in cur.fetchall()}
+            cur.execute("DELETE FROM bot_owners WHERE heartbeat < %s", (purge_before,))
+            return live
+
+    def load_runs(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT user_id, profile_name, running, owner, sent_count, last_run FROM bot_runs")
+            return cur.fetchall()
+
+    def claim_run(self, user_id, profile_name, owner, now, live_after):
+        """Mark the run as started by `owner` unless a live owner already runs it."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO bot_runs (user_id, profile_name, running, owner, sent_count, last_run, updated_at)
+                VALUES (%s, %s, TRUE, %s, 0, NULL, %s)
+                ON CONFLICT (user_id, profile_name) DO UPDATE
+                SET running = TRUE, owner = EXCLUDED.owner, sent_count = 0, last_run = NULL, updated_at = EXCLUDED.updated_at
+                WHERE NOT bot_runs.running OR bot_runs.owner IS NULL
+                   OR bot_runs.owner NOT IN (SELECT owner FROM bot_owners WHERE heartbeat > %s)
+            """, (user_id, profile_name, owner, now, live_after))
+            return cur.rowcount == 1
+
+    def claim_runs(self, user_id, profile_names, owner, now, live_after):
+        """`claim_run` for many profiles in one statement. Returns the names that were claimed."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO bot_runs (user_id, profile_name, running, owner, sent_count, last_run, updated_at)
+                SELECT %s, name, TRUE, %s, 0, NULL, %s FROM unnest(%s::varchar[]) AS name
+                ON CONFLICT (user_id, profile_name) DO UPDATE
+                SET running = TRUE, owner = EXCLUDED.owner, sent_count = 0, last_run = NULL, updated_at = EXCLUDED.updated_at
+                WHERE NOT bot_runs.running OR bot_runs.owner IS NULL
+                   OR bot_runs.owner NOT IN (SELECT owner FROM bot_owners WHERE heartbeat > %s)
+                RETURNING profile_name
+            """, (user_id, owner, now, list(profile_names), live_after))
+            return {row[0] for row in cur.fetchall()}
+
+    def stop_run(self, user_id, profile_name, now):
+        """Mark the run stopped and drop its tick waiting in the outbox, if any."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("UPDATE bot_runs SET running = FALSE, updated_at = %s WHERE user_id = %s AND profile_name = %s",
+                        (now, user_id, profile_name))
+            cur.execute("DELETE FROM outbox WHERE user_id = %s AND profile_name = %s AND status = 'pending'", (user_id, profile_name))
+
+    def stop_runs(self, user_id, profile_names, now):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("UPDATE bot_runs SET running = FALSE, updated_at = %s WHERE user_id = %s AND profile_name = ANY(%s)",
+                        (now, user_id, list(profile_names)))
+            cur.execute("DELETE FROM outbox WHERE user_id = %s AND profile_name = ANY(%s) AND status = 'pending'",
+                        (user_id, list(profile_names)))
+
+    def release_owner(self, owner, now):
+        """Hand back every run owned by `owner` (they stay running, for another process to adopt) and forget the owner."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("UPDATE bot_runs SET owner = NULL, updated_at = %s WHERE owner = %s AND running", (now, owner))
+            cur.execute("DELETE FROM bot_owners WHERE owner = %s", (owner,))
+
+    def adopt_runs(self, owner, now, live_after):
+        """Take over the running runs that have no live owner. Returns their (user_id, profile_name, sent_count, last_run)."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE bot_runs SET owner = %s, updated_at = %s
+                WHERE (user_id, profile_name) IN (
+                    SELECT user_id, profile_name FROM bot_runs
+                    WHERE running AND (owner IS NULL OR owner NOT IN (SELECT owner FROM bot_owners WHERE heartbeat > %s))
+                    FOR UPDATE SKIP LOCKED)
+                RETURNING user_id, profile_name, sent_count, last_run
+            """, (owner, now, live_after))
+            return cur.fetchall()
+
+    def delete_run(self, user_id, profile_name):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM bot_runs WHERE user_id = %s AND profile_name = %s", (user_id, profile_name))
+
+    # --- OUTBOX ---
+    def enqueue_send(self, user_id, profile_name, due_at, cost, now):
+        """Queue a due tick of the profile. False if one is already waiting or being sent."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO outbox (user_id, profile_name, due_at, cost, status, attempts, created_at)
+                VALUES (%s, %s, %s, %s, 'pending', 0, %s)
+                ON CONFLICT DO NOTHING
+            """, (user_id, profile_name, due_at, cost, now))
+            return cur.rowcount == 1
+
+    def claim_outbox(self, owner, now, lease_until, limit, max_attempts):
+        """Lease up to `limit` due ticks to `owner`, oldest first. Returns their (id, user_id, profile_name, due_at, cost).
+
+        Ticks whose lease ran out are due again, so a crashed sender's work is
+        picked up by the others; after `max_attempts` leases a tick is failed.
+        Concurrent claimers skip each other's rows instead of waiting on them.
+        """
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE outbox SET status = 'failed', error = 'lease expired', lease_owner = NULL, lease_until = NULL, finished_at = %s
+                WHERE id IN (
+                    SELECT id FROM outbox WHERE status = 'leased' AND lease_until < %s AND attempts >= %s
+                    FOR UPDATE SKIP LOCKED)
+            """, (now, now, max_attempts))
+            cur.execute("""
+                UPDATE outbox SET status = 'leased', lease_owner = %s, lease_until = %s, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE (status = 'pending' AND due_at <= %s) OR (status = 'leased' AND lease_until < %s)
+                    ORDER BY due_at LIMIT %s
+                    FOR UPDATE SKIP LOCKED)
+                RETURNING id, user_id, profile_name, due_at, cost
+            """, (owner, lease_until, now, now, limit))
+            return cur.fetchall()
+
+    def finish_outbox(self, outcomes, now):
+        """Record (id, owner, status, retry_at, sent, error) outcomes of leased ticks.
+
+        "done" and "failed" are final; "pending" requeues the tick at retry_at.
+        Outcomes whose lease was lost to another sender are ignored. The
+        channels reached by done ticks are added to bot_runs; returns the
+        updated (user_id, profile_name, running, owner, sent_count, last_run).
+        """
+        rows = [(id, owner, status, retry_at, sent, error, None if status == "pending" else now)
+                for id, owner, status, retry_at, sent, error in outcomes]
+        with self.connection() as conn, conn.cursor() as cur:
+            finished = self._execute_values(cur, """
+                UPDATE outbox o SET status = v.status, due_at = COALESCE(v.retry_at, o.due_at), sent = v.sent, error = v.error,
+                    attempts = CASE WHEN v.status = 'pending' THEN 0 ELSE o.attempts END,
+                    lease_owner = NULL, lease_until = NULL, finished_at = v.finished_at
+                FROM (VALUES %s) AS v (id, owner, status, retry_at, sent, error, finished_at)
+                WHERE o.id = v.id AND o.lease_owner = v.owner AND o.status = 'leased'
+                RETURNING o.user_id, o.profile_name, v.status, v.sent
+            """, rows, template="(%s, %s, %s, %s::timestamp, %s::integer, %s, %s::timestamp)", page_size=len(rows), fetch=True)
+            counts = {}
+            for user_id, profile_name, status, sent in finished:
+                if status == "done" and sent:
+                    counts[(user_id, profile_name)] = counts.get((user_id, profile_name), 0) + sent
+            if not counts:
+                return []
+            return self._execute_values(cur, """
+                UPDATE bot_runs r SET sent_count = r.sent_count + v.sent, last_run = v.at, updated_at = v.at
+                FROM (VALUES %s) AS v (user_id, profile_name, sent, at)
+                WHERE r.user_id = v.user_id AND r.profile_name = v.profile_name
+                RETURNING r.user_id, r.profile_name, r.running, r.owner, r.sent_count, r.last_run
+            """, [key + (sent, now) for key, sent in sorted(counts.items())],
+                template="(%s::integer, %s, %s::integer, %s::timestamp)", page_size=len(counts), fetch=True)
+
+    def outbox_stats(self, now):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT status, COUNT(*), MIN(due_at) FILTER (WHERE status = 'pending' AND due_at <= %s)
+                FROM outbox GROUP BY status
+            """, (now,))
+            rows = cur.fetchall()
+        oldest = min((due for _, _, due in rows if due is not None), default=None)
+        return dict({status: count for status, count, _ in rows},
+                    lag_seconds=round((now - oldest).total_seconds(), 3) if oldest else 0.0)
+
+    def expire_outbox(self, cutoff, batch):
+        """Delete up to `batch` finished ticks older than `cutoff`. Returns how many were deleted."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM outbox WHERE id IN (
+                    SELECT id FROM outbox WHERE status IN ('done', 'failed') AND finished_at < %s LIMIT %s)
+            """, (cutoff, batch))
+            return cur.rowcount
+
+    # --- UPLOADS ---
+    def get_upload(self, digest):
+        with self.connection() as conn, self._cursor(conn) as cur:
+            cur.execute("SELECT status, url, filename, size, error FROM uploads WHERE digest = %s", (digest,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+    def claim_upload(self, digest, filename, size, now, stale_before):
+        """Claim the upload of `digest` for this caller.
+
+        Returns None when claimed (new, previously failed, or abandoned while
+        pending), otherwise the existing row.
+        """
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO uploads (digest, filename, size, status, created_at, updated_at)
+                VALUES (%s, %s, %s, 'pending', %s, %s)
+                ON CONFLICT (digest) DO UPDATE
+                SET status = 'pending', filename = EXCLUDED.filename, error = NULL, updated_at = EXCLUDED.updated_at
+                WHERE uploads.status = 'failed' OR (uploads.status = 'pending' AND uploads.updated_at < %s)
+            """, (digest, filename, size, now, now, stale_before))
+            if cur.rowcount == 1:
+                return None
+        return self.get_upload(digest)
+
+    def finish_upload(self, digest, status, url, error, now):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("UPDATE uploads SET status = %s, url = %s, error = %s, updated_at = %s WHERE digest = %s",
+                        (status, url, error, now, digest))
+
+    def stats(self):
+        return dict(self.pool.stats(), backend=self.backend)
+
+    def close(self):
+        self.pool.close()
+
+
+# --- SQLITE ---
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS profiles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER REFERENCES users(id),
+        profile_name TEXT NOT NULL,
+        token TEXT NOT NULL,
+        channelid TEXT NOT NULL,
+        schedule_mode TEXT DEFAULT 'interval',
+        interval_seconds INTEGER DEFAULT 300,
+        cron_expression TEXT,
+        messages TEXT NOT NULL,
+        UNIQUE (user_id, profile_name)
+    );
+    CREATE TABLE IF NOT EXISTS sends (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        profile_name TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        success INTEGER NOT NULL,
+        channel_id TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_sends_user_timestamp ON sends (user_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_sends_user_profile ON sends (user_id, profile_name);
+    CREATE INDEX IF NOT EXISTS idx_sends_timestamp ON sends (timestamp);
+    CREATE TABLE IF NOT EXISTS send_rollups (
+        user_id INTEGER NOT NULL,
+        profile_name TEXT NOT NULL,
+        hour TEXT NOT NULL,
+        success_count INTEGER NOT NULL DEFAULT 0,
+        failure_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, profile_name, hour)
+    );
+    CREATE INDEX IF NOT EXISTS idx_send_rollups_user_hour ON send_rollups (user_id, hour);
+    CREATE TABLE IF NOT EXISTS deleted_profiles (
+        user_id INTEGER NOT NULL,
+        profile_name TEXT NOT NULL,
+        deleted_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, profile_name, deleted_at)
+    );
+    CREATE TABLE IF NOT EXISTS logs (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        timestamp TEXT NOT NULL,
+        message TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_logs_user_timestamp ON logs (user_id, timestamp DESC);
+    CREATE TABLE IF NOT EXISTS bot_runs (
+        user_id INTEGER NOT NULL,
+        profile_name TEXT NOT NULL,
+        running INTEGER NOT NULL DEFAULT 0,
+        owner TEXT,
+        sent_count INTEGER NOT NULL DEFAULT 0,
+        last_run TEXT,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, profile_name)
+    );
+    CREATE TABLE IF NOT EXISTS bot_owners (
+        owner TEXT PRIMARY KEY,
+        heartbeat TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS uploads (
+        digest TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        url TEXT,
+        error TEXT,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+"""
+
+SQLITE_OUTBOX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        profile_name TEXT NOT NULL,
+        due_at TEXT NOT NULL,
+        cost INTEGER NOT NULL DEFAULT 1,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        lease_owner TEXT,
+        lease_until TEXT,
+        sent INTEGER,
+        error TEXT,
+        created_at TEXT NOT NULL,
+        finished_at TEXT
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_outstanding ON outbox (user_id, profile_name) WHERE status IN ('pending', 'leased');
+    CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (due_at) WHERE status = 'pending';
+    CREATE INDEX IF NOT EXISTS idx_outbox_leased ON outbox (lease_until) WHERE status = 'leased';
+    CREATE INDEX IF NOT EXISTS idx_outbox_finished ON outbox (finished_at) WHERE status IN ('done', 'failed')
+"""
+
+
+def _ts(value):
+    # Timestamps are stored as ISO text, which sorts chronologically.
+    return value.isoformat(sep=" ") if value is not None else None
+
+
+def _dt(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class SQLiteStorage:
+    backend = "sqlite"
+
+    def __init__(self, path, max_batch=None, busy_timeout=5.0):
+        self.path = path
+        self.max_batch = max_batch or int(os.environ.get("SQLITE_WRITE_BATCH", 256))
+        self.busy_timeout = busy_timeout
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Connections and the writer thread do not survive a fork.
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._stats = {"reads": 0, "writes": 0, "commits": 0, "failed": 0, "max_batch_seen": 0, "connections": 0}
+
+    def _open(self):
+        self._stats["connections"] += 1
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _reader(self):
+        if self._pid != os.getpid():
+            self._reset()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    def _read(self, sql, params=()):
+        self._stats["reads"] += 1
+        return self._reader().execute(sql, params).fetchall()
+
+    # --- WRITER ---
+    def _write(self, fn):
+        """Run `fn(conn)` on the writer thread and return its result once committed.
+
+        `fn` must not return a cursor: it would be finalized on the caller's
+        thread while the writer reuses the same cached statement.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        if not (self._writer and self._writer.is_alive()):
+            with self._start_lock:
+                if not (self._writer and self._writer.is_alive()):
+                    self._writer = threading.Thread(target=self._run_writer, name="sqlite-writer", daemon=True)
+                    self._writer.start()
+        future = Future()
+        self._queue.put((fn, future))
+        return future.result()
+
+    def _run_writer(self):
+        conn = self._open()
+        while True:
+            jobs = [self._queue.get()]
+            while len(jobs) < self.max_batch:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            results = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, future in jobs:
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        results.append((future, fn(conn), None))
+                        conn.execute("RELEASE job")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        results.append((future, None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                log.error(f"SQLite commit of {len(jobs)} writes failed: {e}")
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                self._stats["failed"] += len(jobs)
+                for fn, future in jobs:
+                    future.set_exception(e)
+                continue
+            self._stats["writes"] += len(jobs)
+            self._stats["commits"] += 1
+            self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(jobs))
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def _execute(self, sql, params=()):
+        """Run one write statement and return its rowcount."""
+        return self._write(lambda conn: conn.execute(sql, params).rowcount)
+
+    # --- SCHEMA ---
+    def _base_schema(self, conn):
+        for statement in SQLITE_SCHEMA.split(";"):
+            conn.execute(statement)
+        # Sends recorded before multi-channel profiles have no channel_id.
+        if "channel_id" not in {row[1] for row in conn.execute("PRAGMA table_info(sends)")}:
+            conn.execute("ALTER TABLE sends ADD COLUMN channel_id TEXT")
+        conn.execute("""
+            INSERT INTO send_rollups (user_id, profile_name, hour, success_count, failure_count)
+            SELECT user_id, profile_name, strftime('%Y-%m-%d %H:00:00', timestamp),
+                   SUM(CASE WHEN success THEN 1 ELSE 0 END), SUM(CASE WHEN success THEN 0 ELSE 1 END)
+            FROM sends
+            WHERE user_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM send_rollups)
+            GROUP BY user_id, profile_name, strftime('%Y-%m-%d %H:00:00', timestamp)
+        """)
+
+    def _index_run_owners(self, conn):
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_bot_runs_owner ON bot_runs (owner) WHERE running")
+
+    def _add_profile_jitter(self, conn):
+        if "jitter_seconds" not in {row[1] for row in conn.execute("PRAGMA table_info(profiles)")}:
+            conn.execute("ALTER TABLE profiles ADD COLUMN jitter_seconds INTEGER NOT NULL DEFAULT 0")
+
+    def _create_outbox(self, conn):
+        for statement in SQLITE_OUTBOX_SCHEMA.split(";"):
+            conn.execute(statement)
+
+    MIGRATIONS = (
+        (1, "base schema", _base_schema),
+        (2, "index running bot_runs by owner", _index_run_owners),
+        (3, "add profiles.jitter_seconds", _add_profile_jitter),
+        (4, "create outbox", _create_outbox),
+    )
+
+    def migrate(self):
+        if self._read("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'schema_migrations'")[0][0]:
+            if self._read("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")[0][0] >= self.MIGRATIONS[-1][0]:
+                return []
+
+        def apply(conn):
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TEXT NOT NULL
+                )
+            """)
+            done = {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+            applied = []
+            for version, description, fn in self.MIGRATIONS:
+                if version in done:
+                    continue
+                fn(self, conn)
+                conn.execute("INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+                             (version, description, _ts(datetime.now())))
+                applied.append(version)
+            return applied
+        return self._write(apply)
+
+    # --- USERS & PROFILES ---
+    def get_user(self, user_id):
+        rows = self._read("SELECT id, username, password_hash FROM users WHERE id = ?", (user_id,))
+        return rows[0] if rows else None
+
+    def find_user(self, username):
+        rows = self._read("SELECT id, username, password_hash FROM users WHERE username = ?", (username,))
+        return rows[0] if rows else None
+
+    def create_user(self, username, password_hash, default_profile):
+        def create(conn):
+            cur = conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?) ON CONFLICT (username) DO NOTHING",
+                               (username, password_hash))
+            if cur.rowcount == 0:
+                return None
+            conn.execute("""
+                INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (cur.lastrowid, "default") + _profile_values(default_profile))
+            return cur.lastrowid
+        return self._write(create)
+
+    def load_profiles(self, user_id):
+        rows = self._read("SELECT profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds FROM profiles WHERE user_id = ?", (user_id,))
+        profiles = {}
+        for row in rows:
+            profiles[row[0]] = dict(zip(PROFILE_COLUMNS, row[1:]))
+            profiles[row[0]]["messages"] = json.loads(row[6])
+        return profiles
+
+    def count_profiles(self, user_id):
+        return self._read("SELECT COUNT(*) FROM profiles WHERE user_id = ?", (user_id,))[0][0]
+
+    def create_profile(self, user_id, profile_name, cfg):
+        return self._execute("""
+            INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, profile_name) DO NOTHING
+        """, (user_id, profile_name) + _profile_values(cfg)) == 1
+
+    def save_profile(self, user_id, profile_name, cfg):
+        self._execute("""
+            INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, profile_name) DO UPDATE
+            SET token = excluded.token, channelid = excluded.channelid, schedule_mode = excluded.schedule_mode,
+                interval_seconds = excluded.interval_seconds, cron_expression = excluded.cron_expression, messages = excluded.messages,
+                jitter_seconds = excluded.jitter_seconds
+        """, (user_id, profile_name) + _profile_values(cfg))
+
+    def save_profiles(self, user_id, profiles):
+        rows = [(user_id, name) + _profile_values(cfg) for name, cfg in profiles.items()]
+        self._write(lambda conn: conn.executemany("""
+            INSERT INTO profiles (user_id, profile_name, token, channelid, schedule_mode, interval_seconds, cron_expression, messages, jitter_seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, profile_name) DO UPDATE
+            SET token = excluded.token, channelid = excluded.channelid, schedule_mode = excluded.schedule_mode,
+                interval_seconds = excluded.interval_seconds, cron_expression = excluded.cron_expression, messages = excluded.messages,
+                jitter_seconds = excluded.jitter_seconds
+        """, rows).rowcount)
+
+    def delete_profile(self, user_id, profile_name, now):
+        def delete(conn):
+            if conn.execute("DELETE FROM profiles WHERE user_id = ? AND profile_name = ?", (user_id, profile_name)).rowcount == 0:
+                return False
+            conn.execute("DELETE FROM send_rollups WHERE user_id = ? AND profile_name = ?", (user_id, profile_name))
+            conn.execute("DELETE FROM outbox WHERE user_id = ? AND profile_name = ?", (user_id, profile_name))
+            conn.execute("INSERT INTO deleted_profiles (user_id, profile_name, deleted_at) VALUES (?, ?, ?) ON CONFLICT DO NOTHING",
+                         (user_id, profile_name, _ts(now)))
+            return True
+        return self._write(delete)
+
+    # --- SENDS & LOGS ---
+    def write_sends(self, rows):
+        sends = [(user_id, profile_name, _ts(timestamp), int(success), channel_id)
+                 for user_id, profile_name, timestamp, success, channel_id in rows]
+        rollups = [(user_id, profile_name, _ts(hour), ok, failed) for user_id, profile_name, hour, ok, failed in _rollup_rows(rows)]
+
+        def write(conn):
+            conn.executemany("INSERT INTO sends (user_id, profile_name, timestamp, success, channel_id) VALUES (?, ?, ?, ?, ?)", sends)
+            conn.executemany("""
+                INSERT INTO send_rollups (user_id, profile_name, hour, success_count, failure_count) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, profile_name, hour) DO UPDATE
+                SET success_count = success_count + excluded.success_count,
+                    failure_count = failure_count + excluded.failure_count
+            """, rollups)
+        self._write(write)
+
+    def write_logs(self, rows):
+        rows = [(user_id, _ts(timestamp), message) for user_id, timestamp, message in rows]
+        self._write(lambda conn: conn.executemany("INSERT INTO logs (user_id, timestamp, message) VALUES (?, ?, ?)", rows).rowcount)
+
+    def recent_logs(self, user_id, limit):
+        return [row[0] for row in self._read("SELECT message FROM logs WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?", (user_id, limit))]
+
+    def clear_logs(self, user_id):
+        self._execute("DELETE FROM logs WHERE user_id = ?", (user_id,))
+
+    def dashboard(self, user_id, since):
+        profile_count, total_sent, failed_sent = self._read("""
+            SELECT
+                (SELECT COUNT(*) FROM profiles WHERE user_id = ?1),
+                COALESCE(SUM(success_count + failure_count), 0),
+                COALESCE(SUM(failure_count), 0)
+            FROM send_rollups
+            WHERE user_id = ?1 AND hour >= ?2
+        """, (user_id, _ts(since)))[0]
+        return {"profile_count": profile_count, "total_sent": total_sent, "failed_sent": failed_sent}
+
+    def rollups(self, user_id, since):
+        rows = self._read("""
+            SELECT profile_name, hour, success_count, failure_count
+            FROM send_rollups
+            WHERE user_id = ? AND hour >= ?
+            ORDER BY hour ASC
+        """, (user_id, _ts(since)))
+        return [(profile_name, _dt(hour), ok, failed) for profile_name, hour, ok, failed in rows]
+
+    # --- SENDS RETENTION ---
+    # SQLite has no partitions: expired rows are deleted in batches, each its own write.
+    def ensure_partitions(self, now):
+        pass
+
+    def expire_sends(self, cutoff, batch):
+        """Delete sends older than `cutoff`. Returns how many rows were deleted."""
+        deleted = 0
+        while True:
+            count = self._execute("DELETE FROM sends WHERE id IN (SELECT id FROM sends WHERE timestamp < ? LIMIT ?)", (_ts(cutoff), batch))
+            deleted += count
+            if count < batch:
+                return deleted
+
+    def purge_deleted_profiles(self, batch):
+        def purge(conn):
+            tombstone = conn.execute("SELECT user_id, profile_name, deleted_at FROM deleted_profiles ORDER BY deleted_at LIMIT 1").fetchone()
+            if tombstone is None:
+                return None
+            deleted = conn.execute("""
+                DELETE FROM sends WHERE id IN (
+                    SELECT id FROM sends WHERE user_id = ?1 AND profile_name = ?2 AND timestamp <= ?3 LIMIT ?4)
+            """, tombstone + (batch,)).rowcount
+            if deleted < batch:
+                conn.execute("DELETE FROM deleted_profiles WHERE user_id = ? AND profile_name = ? AND deleted_at = ?", tombstone)
+            return deleted
+        return self._write(purge)
+
+    # --- BOT RUNS ---
+    def heartbeat(self, owner, now, updates, live_after, purge_before):
+        def beat(conn):
+            conn.execute("""
+                INSERT INTO bot_owners (owner, heartbeat) VALUES (?, ?)
+                ON CONFLICT (owner) DO UPDATE SET heartbeat = excluded.heartbeat
+            """, (owner, _ts(now)))
+            conn.executemany("""
+                UPDATE bot_runs SET sent_count = ?, last_run = ?, updated_at = ?
+                WHERE user_id = ? AND profile_name = ? AND owner = ?
+            """, [(sent, _ts(last_run), _ts(now), user_id, profile_name, owner) for user_id, profile_name, sent, last_run in updates])
+            live = {row[0] for row in conn.execute("SELECT owner FROM bot_owners WHERE heartbeat > ?", (_ts(live_after),))}
+            conn.execute("DELETE FROM bot_owners WHERE heartbeat < ?", (_ts(purge_before),))
+            return live
+        return self._write(beat)
+
+    def load_runs(self):
+        rows = self._read("SELECT user_id, profile_name, running, owner, sent_count, last_run FROM bot_runs")
+        return [(user_id, profile_name, bool(running), owner, sent_count, _dt(last_run))
+                for user_id, profile_name, running, owner, sent_count, last_run in rows]
+
+    def claim_run(self, user_id, profile_name, owner, now, live_after):
+        return self._execute("""
+            INSERT INTO bot_runs (user_id, profile_name, running, owner, sent_count, last_run, updated_at)
+            VALUES (?, ?, 1, ?, 0, NULL, ?)
+            ON CONFLICT (user_id, profile_name) DO UPDATE
+            SET running = 1, owner = excluded.owner, sent_count = 0, last_run = NULL, updated_at = excluded.updated_at
+            WHERE NOT bot_runs.running OR bot_runs.owner IS NULL
+               OR bot_runs.owner NOT IN (SELECT owner FROM bot_owners WHERE heartbeat > ?)
+        """, (user_id, profile_name, owner, _ts(now), _ts(live_after))) == 1
+
+    def claim_runs(self, user_id, profile_names, owner, now, live_after):
+        def claim(conn):
+            claimed = set()
+            for name in profile_names:
+                if conn.execute("""
+                    INSERT INTO bot_runs (user_id, profile_name, running, owner, sent_count, last_run, updated_at)
+                    VALUES (?, ?, 1, ?, 0, NULL, ?)
+                    ON CONFLICT (user_id, profile_name) DO UPDATE
+                    SET running = 1, owner = excluded.owner, sent_count = 0, last_run = NULL, updated_at = excluded.updated_at
+                    WHERE NOT bot_runs.running OR bot_runs.owner IS NULL
+                       OR bot_runs.owner NOT IN (SELECT owner FROM bot_owners WHERE heartbeat > ?)
+                """, (user_id, name, owner, _ts(now), _ts(live_after))).rowcount == 1:
+                    claimed.add(name)
+            return claimed
+        return self._write(claim)
+
+    def stop_run(self, user_id, profile_name, now):
+        self.stop_runs(user_id, [profile_name], now)
+
+    def stop_runs(self, user_id, profile_names, now):
+        def stop(conn):
+            conn.executemany("UPDATE bot_runs SET running = 0, updated_at = ? WHERE user_id = ? AND profile_name = ?",
+                             [(_ts(now), user_id, name) for name in profile_names])
+            conn.executemany("DELETE FROM outbox WHERE user_id = ? AND profile_name = ? AND status = 'pending'",
+                             [(user_id, name) for name in profile_names])
+        self._write(stop)
+
+    def release_owner(self, owner, now):
+        def release(conn):
+            conn.execute("UPDATE bot_runs SET owner = NULL, updated_at = ? WHERE owner = ? AND running", (_ts(now), owner))
+            conn.execute("DELETE FROM bot_owners WHERE owner = ?", (owner,))
+        self._write(release)
+
+    def adopt_runs(self, owner, now, live_after):
+        rows = self._write(lambda conn: conn.execute("""
+            UPDATE bot_runs SET owner = ?1, updated_at = ?2
+            WHERE running AND (owner IS NULL OR owner NOT IN (SELECT owner FROM bot_owners WHERE heartbeat > ?3))
+            RETURNING user_id, profile_name, sent_count, last_run
+        """, (owner, _ts(now), _ts(live_after))).fetchall())
+        return [(user_id, profile_name, sent_count, _dt(last_run)) for user_id, profile_name, sent_count, last_run in rows]
+
+    def delete_run(self, user_id, profile_name):
+        self._execute("DELETE FROM bot_runs WHERE user_id = ? AND profile_name = ?", (user_id, profile_name))
+
+    # --- OUTBOX ---
+    # No SKIP LOCKED here: claims go through the writer's BEGIN IMMEDIATE transactions, which
+    # serialize them across threads and processes sharing the file.
+    def enqueue_send(self, user_id, profile_name, due_at, cost, now):
+        return self._execute("""
+            INSERT INTO outbox (user_id, profile_name, due_at, cost, status, attempts, created_at)
+            VALUES (?, ?, ?, ?, 'pending', 0, ?)
+            ON CONFLICT DO NOTHING
+        """, (user_id, profile_name, _ts(due_at), cost, _ts(now))) == 1
+
+    def claim_outbox(self, owner, now, lease_until, limit, max_attempts):
+        def claim(conn):
+            conn.execute("""
+                UPDATE outbox SET status = 'failed', error = 'lease expired', lease_owner = NULL, lease_until = NULL, finished_at = ?1
+                WHERE status = 'leased' AND lease_until < ?1 AND attempts >= ?2
+            """, (_ts(now), max_attempts))
+            return conn.execute("""
+                UPDATE outbox SET status = 'leased', lease_owner = ?1, lease_until = ?2, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE (status = 'pending' AND due_at <= ?3) OR (status = 'leased' AND lease_until < ?3)
+                    ORDER BY due_at LIMIT ?4)
+                RETURNING id, user_id, profile_name, due_at, cost
+            """, (owner, _ts(lease_until), _ts(now), limit)).fetchall()
+        rows = self._write(claim)
+        return [(id, user_id, profile_name, _dt(due_at), cost) for id, user_id, profile_name, due_at, cost in rows]
+
+    def finish_outbox(self, outcomes, now):
+        def finish(conn):
+            counts = {}
+            for id, owner, status, retry_at, sent, error in outcomes:
+                row = conn.execute("""
+                    UPDATE outbox SET status = ?1, due_at = COALESCE(?2, due_at), sent = ?3, error = ?4,
+                        attempts = CASE WHEN ?1 = 'pending' THEN 0 ELSE attempts END,
+                        lease_owner = NULL, lease_until = NULL, finished_at = ?5
+                    WHERE id = ?6 AND lease_owner = ?7 AND status = 'leased'
+                    RETURNING user_id, profile_name
+                """, (status, _ts(retry_at), sent, error, None if status == "pending" else _ts(now), id, owner)).fetchone()
+                if row is not None and status == "done" and sent:
+                    counts[row] = counts.get(row, 0) + sent
+            updated = []
+            for (user_id, profile_name), sent in sorted(counts.items()):
+                updated += conn.execute("""
+                    UPDATE bot_runs SET sent_count = sent_count + ?1, last_run = ?2, updated_at = ?2
+                    WHERE user_id = ?3 AND profile_name = ?4
+                    RETURNING user_id, profile_name, running, owner, sent_count, last_run
+                """, (sent, _ts(now), user_id, profile_name)).fetchall()
+            return updated
+        return [(user_id, profile_name, bool(running), owner, sent_count, _dt(last_run))
+                for user_id, profile_name, running, owner, sent_count, last_run in self._write(finish)]
+
+    def outbox_stats(self, now):
+        rows = self._read("""
+            SELECT status, COUNT(*), MIN(CASE WHEN status = 'pending' AND due_at <= ? THEN due_at END)
+            FROM outbox GROUP BY status
+        """, (_ts(now),))
+        oldest = min((_dt(due) for _, _, due in rows if due is not None), default=None)
+        return dict({status: count for status, count, _ in rows},
+                    lag_seconds=round((now - oldest).total_seconds(), 3) if oldest else 0.0)
+
+    def expire_outbox(self, cutoff, batch):
+        return self._execute("""
+            DELETE FROM outbox WHERE id IN (
+                SELECT id FROM outbox WHERE status IN ('done', 'failed') AND finished_at < ? LIMIT ?)
+        """, (_ts(cutoff), batch))
+
+    # --- UPLOADS ---
+    def get_upload(self, digest):
+        rows = self._read("SELECT status, url, filename, size, error FROM uploads WHERE digest = ?", (digest,))
+        return dict(zip(("status", "url", "filename", "size", "error"), rows[0])) if rows else None
+
+    def claim_upload(self, digest, filename, size, now, stale_before):
+        claimed = self._execute("""
+            INSERT INTO uploads (digest, filename, size, status, created_at, updated_at)
+            VALUES (?, ?, ?, 'pending', ?, ?)
+            ON CONFLICT (digest) DO UPDATE
+            SET status = 'pending', filename = excluded.filename, error = NULL, updated_at = excluded.updated_at
+            WHERE uploads.status = 'failed' OR (uploads.status = 'pending' AND uploads.updated_at < ?)
+        """, (digest, filename, size, _ts(now), _ts(now), _ts(stale_before))) == 1
+        return None if claimed else self.get_upload(digest)
+
+    def finish_upload(self, digest, status, url, error, now):
+        self._execute("UPDATE uploads SET status = ?, url = ?, error = ?, updated_at = ? WHERE digest = ?",
+                      (status, url, error, _ts(now), digest))
+
+    def stats(self):
+        return dict(self._stats, backend=self.backend, path=self.path, pending_writes=self._queue.qsize())
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def postgres_config():
+    """psycopg2 connection settings from the PG_* environment variables."""
+    return {
+        'dbname': os.environ.get('PG_DBNAME', 'discord_bot'),
+        'user': os.environ.get('PG_USER', 'admin'),
+        'password': os.environ.get('PG_PASSWORD', 'password'),
+        'host': os.environ.get('PG_HOST', 'localhost'),
+        'port': os.environ.get('PG_PORT', '5432')
+    }
+
+
+def open_storage(db_config=None):
+    """Build the backend named by STORAGE_BACKEND (default "postgres")."""
+    backend = os.environ.get("STORAGE_BACKEND", "postgres").lower()
+    if backend == "sqlite":
+        data_dir = os.environ.get("RENDER_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+        return SQLiteStorage(os.environ.get("SQLITE_PATH", os.path.join(data_dir, "analytics.db")))
+    if backend == "postgres":
+        return PostgresStorage(db_config or postgres_config())
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'")
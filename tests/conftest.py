@@ -0,0 +1,21 @@
+import os
+import sys
+import time
+
+import pytest
+
+# The modules live at the repository root, not in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def wait_until():
+    """Poll `predicate` until it is true or `timeout` seconds pass; returns its last value."""
+    def wait(predicate, timeout=2.0, interval=0.01):
+        deadline = time.monotonic() + timeout
+        while True:
+            value = predicate()
+            if value or time.monotonic() >= deadline:
+                return value
+            time.sleep(interval)
+    return wait
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, suspension_reason
+from ratelimit import RateLimited
+
+TOKEN = "Bot t"
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker(transient_threshold=3, permanent_threshold=2, backoff=0.05, permanent_probe=0.05, backoff_max=10)
+
+
+def state(breaker, channel=None):
+    entries = [c for c in breaker.snapshot() if c["channel"] == channel]
+    return entries[0]["state"] if entries else CLOSED
+
+
+def fail(breaker, channel, times, **outcome):
+    for _ in range(times):
+        breaker.check(TOKEN, channel)
+        breaker.record(TOKEN, channel, **outcome)
+
+
+def test_permanent_errors_open_after_threshold(breaker):
+    fail(breaker, "1", 1, status=404)
+    breaker.check(TOKEN, "1")
+    breaker.record(TOKEN, "1", 404)
+    with pytest.raises(CircuitOpen) as e:
+        breaker.check(TOKEN, "1")
+    assert (e.value.scope, e.value.permanent) == ("channel", True)
+    assert "404" in e.value.reason
+    breaker.check(TOKEN, "2")
+
+
+def test_401_opens_the_token(breaker):
+    fail(breaker, "1", 2, status=401)
+    with pytest.raises(CircuitOpen) as e:
+        breaker.check(TOKEN, "2")
+    assert e.value.scope == "token"
+    breaker.check("Bot other", "2")
+
+
+def test_transient_errors_need_more_failures(breaker):
+    fail(breaker, "1", 2, status=503)
+    breaker.check(TOKEN, "1")
+    breaker.record(TOKEN, "1", error=TimeoutError("timed out"))
+    with pytest.raises(CircuitOpen) as e:
+        breaker.check(TOKEN, "1")
+    assert e.value.permanent is False
+
+
+def test_success_resets_the_failure_count(breaker):
+    fail(breaker, "1", 1, status=404)
+    fail(breaker, "1", 1, status=200)
+    fail(breaker, "1", 1, status=404)
+    breaker.check(TOKEN, "1")
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success(breaker):
+    fail(breaker, "1", 2, status=404)
+    assert state(breaker, "1") == OPEN
+    time.sleep(0.06)
+    breaker.check(TOKEN, "1")
+    assert state(breaker, "1") == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.check(TOKEN, "1")
+    breaker.record(TOKEN, "1", 200)
+    assert state(breaker, "1") == CLOSED
+    breaker.check(TOKEN, "1")
+
+
+def test_failed_probe_reopens_with_doubled_backoff(breaker):
+    fail(breaker, "1", 2, status=404)
+    time.sleep(0.06)
+    breaker.check(TOKEN, "1")
+    breaker.record(TOKEN, "1", 404)
+    entry = breaker.snapshot()[0]
+    assert (entry["state"], entry["opens"]) == (OPEN, 2)
+    assert 0.05 < entry["retry_after"] <= 0.1
+
+
+def test_unsent_probe_frees_the_slot(breaker):
+    fail(breaker, "1", 2, status=404)
+    time.sleep(0.06)
+    breaker.check(TOKEN, "1")
+    breaker.record(TOKEN, "1")  # rate limited, never reached Discord
+    breaker.check(TOKEN, "1")
+
+
+def test_suspension_reason_needs_every_channel_cut_off():
+    cut = CircuitOpen("channel", "unknown channel (HTTP 404)", 30, True)
+    sooner = CircuitOpen("token", "token rejected (HTTP 401)", 5, True)
+    assert suspension_reason({"1": cut, "2": sooner}) == "token rejected (HTTP 401)"
+    assert suspension_reason({"1": cut, "2": True}) is None
+    assert suspension_reason({"1": cut, "2": RateLimited(1)}) is None
+    assert suspension_reason({}) is None
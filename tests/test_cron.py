@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+
+from scheduler import CronSchedule
+
+T0 = datetime(2026, 1, 1, 12, 0, 30).timestamp()
+
+
+def minute_after(ts):
+    return (int(ts) // 60 + 1) * 60
+
+
+def test_cron_rejects_invalid_expression():
+    with pytest.raises(ValueError):
+        CronSchedule("not a cron")
+
+
+def test_cron_next_after_steps_forward():
+    cron = CronSchedule("* * * * *", start=T0)
+    assert cron.next_after(T0) == minute_after(T0)
+    assert cron.next_after(T0 + 10 * 60) == minute_after(T0 + 10 * 60)
+
+
+def test_cron_catches_up_past_max_by_resetting():
+    cron = CronSchedule("* * * * *", start=T0)
+    cron.next_after(T0)
+    later = T0 + (CronSchedule.MAX_CATCH_UP * 10) * 60
+    assert cron.next_after(later) == minute_after(later)
+    # Back in step afterwards.
+    assert cron.next_after(later + 60) == minute_after(later + 60)
+
+
+def test_cron_resets_when_asked_about_the_past():
+    cron = CronSchedule("* * * * *", start=T0)
+    cron.next_after(T0 + 3600)
+    assert cron.next_after(T0 - 3600) == minute_after(T0 - 3600)
+
+
+def test_cron_upcoming():
+    cron = CronSchedule("*/5 * * * *", start=T0)
+    first = minute_after(T0) + 4 * 60
+    assert cron.upcoming(3, T0) == [first, first + 300, first + 600]
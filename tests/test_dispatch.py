@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from dispatch import Dispatcher, parse_weights
+from scheduler import Scheduler
+
+
+def run_queued(dispatcher, submissions):
+    """Hold the only slot while `submissions` [(owner, cost)] queue up, then return the order they ran in."""
+    gate, order = threading.Event(), []
+    blocker = dispatcher.submit("blocker", lambda: gate.wait(2))
+    futures = [dispatcher.submit(owner, lambda owner=owner: order.append(owner), cost) for owner, cost in submissions]
+    gate.set()
+    blocker.result(2)
+    for future in futures:
+        future.result(2)
+    return "".join(order)
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher(concurrency=1, weights={})
+    yield dispatcher
+    dispatcher.close()
+
+
+def test_owners_take_turns(dispatcher):
+    order = run_queued(dispatcher, [("a", 1)] * 6 + [("b", 1)] * 3)
+    assert order == "ababab" + "aaa"
+
+
+def test_weights_give_more_turns(dispatcher):
+    dispatcher.set_weight("b", 2)
+    order = run_queued(dispatcher, [("a", 1)] * 4 + [("b", 1)] * 4)
+    assert order == "abbabbaa"
+
+
+def test_expensive_sends_wait_for_their_deficit():
+    dispatcher = Dispatcher(concurrency=2, weights={})
+    try:
+        order = run_queued(dispatcher, [("a", 2)] * 2 + [("b", 1)] * 4)
+    finally:
+        dispatcher.close()
+    # a needs two turns of deficit per send: b goes first, but a is not pushed to the end.
+    assert order[0] == "b" and order.count("b") == 4
+    assert order.rindex("a") < len(order) - 1
+
+
+def test_results_and_errors_come_back_on_the_future(dispatcher):
+    assert dispatcher.submit("a", lambda: 42).result(2) == 42
+    with pytest.raises(ZeroDivisionError):
+        dispatcher.submit("a", lambda: 1 / 0).result(2)
+    assert dispatcher.stats()["failed"] == 1
+
+
+def test_close_cancels_queued_sends():
+    dispatcher = Dispatcher(concurrency=1, weights={})
+    gate = threading.Event()
+    dispatcher.submit("a", lambda: gate.wait(2))
+    queued = dispatcher.submit("b", lambda: None)
+    dispatcher.close()
+    gate.set()
+    assert queued.cancelled()
+    with pytest.raises(RuntimeError):
+        dispatcher.submit("a", lambda: None)
+
+
+def test_parse_weights():
+    assert parse_weights("7:2, vip:0.5,bad,:3") == {7: 2.0, "vip": 0.5}
+    assert parse_weights(None) == {}
+
+
+def test_cancelled_dispatch_stops_the_job(wait_until):
+    dispatcher = Dispatcher(concurrency=1)
+    scheduler = Scheduler(dispatch=lambda key, action, cost: dispatcher.submit("owner", action, cost))
+    gate = threading.Event()
+    scheduler.add("busy", lambda: gate.wait(2), interval=3600)
+    assert wait_until(lambda: dispatcher.stats()["in_use"] == 1)
+    scheduler.add("queued", lambda: None, interval=3600)
+    assert wait_until(lambda: dispatcher.stats()["queued"] == 1)
+    dispatcher.close()
+    gate.set()
+    assert wait_until(lambda: not scheduler.is_scheduled("queued"))
+    assert wait_until(lambda: not scheduler._jobs["busy"].in_flight)
+    scheduler.cancel("busy")
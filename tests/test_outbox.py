@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from dispatch import Dispatcher
+from outbox import OutboxWorker
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "outbox.db"))
+    storage.migrate()
+    return storage
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher(concurrency=2, weights={})
+    yield dispatcher
+    dispatcher.close()
+
+
+def make_worker(storage, dispatcher, deliver, owner):
+    worker = OutboxWorker(storage, deliver, dispatcher, batch=10, lease=0.2, poll=0.05, max_attempts=3)
+    worker._owner = owner
+    return worker
+
+
+def test_delivered_tick_is_done(storage, dispatcher, wait_until):
+    worker = make_worker(storage, dispatcher, lambda user_id, profile_name: (1, None), "a")
+    storage.enqueue_send(1, "p", datetime.now(), 1, datetime.now())
+    assert len(worker.claim(10)) == 1
+    assert wait_until(lambda: worker.stats()["done"] == 1)
+    worker.close()
+    assert storage.outbox_stats(datetime.now()).get("done") == 1
+
+
+def test_rate_limited_tick_goes_back_to_pending(storage, dispatcher, wait_until):
+    worker = make_worker(storage, dispatcher, lambda user_id, profile_name: (0, 30.0), "a")
+    storage.enqueue_send(1, "p", datetime.now(), 1, datetime.now())
+    worker.claim(10)
+    assert wait_until(lambda: worker.stats()["retried"] == 1)
+    worker.close()
+    assert storage.outbox_stats(datetime.now()).get("pending") == 1
+    assert storage.claim_outbox("b", datetime.now(), datetime.now() + timedelta(seconds=1), 10, 3) == []
+
+
+def test_crashed_send_is_taken_over_after_its_lease(storage, dispatcher, wait_until):
+    def crash(user_id, profile_name):
+        raise RuntimeError("sender died")
+
+    crashed = make_worker(storage, dispatcher, crash, "a")
+    storage.enqueue_send(1, "p", datetime.now(), 1, datetime.now())
+    crashed.claim(10)
+    assert wait_until(lambda: crashed.stats()["errors"] == 1)
+    survivor = make_worker(storage, dispatcher, lambda user_id, profile_name: (1, None), "b")
+    assert survivor.claim(10) == []
+    assert wait_until(lambda: survivor.claim(10), timeout=1)
+    assert wait_until(lambda: survivor.stats()["done"] == 1)
+    survivor.close()
+    crashed.close()
+    assert storage.outbox_stats(datetime.now()).get("done") == 1
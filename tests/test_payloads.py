@@ -0,0 +1,105 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import discord_client
+import payloads
+import sender
+from payloads import AttachmentCache, CompiledProfile, _Template
+
+
+@pytest.mark.parametrize("value", ['quote " and backslash \\', "new\nline\ttab", "unicode é ✓", "</script>", "{now}"])
+def test_template_escapes_slot_values(monkeypatch, value):
+    monkeypatch.setitem(payloads.PLACEHOLDERS, "now", lambda: value)
+    template = _Template({"content": 'at "{now}" and {now}', "tts": False})
+    assert json.loads(template.render()) == {"content": f'at "{value}" and {value}', "tts": False}
+
+
+def test_template_without_slots_is_plain_json():
+    document = {"content": "no <slot:now> here", "embeds": [{"title": "t"}]}
+    assert json.loads(_Template(document).render()) == document
+    assert _Template(document).slots == []
+
+
+def test_template_fills_nested_slots(monkeypatch):
+    monkeypatch.setitem(payloads.PLACEHOLDERS, "now", lambda: "NOW")
+    template = _Template({"embeds": [{"title": "{now}", "fields": [{"value": "x{now}y"}]}]})
+    assert json.loads(template.render()) == {"embeds": [{"title": "NOW", "fields": [{"value": "xNOWy"}]}]}
+
+
+def test_mapped_attachments_are_bounded(tmp_path):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"{i}.bin"
+        path.write_bytes(b"x" * 10)
+        paths.append(str(path))
+    cache = AttachmentCache(resolve_local=lambda source: source, max_mapped=2)
+    held = cache.get(paths[0])
+    for path in paths:
+        cache.get(path)
+    stats = cache.stats()
+    assert stats["mapped_files"] == 2 and stats["evictions"] == 3
+    # An evicted map stays readable for whoever still holds it.
+    assert held[:2] == b"xx"
+
+
+def test_compiled_headers_identify_the_bot():
+    profile = CompiledProfile("Bot t", "1, 2", [{"type": "text", "content": "hi"}], AttachmentCache())
+    headers, body = profile.pick().render()
+    assert headers["User-Agent"].startswith("DiscordBot (")
+    assert headers["Authorization"] == "Bot t"
+    assert profile.channel_ids == ["1", "2"]
+    assert json.loads(body)["content"] == "hi"
+
+
+# --- ATTACHMENT UPLOADS ---
+@pytest.fixture
+def uploads(monkeypatch):
+    """A local Discord stand-in; returns the list of multipart bodies it received."""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(self.rfile.read(int(self.headers["Content-Length"])))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pool = discord_client.ConnectionPool(f"http://127.0.0.1:{server.server_port}", timeout=5)
+    monkeypatch.setattr(discord_client, "_pool", pool)
+    yield received
+    pool.close()
+    server.shutdown()
+    server.server_close()
+
+
+def attachment_profile(tmp_path, token, channel_id):
+    path = tmp_path / "file.bin"
+    path.write_bytes(bytes(range(256)) * 64)
+    cache = AttachmentCache(resolve_local=lambda source: source)
+    return CompiledProfile(token, channel_id, [{"type": "attachment", "path": str(path)}], cache), path.read_bytes()
+
+
+def test_mapped_attachment_is_sent_whole_every_time(tmp_path, uploads):
+    profile, data = attachment_profile(tmp_path, "repeat-token", "1")
+    message = profile.pick()
+    for _ in range(2):
+        assert sender.send_to_channels(profile.channel_ids, profile.token, message) == {"1": True}
+    assert len(uploads) == 2
+    assert all(data in body for body in uploads)
+
+
+def test_mapped_attachment_fans_out_whole_to_every_channel(tmp_path, uploads):
+    profile, data = attachment_profile(tmp_path, "fanout-token", "1, 2")
+    assert sender.send_to_channels(profile.channel_ids, profile.token, profile.pick()) == {"1": True, "2": True}
+    assert len(uploads) == 2
+    assert all(data in body for body in uploads)
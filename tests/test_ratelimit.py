@@ -0,0 +1,70 @@
+import json
+import time
+from collections import namedtuple
+
+import pytest
+
+from ratelimit import MESSAGE_ROUTE, RateLimited, RateLimiter
+
+Resp = namedtuple("Resp", ["status", "headers", "body"])
+
+
+def limited(remaining, reset_after, bucket="abc"):
+    return Resp(200, {"X-RateLimit-Bucket": bucket, "X-RateLimit-Limit": "5", "X-RateLimit-Remaining": str(remaining),
+                      "X-RateLimit-Reset-After": str(reset_after)}, b"{}")
+
+
+def too_many(retry_after, is_global=False):
+    return Resp(429, {}, json.dumps({"retry_after": retry_after, "global": is_global}).encode())
+
+
+def test_acquire_is_free_for_unknown_buckets():
+    assert RateLimiter().acquire("t", MESSAGE_ROUTE, "1") == 0
+
+
+def test_empty_bucket_makes_the_next_send_wait():
+    limiter = RateLimiter()
+    limiter.update("t", MESSAGE_ROUTE, "1", limited(0, 5))
+    assert 4 < limiter.acquire("t", MESSAGE_ROUTE, "1") <= 5
+    # Buckets are per channel.
+    assert limiter.acquire("t", MESSAGE_ROUTE, "2") == 0
+    with pytest.raises(RateLimited) as e:
+        limiter.send("t", MESSAGE_ROUTE, "1", lambda: pytest.fail("sent while limited"))
+    assert e.value.scope == "preemptive"
+
+
+def test_bucket_refills_after_reset():
+    limiter = RateLimiter()
+    limiter.update("t", MESSAGE_ROUTE, "1", limited(0, 0.05))
+    time.sleep(0.06)
+    assert limiter.acquire("t", MESSAGE_ROUTE, "1") == 0
+
+
+def test_send_waits_out_a_short_limit_within_max_wait():
+    limiter = RateLimiter()
+    limiter.update("t", MESSAGE_ROUTE, "1", limited(0, 0.05))
+    assert limiter.send("t", MESSAGE_ROUTE, "1", lambda: limited(4, 1), max_wait=1).status == 200
+
+
+def test_bucket_429_raises_and_blocks_the_channel():
+    limiter = RateLimiter()
+    with pytest.raises(RateLimited) as e:
+        limiter.send("t", MESSAGE_ROUTE, "1", lambda: too_many(2.5))
+    assert (e.value.retry_after, e.value.scope) == (2.5, "bucket")
+    assert limiter.acquire("t", MESSAGE_ROUTE, "1") > 2
+    assert limiter.acquire("t", MESSAGE_ROUTE, "2") == 0
+
+
+def test_global_429_blocks_every_channel_of_the_token():
+    limiter = RateLimiter()
+    with pytest.raises(RateLimited) as e:
+        limiter.send("t", MESSAGE_ROUTE, "1", lambda: too_many(1, is_global=True))
+    assert e.value.scope == "global"
+    assert limiter.acquire("t", MESSAGE_ROUTE, "2") > 0
+    assert limiter.acquire("other", MESSAGE_ROUTE, "2") == 0
+
+
+def test_global_limit_per_second():
+    limiter = RateLimiter(global_limit=2)
+    assert [limiter.acquire("t", MESSAGE_ROUTE, str(i)) for i in range(2)] == [0, 0]
+    assert limiter.acquire("t", MESSAGE_ROUTE, "3") > 0
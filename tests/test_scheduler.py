@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import Scheduler
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(max_workers=4)
+    yield scheduler
+    for key in scheduler.keys():
+        scheduler.cancel(key)
+
+
+def test_numeric_retry_after_requeues_early(scheduler, wait_until):
+    calls = []
+
+    def action():
+        calls.append(time.time())
+        return 0.05 if len(calls) == 1 else None
+
+    scheduler.add("k", action, interval=3600)
+    assert wait_until(lambda: len(calls) == 2)
+    assert calls[1] - calls[0] < 1
+    assert wait_until(lambda: scheduler.next_run("k") > time.time() + 3000)
+
+
+@pytest.mark.parametrize("result", [True, False, float("nan")])
+def test_bool_and_nan_results_are_not_retries(scheduler, wait_until, result):
+    calls = []
+    scheduler.add("k", lambda: calls.append(1) or result, interval=3600)
+    assert wait_until(lambda: calls and scheduler.next_run("k") > time.time() + 3000)
+    time.sleep(0.1)
+    assert len(calls) == 1
+
+
+def test_negative_retry_after_runs_again_at_once(scheduler, wait_until):
+    calls = []
+    scheduler.add("k", lambda: calls.append(1) or (-5 if len(calls) == 1 else None), interval=3600)
+    assert wait_until(lambda: len(calls) == 2)
+
+
+def test_in_flight_job_is_not_fired_twice(scheduler, wait_until):
+    gate, calls = threading.Event(), []
+
+    def action():
+        calls.append(1)
+        gate.wait(2)
+
+    scheduler.add("k", action, interval=3600)
+    assert wait_until(lambda: calls)
+    scheduler.reschedule("k", time.time())
+    time.sleep(0.2)
+    assert len(calls) == 1
+    gate.set()
+    assert wait_until(lambda: scheduler.next_run("k") > time.time() + 3000)
+    assert len(calls) == 1
@@ -0,0 +1,11 @@
+import sender
+from payloads import AttachmentCache, CompiledProfile
+
+
+def test_render_failure_fails_every_channel(tmp_path):
+    missing = str(tmp_path / "gone.bin")
+    profile = CompiledProfile("render-token", "1, 2", [{"type": "attachment", "path": missing}],
+                              AttachmentCache(resolve_local=lambda source: source))
+    results, retry_after = sender.send_profile(profile)
+    assert results == {"1": False, "2": False}
+    assert retry_after is None
@@ -0,0 +1,102 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from storage import SQLiteStorage
+
+NOW = datetime(2026, 1, 1, 12, 0, 0)
+PROFILE = {"token": "t", "channelid": "1", "schedule_mode": "interval", "interval_seconds": 60,
+           "cron_expression": "", "messages": [], "jitter_seconds": 0}
+
+
+def columns(path, table):
+    with sqlite3.connect(path) as conn:
+        return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+# --- MIGRATIONS ---
+def test_migrates_the_legacy_analytics_db(tmp_path):
+    path = str(tmp_path / "analytics.db")
+    with sqlite3.connect(path) as conn:
+        # The single table the original app created.
+        conn.execute("CREATE TABLE sends (id INTEGER PRIMARY KEY, user_id TEXT, profile_name TEXT, timestamp DATETIME, success BOOLEAN)")
+        conn.executemany("INSERT INTO sends (user_id, profile_name, timestamp, success) VALUES (?, ?, ?, ?)",
+                         [("1", "p", "2025-01-01 10:05:00", 1), ("1", "p", "2025-01-01 10:45:00", 0),
+                          ("1", "p", "2025-01-01 11:00:00", 1)])
+    storage = SQLiteStorage(path)
+    assert storage.migrate() == [1, 2, 3, 4]
+    assert "channel_id" in columns(path, "sends")
+    assert "jitter_seconds" in columns(path, "profiles")
+    assert "lease_until" in columns(path, "outbox")
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM sends").fetchone()[0] == 3
+        assert conn.execute("SELECT hour, success_count, failure_count FROM send_rollups ORDER BY hour").fetchall() == [
+            ("2025-01-01 10:00:00", 1, 1), ("2025-01-01 11:00:00", 1, 0)]
+    assert storage.migrate() == []
+    assert SQLiteStorage(path).migrate() == []
+
+
+def test_migrates_an_empty_database(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "new.db"))
+    assert storage.migrate() == [1, 2, 3, 4]
+    assert storage.create_user("u", "hash", PROFILE) is not None
+
+
+# --- OUTBOX ---
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "outbox.db"))
+    storage.migrate()
+    return storage
+
+
+def lease(seconds):
+    return NOW + timedelta(seconds=seconds)
+
+
+def test_one_outstanding_tick_per_profile(storage):
+    assert storage.enqueue_send(1, "p", NOW, 1, NOW)
+    assert not storage.enqueue_send(1, "p", NOW, 1, NOW)
+    assert storage.enqueue_send(1, "q", NOW, 1, NOW)
+
+
+def test_ticks_are_claimed_once_when_due(storage):
+    storage.enqueue_send(1, "p", lease(30), 2, NOW)
+    assert storage.claim_outbox("a", NOW, lease(60), 10, 5) == []
+    claimed = storage.claim_outbox("a", lease(30), lease(90), 10, 5)
+    assert [(user_id, name, cost) for _, user_id, name, _, cost in claimed] == [(1, "p", 2)]
+    assert storage.claim_outbox("b", lease(31), lease(91), 10, 5) == []
+
+
+def test_expired_lease_is_reclaimed_and_the_old_owner_cannot_finish(storage):
+    storage.enqueue_send(1, "p", NOW, 1, NOW)
+    (id, *_), = storage.claim_outbox("a", NOW, lease(60), 10, 5)
+    assert storage.claim_outbox("b", lease(59), lease(119), 10, 5) == []
+    assert [row[0] for row in storage.claim_outbox("b", lease(61), lease(121), 10, 5)] == [id]
+    storage.finish_outbox([(id, "a", "done", None, 1, None)], lease(62))
+    assert storage.outbox_stats(lease(62))["leased"] == 1
+    storage.finish_outbox([(id, "b", "done", None, 1, None)], lease(63))
+    stats = storage.outbox_stats(lease(63))
+    assert stats.get("leased") is None and stats["done"] == 1
+
+
+def test_tick_fails_after_max_attempts(storage):
+    storage.enqueue_send(1, "p", NOW, 1, NOW)
+    for attempt in range(2):
+        assert storage.claim_outbox(f"w{attempt}", lease(attempt * 100), lease(attempt * 100 + 60), 10, 2)
+    assert storage.claim_outbox("w2", lease(300), lease(360), 10, 2) == []
+    assert storage.outbox_stats(lease(300))["failed"] == 1
+    # The profile can be queued again once its tick has failed.
+    assert storage.enqueue_send(1, "p", lease(300), 1, lease(300))
+
+
+def test_retry_puts_the_tick_back_and_done_counts_sends(storage):
+    storage.claim_run(1, "p", "a", NOW, NOW)
+    storage.enqueue_send(1, "p", NOW, 1, NOW)
+    (id, *_), = storage.claim_outbox("a", NOW, lease(60), 10, 5)
+    storage.finish_outbox([(id, "a", "pending", lease(10), None, None)], NOW)
+    assert storage.claim_outbox("a", lease(5), lease(65), 10, 5) == []
+    (id, *_), = storage.claim_outbox("a", lease(10), lease(70), 10, 5)
+    updated = storage.finish_outbox([(id, "a", "done", None, 3, None)], lease(11))
+    assert [(user_id, name, sent) for user_id, name, _, _, sent, _ in updated] == [(1, "p", 3)]
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Attachment uploads, deduplicated by content hash.
+
+The request body is streamed to a spool file in chunks and hashed with
+SHA-256 as it arrives. If that hash has been uploaded before, the stored
+URL is returned immediately. Otherwise a background job pushes the file
+to the upload backend, and callers poll `status(digest)` until it is done.
+
+The uploads table (through the storage backend) records every hash, so
+deduplication and status work across workers and restarts. An upload
+left "pending" by a worker that died is picked up again after
+`stale_after` seconds.
+
+Backends:
+- CloudinaryBackend: the production store.
+- LocalDiskBackend: files under a directory, served by the app; stands in
+  for Cloudinary on single nodes and in tests.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+log = logging.getLogger("discordbot")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def safe_filename(filename):
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", os.path.basename(filename or "")).strip("._")
+    return name[:100] or "file"
+
+
+class CloudinaryBackend:
+    name = "cloudinary"
+
+    def store(self, path, filename, digest, progress):
+        import cloudinary.uploader
+        # The digest as public_id makes a retried push land on the same asset.
+        result = cloudinary.uploader.upload_large(path, resource_type="auto", public_id=digest, overwrite=False,
+                                                  filename=filename, chunk_size=6 * CHUNK_SIZE)
+        progress(os.path.getsize(path))
+        return result["secure_url"]
+
+
+class LocalDiskBackend:
+    name = "local"
+
+    def __init__(self, directory, url_prefix="/uploads/"):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, url):
+        """Map a URL returned by `store` back to the file on disk, or None if it is not ours."""
+        if not url or not url.startswith(self.url_prefix):
+            return None
+        name = os.path.basename(url[len(self.url_prefix):])
+        return os.path.join(self.directory, name)
+
+    def store(self, path, filename, digest, progress):
+        name = f"{digest[:32]}_{filename}"
+        target = os.path.join(self.directory, name)
+        if not os.path.exists(target):
+            partial, done = target + ".part", 0
+            with open(path, "rb") as src, open(partial, "wb") as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    dst.write(chunk)
+                    done += len(chunk)
+                    progress(done)
+            os.replace(partial, target)
+        return self.url_prefix + name
+
+
+def open_backend(upload_dir):
+    """Build the backend named by UPLOAD_BACKEND ("cloudinary", the default, or "local")."""
+    backend = os.environ.get("UPLOAD_BACKEND", "cloudinary").lower()
+    if backend == "local":
+        return LocalDiskBackend(upload_dir)
+    if backend == "cloudinary":
+        return CloudinaryBackend()
+    raise ValueError(f"Unknown UPLOAD_BACKEND '{backend}'")
+
+
+class UploadManager:
+    def __init__(self, storage, backend, spool_dir, workers=None, stale_after=600):
+        self.storage = storage
+        self.backend = backend
+        self.spool_dir = spool_dir
+        self.stale_after = stale_after
+        self._executor = ThreadPoolExecutor(max_workers=workers or int(os.environ.get("UPLOAD_WORKERS", 2)),
+                                            thread_name_prefix="upload")
+        self._lock = threading.Lock()
+        self._jobs = {}  # digest -> in-process progress for uploads running here
+        self._stats = {"received": 0, "deduplicated": 0, "uploaded": 0, "failed": 0, "bytes_received": 0}
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def _spool(self, stream):
+        """Copy `stream` to a spool file in chunks, hashing as it goes. Returns (path, digest, size)."""
+        digest, size = hashlib.sha256(), 0
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as spool:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    spool.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            os.unlink(path)
+            raise
+        return path, digest.hexdigest(), size
+
+    def ingest(self, stream, filename):
+        """Store an uploaded file. Returns its status dict (see `status`)."""
+        filename = safe_filename(filename)
+        path, digest, size = self._spool(stream)
+        with self._lock:
+            self._stats["received"] += 1
+            self._stats["bytes_received"] += size
+        now = datetime.now()
+        row = self.storage.claim_upload(digest, filename, size, now, now - timedelta(seconds=self.stale_after))
+        if row is not None:
+            # Already uploaded, or being uploaded by another request.
+            os.unlink(path)
+            with self._lock:
+                self._stats["deduplicated"] += 1
+            return self.status(digest)
+        with self._lock:
+            self._jobs[digest] = {"done_bytes": 0}
+        self._executor.submit(self._push, path, filename, digest, size)
+        return self.status(digest)
+
+    def _push(self, path, filename, digest, size):
+        def progress(done):
+            with self._lock:
+                self._jobs[digest]["done_bytes"] = done
+
+        try:
+            url = self.backend.store(path, filename, digest, progress)
+            self.storage.finish_upload(digest, "done", url, None, datetime.now())
+            with self._lock:
+                self._stats["uploaded"] += 1
+            log.info(f"Uploaded {filename} ({size} bytes, sha256 {digest[:12]}) to {self.backend.name}.")
+        except Exception as e:
+            log.error(f"Upload of {filename} to {self.backend.name} failed: {e}")
+            self.storage.finish_upload(digest, "failed", None, str(e), datetime.now())
+            with self._lock:
+                self._stats["failed"] += 1
+        finally:
+            with self._lock:
+                self._jobs.pop(digest, None)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def status(self, digest):
+        """{"id", "status" (pending|done|failed), "filepath", "filename", "size", "progress", "error"} or None."""
+        row = self.storage.get_upload(digest)
+        if row is None:
+            return None
+        with self._lock:
+            job = self._jobs.get(digest)
+            done_bytes = job["done_bytes"] if job is not None else None
+        if row["status"] == "done":
+            progress = 1.0
+        elif done_bytes is not None and row["size"]:
+            progress = round(done_bytes / row["size"], 3)
+        else:
+            progress = 0.0
+        return {"id": digest, "status": row["status"], "filepath": row["url"], "filename": row["filename"],
+                "size": row["size"], "progress": progress, "error": row["error"]}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, backend=self.backend.name, in_progress=len(self._jobs))
+
+    def close(self):
+        self._executor.shutdown(wait=True)